@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 """
-Delete files from an S3 bucket. Two source modes:
+Delete files from an S3 bucket. Four source modes:
 
 1. Bucket scan: list objects matching `-p PREFIX` and `-s SEARCH`
    (substring; pass `-r` to use regex), then delete matches.
 2. From-file: read a newline-delimited list of exact keys from
    `-f FILE` and delete those specific paths.
+3. Garbage collection (`--gc`): list everything under `data/` (or
+   `-p PREFIX`) and delete objects that the live `data/datasets.json`
+   manifest doesn't reference, optionally only those older than
+   `--min-age-days` and at least `--min-size` bytes.
+4. Version purge (`--purge-versions`): on a versioned bucket, stream
+   `list_object_versions` under `-p PREFIX` and delete noncurrent
+   versions and delete markers (optionally only those noncurrent for at
+   least `--min-age-days`, and versions of at least `--min-size` bytes).
+   Current versions are never touched. A delete marker that is the
+   current version is only removed, in a final pass, once every older
+   version of its key has been deleted, so no deleted file reappears.
 
 Mirrors aws_download.py conventions for credentials and anonymous access.
 
@@ -23,31 +34,38 @@ Examples:
 
   # Delete a specific list of keys from a file (one path per line)
   %(prog)s -b www.olmstedviz.org -f /tmp/orphans.txt --confirm
+
+  # Preview data files no longer referenced by datasets.json and > 30 days old
+  %(prog)s -b www.olmstedviz.org --gc --min-age-days 30
+
+  # Preview old versions of data files, noncurrent for over a week
+  %(prog)s -b www.olmstedviz.org --purge-versions -p data/ --min-age-days 7
 """
 
 import argparse
+import json
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-import boto3
-import yaml
+import olmsted_data
+import olmsted_filters
+import olmsted_session
+import olmsted_storage
 
 
 def load_credentials(creds_filename):
     """Load AWS credentials from YAML file."""
-    with open(creds_filename) as handle:
-        return yaml.load(handle, Loader=yaml.SafeLoader)
+    return olmsted_session.load_credentials(creds_filename)
 
 
 def create_s3_client(credentials=None):
     """Create S3 client with or without credentials."""
     if credentials:
-        return boto3.client("s3", **credentials)
-    from botocore import UNSIGNED
-    from botocore.config import Config
-
-    return boto3.client("s3", config=Config(signature_version=UNSIGNED))
+        return olmsted_session.client("s3", credentials)
+    return olmsted_session.client("s3", anonymous=True)
 
 
 def format_file_size(size):
@@ -59,37 +77,165 @@ def format_file_size(size):
     return f"{size:.2f} PB"
 
 
-def list_objects(client, bucket_name, prefix="", search_term=None, use_regex=False):
+def list_objects(
+    client, bucket_name, prefix="", search_term=None, use_regex=False, includes=None, excludes=None, case_sensitive=False
+):
     """List objects in `bucket_name` under `prefix`, optionally filtered.
+    Only the prefixes the filters can match are listed (see olmsted_filters).
 
     Returns a list of {Key, Size} dicts.
     """
-    pattern = None
-    if search_term and use_regex:
-        try:
-            pattern = re.compile(search_term, re.IGNORECASE)
-        except re.error as e:
-            print(f"Invalid regex pattern: {e}", file=sys.stderr)
-            sys.exit(2)
+    try:
+        key_filter = olmsted_filters.KeyFilter(prefix, search_term, use_regex, includes, excludes, case_sensitive)
+    except re.error as e:
+        print(f"Invalid regex pattern: {e}", file=sys.stderr)
+        sys.exit(2)
 
-    paginator = client.get_paginator("list_objects_v2")
     matched = []
     skipped = 0
+    for obj in key_filter.iter_listing(client, bucket_name):
+        key = obj["Key"]
+        if key.endswith("/"):
+            continue
+        if not key_filter.matches(key):
+            skipped += 1
+            continue
+        matched.append(obj)
+    return matched, skipped
+
+
+MANIFEST_KEY = "data/datasets.json"
+
+
+def load_manifest(client, bucket_name, manifest_file=None):
+    """Load the manifest entries from a local file, or else from the live
+    `data/datasets.json` in the bucket."""
+    if manifest_file:
+        with open(manifest_file) as handle:
+            return json.load(handle)
+    response = client.get_object(Bucket=bucket_name, Key=MANIFEST_KEY)
+    return json.loads(response["Body"].read())
+
+
+def manifest_references(entries):
+    """Return (keys, prefixes) the manifest keeps alive: the manifest
+    itself, each `consolidated_path` and `summary_path`, and each sharded
+    dataset's whole shard directory (`data/shards/<stem>/`).
+
+    `summary_path` and `shards` are only added to the manifest aws_deploy.py
+    uploads, not to a local build's datasets.json, so the summary and shard
+    directory aws_deploy.py would name after each `consolidated_path` are
+    kept too."""
+    keys = {MANIFEST_KEY}
+    prefixes = []
+    for entry in entries:
+        for field in ("consolidated_path", "summary_path"):
+            if entry.get(field):
+                keys.add(f"data/{entry[field]}")
+        if entry.get("consolidated_path"):
+            stem = olmsted_data.dataset_stem(entry["consolidated_path"])
+            keys.add(f"data/summaries/{stem}.summary.json")
+            prefixes.append(f"data/shards/{stem}/")
+        shards = entry.get("shards")
+        if shards and shards.get("header"):
+            prefixes.append("data/" + shards["header"].rsplit("/", 1)[0] + "/")
+    return keys, prefixes
+
+
+def find_orphans(client, bucket_name, prefix, keys, prefixes, min_age_days=None, min_size=None):
+    """Stream the listing under `prefix` and return (orphans, kept): the
+    unreferenced objects that pass the age/size filters, and how many
+    objects were kept (referenced or filtered out)."""
+    cutoff = None
+    if min_age_days is not None:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=min_age_days)
+    paginator = client.get_paginator("list_objects_v2")
+    orphans = []
+    kept = 0
     for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
         for obj in page.get("Contents", []):
             key = obj["Key"]
-            if key.endswith("/"):
+            if (
+                key.endswith("/")
+                or key in keys
+                or any(key.startswith(p) for p in prefixes)
+                or (cutoff is not None and obj["LastModified"] > cutoff)
+                or (min_size is not None and obj["Size"] < min_size)
+            ):
+                kept += 1
                 continue
-            if search_term:
-                if use_regex:
-                    if not pattern.search(key):
-                        skipped += 1
-                        continue
-                elif search_term.lower() not in key.lower():
-                    skipped += 1
-                    continue
-            matched.append(obj)
-    return matched, skipped
+            orphans.append(obj)
+    return orphans, kept
+
+
+def iter_key_versions(client, bucket_name, prefix=""):
+    """Stream `list_object_versions` under `prefix`, yielding (key,
+    versions) one key at a time: its versions and delete markers, newest
+    first, each a dict with Key, VersionId, IsLatest, LastModified, Size
+    (0 for delete markers) and DeleteMarker."""
+    paginator = client.get_paginator("list_object_versions")
+    key, versions = None, []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        # Each page lists versions and delete markers separately; merge
+        # them back into per-key, newest-first order.
+        entries = [dict(v, DeleteMarker=False) for v in page.get("Versions", [])]
+        entries += [dict(m, DeleteMarker=True, Size=0) for m in page.get("DeleteMarkers", [])]
+        entries.sort(key=lambda v: (v["Key"], not v["IsLatest"], -v["LastModified"].timestamp()))
+        for entry in entries:
+            if entry["Key"] != key:
+                if versions:
+                    yield key, versions
+                key, versions = entry["Key"], []
+            versions.append(entry)
+    if versions:
+        yield key, versions
+
+
+def select_noncurrent(versions, cutoff=None, min_size=None):
+    """The versions of one key (newest first) to purge: noncurrent
+    versions and delete markers that have been noncurrent since before
+    `cutoff` and (versions only) are at least `min_size` bytes.
+
+    A version becomes noncurrent when the next newer one is written, so
+    its age counts from then, as in S3 lifecycle rules. A current delete
+    marker hides its key; removing it would bring back the newest
+    remaining version, so it is only selected if every older version is,
+    and comes last (see `purge_versions`).
+    """
+    selected = []
+    newer = None
+    for version in versions:
+        if not version["IsLatest"]:
+            since = newer or version["LastModified"]
+            if (cutoff is None or since <= cutoff) and (
+                min_size is None or version["DeleteMarker"] or version["Size"] >= min_size
+            ):
+                selected.append(version)
+        newer = version["LastModified"]
+    latest = versions[0]
+    if (
+        latest["IsLatest"]
+        and latest["DeleteMarker"]
+        and len(selected) == len(versions) - 1
+        and (cutoff is None or latest["LastModified"] <= cutoff)
+    ):
+        selected.append(latest)
+    return selected
+
+
+def find_noncurrent_versions(client, bucket_name, prefix, min_age_days=None, min_size=None):
+    """Return (selected, kept): the versions and delete markers to purge
+    under `prefix`, and how many versions were kept."""
+    cutoff = None
+    if min_age_days is not None:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=min_age_days)
+    selected = []
+    kept = 0
+    for _key, versions in iter_key_versions(client, bucket_name, prefix):
+        chosen = select_noncurrent(versions, cutoff, min_size)
+        selected.extend(chosen)
+        kept += len(versions) - len(chosen)
+    return selected, kept
 
 
 def read_keys_from_file(path):
@@ -151,6 +297,32 @@ def print_keys_summary(keys, source_path):
     print()
 
 
+def print_versions_summary(versions):
+    """Print counts and sizes of the versions to purge, plus head/tail
+    samples."""
+    markers = sum(1 for v in versions if v["DeleteMarker"])
+    print(f"Found {len(versions) - markers} noncurrent versions and {markers} delete markers")
+    print(f"Total size: {format_file_size(sum(v['Size'] for v in versions))}\n")
+
+    def describe(version):
+        what = "delete marker" if version["DeleteMarker"] else format_file_size(version["Size"])
+        return f"  {version['Key']} [{version['VersionId']}] ({what})"
+
+    head = 10
+    tail = 5
+    if len(versions) <= head + tail:
+        for version in versions:
+            print(describe(version))
+    else:
+        for version in versions[:head]:
+            print(describe(version))
+        print(f"  … {len(versions) - head - tail} more …")
+        for version in versions[-tail:]:
+            print(describe(version))
+    if versions:
+        print()
+
+
 def delete_batch(client, bucket_name, keys):
     """Delete up to 1000 keys in a single DeleteObjects call (the S3 batch limit)."""
     response = client.delete_objects(
@@ -162,15 +334,77 @@ def delete_batch(client, bucket_name, keys):
     return deleted, errors
 
 
+def delete_versions_batch(client, bucket_name, versions):
+    """Delete up to 1000 specific versions (or delete markers) in one
+    DeleteObjects call."""
+    response = client.delete_objects(
+        Bucket=bucket_name,
+        Delete={"Objects": [{"Key": v["Key"], "VersionId": v["VersionId"]} for v in versions], "Quiet": False},
+    )
+    return len(response.get("Deleted", [])), response.get("Errors", [])
+
+
+def delete_all(client, bucket_name, items, delete_fn, threads):
+    """Delete `items` in batches of 1000 (the S3 limit) with `delete_fn`,
+    `threads` batches at a time. Returns (deleted, errors)."""
+    BATCH = 1000
+    batches = [items[i : i + BATCH] for i in range(0, len(items), BATCH)]
+    total_deleted = 0
+    done = 0
+    all_errors = []
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        futures = {pool.submit(delete_fn, client, bucket_name, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            deleted, errors = future.result()
+            total_deleted += deleted
+            all_errors.extend(errors)
+            done += len(futures[future])
+            print(f"  [{done}/{len(items)}] {total_deleted} deleted, {len(all_errors)} errors")
+    return total_deleted, all_errors
+
+
+def purge_versions(client, bucket_name, versions, threads):
+    """Delete the `versions` chosen by `select_noncurrent`. Noncurrent
+    versions go first; current delete markers only afterwards, and only
+    for keys whose selected versions were all deleted, since removing a
+    marker while an older version survives would bring that version
+    back. Returns (deleted, errors, markers kept)."""
+    markers = [v for v in versions if v["IsLatest"]]
+    older = [v for v in versions if not v["IsLatest"]]
+    total_deleted, all_errors = delete_all(client, bucket_name, older, delete_versions_batch, threads)
+    failed_keys = {error.get("Key") for error in all_errors}
+    safe = [marker for marker in markers if marker["Key"] not in failed_keys]
+    if safe:
+        deleted, errors = delete_all(client, bucket_name, safe, delete_versions_batch, threads)
+        total_deleted += deleted
+        all_errors.extend(errors)
+    return total_deleted, all_errors, len(markers) - len(safe)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("-b", "--bucket", required=True, help="S3 bucket name")
+    parser.add_argument(
+        "-b",
+        "--bucket",
+        required=True,
+        help="S3 bucket name (or s3://bucket), or file:///path/to/dir for a local target",
+    )
     parser.add_argument("-p", "--prefix", default="", help="Only consider keys with this prefix")
     parser.add_argument("-s", "--search", help="Filter keys by substring (case-insensitive)")
     parser.add_argument("-r", "--regex", action="store_true", help="Treat --search as a regex")
+    parser.add_argument(
+        "--case-sensitive",
+        action="store_true",
+        help=(
+            "Match --regex case-sensitively, so its literal prefix is listed exactly (by default it is only "
+            "pushed down up to its first letter)"
+        ),
+    )
+    parser.add_argument("--include", action="append", metavar="GLOB", help="Only keys matching this glob (repeatable)")
+    parser.add_argument("--exclude", action="append", metavar="GLOB", help="Skip keys matching this glob (repeatable)")
     parser.add_argument(
         "-f",
         "--from-file",
@@ -180,9 +414,48 @@ def main():
             "and #-prefixed comments are ignored."
         ),
     )
+    parser.add_argument(
+        "--gc",
+        action="store_true",
+        help=(
+            "Delete objects under data/ (or --prefix) that datasets.json does not reference. "
+            "Mutually exclusive with --search and --from-file."
+        ),
+    )
+    parser.add_argument(
+        "--purge-versions",
+        action="store_true",
+        help=(
+            "Delete noncurrent versions and delete markers under --prefix in a versioned bucket, "
+            "keeping current versions. Mutually exclusive with --search, --from-file and --gc."
+        ),
+    )
+    parser.add_argument(
+        "--manifest",
+        help="With --gc, read the manifest from this local file instead of data/datasets.json in the bucket",
+    )
+    parser.add_argument(
+        "--min-age-days",
+        type=float,
+        help=(
+            "With --gc, only delete objects last modified at least this many days ago; with "
+            "--purge-versions, only versions noncurrent for at least this many days"
+        ),
+    )
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        help="With --gc or --purge-versions, only delete objects (versions) of at least this many bytes",
+    )
     parser.add_argument("-c", "--creds", help="Path to AWS credentials YAML file")
     parser.add_argument("--anonymous", action="store_true", help="Access public bucket without credentials")
     parser.add_argument("--list-only", action="store_true", help="Only list matching files; do not delete")
+    parser.add_argument(
+        "--delete-threads",
+        type=int,
+        default=4,
+        help="Concurrent DeleteObjects requests of up to 1000 keys each (default: 4)",
+    )
     parser.add_argument(
         "--confirm",
         action="store_true",
@@ -191,18 +464,28 @@ def main():
 
     args = parser.parse_args()
 
-    if args.from_file and (args.prefix or args.search):
-        parser.error("--from-file is mutually exclusive with --prefix and --search")
-
-    if args.creds:
-        print(f"Loading credentials from: {args.creds}")
-        client = create_s3_client(load_credentials(args.creds))
-    elif args.anonymous:
-        print("Using anonymous access (public bucket)")
-        client = create_s3_client()
-    else:
+    if args.from_file and (args.prefix or args.search or args.include or args.exclude):
+        parser.error("--from-file is mutually exclusive with --prefix, --search, --include and --exclude")
+    if args.gc and (args.from_file or args.search or args.include or args.exclude):
+        parser.error("--gc is mutually exclusive with --from-file, --search, --include and --exclude")
+    if args.purge_versions and (args.gc or args.from_file or args.search or args.include or args.exclude):
+        parser.error("--purge-versions is mutually exclusive with --gc, --from-file, --search, --include and --exclude")
+    if not args.gc and args.manifest:
+        parser.error("--manifest only applies to --gc")
+    if not (args.gc or args.purge_versions) and (args.min_age_days is not None or args.min_size is not None):
+        parser.error("--min-age-days and --min-size only apply to --gc and --purge-versions")
+
+    def make_client():
+        if args.creds:
+            print(f"Loading credentials from: {args.creds}")
+            return create_s3_client(load_credentials(args.creds))
+        if args.anonymous:
+            print("Using anonymous access (public bucket)")
+            return create_s3_client()
         print("Using default AWS credentials")
-        client = boto3.client("s3")
+        return olmsted_session.client("s3")
+
+    client, args.bucket = olmsted_storage.connect(args.bucket, make_client)
 
     print(f"\nBucket: {args.bucket}")
 
@@ -210,16 +493,73 @@ def main():
         keys = read_keys_from_file(args.from_file)
         print()
         print_keys_summary(keys, args.from_file)
+    elif args.gc:
+        prefix = args.prefix or "data/"
+        source = args.manifest or f"{args.bucket}/{MANIFEST_KEY}"
+        try:
+            entries = load_manifest(client, args.bucket, args.manifest)
+        except (olmsted_storage.ClientError, OSError, ValueError) as e:
+            print(f"Can't read manifest {source}: {e}", file=sys.stderr)
+            hint = "" if args.manifest else "; pass --manifest FILE to read it from a local file"
+            print(f"Refusing to garbage-collect{hint}.", file=sys.stderr)
+            sys.exit(2)
+        if not entries:
+            # An empty manifest would make every data file an orphan.
+            print(f"Manifest {source} has no entries; refusing to garbage-collect.", file=sys.stderr)
+            sys.exit(2)
+        ref_keys, ref_prefixes = manifest_references(entries)
+        print(f"Manifest: {source} ({len(entries)} entries)")
+        print(f"Prefix: '{prefix}'")
+        if args.min_age_days is not None:
+            print(f"Older than: {args.min_age_days:g} days")
+        if args.min_size is not None:
+            print(f"At least: {format_file_size(args.min_size)}")
+        matched, kept = find_orphans(
+            client, args.bucket, prefix, ref_keys, ref_prefixes, args.min_age_days, args.min_size
+        )
+        print()
+        print(f"Kept {kept} referenced or filtered-out files; unreferenced:")
+        print_summary(matched, None, 0)
+        keys = [obj["Key"] for obj in matched]
+    elif args.purge_versions:
+        if isinstance(client, olmsted_storage.LocalS3Client):
+            print("file:// targets keep no versions; nothing to purge.")
+            return
+        print(f"Prefix: '{args.prefix}'")
+        if args.min_age_days is not None:
+            print(f"Noncurrent for at least: {args.min_age_days:g} days")
+        if args.min_size is not None:
+            print(f"At least: {format_file_size(args.min_size)}")
+        versions, kept = find_noncurrent_versions(
+            client, args.bucket, args.prefix, args.min_age_days, args.min_size
+        )
+        print()
+        print(f"Kept {kept} current or filtered-out versions; to purge:")
+        print_versions_summary(versions)
+        keys = versions  # {Key, VersionId, ...} dicts, deleted by version
     else:
         if args.prefix:
             print(f"Prefix: '{args.prefix}'")
         if args.search:
             kind = "regex" if args.regex else "substring"
             print(f"Filter ({kind}): '{args.search}'")
-
-        matched, _skipped = list_objects(client, args.bucket, args.prefix, args.search, args.regex)
+        for glob in args.include or []:
+            print(f"Include: '{glob}'")
+        for glob in args.exclude or []:
+            print(f"Exclude: '{glob}'")
+
+        matched, _skipped = list_objects(
+            client,
+            args.bucket,
+            args.prefix,
+            args.search,
+            args.regex,
+            args.include,
+            args.exclude,
+            args.case_sensitive,
+        )
         print()
-        print_summary(matched, args.search, _skipped)
+        print_summary(matched, args.search or args.include or args.exclude, _skipped)
         keys = [obj["Key"] for obj in matched]
 
     if args.list_only:
@@ -234,22 +574,20 @@ def main():
         print("Nothing to delete.")
         return
 
-    print(f"=== Deleting {len(keys)} files from {args.bucket} ===")
-    BATCH = 1000
-    total_deleted = 0
-    all_errors = []
-    for i in range(0, len(keys), BATCH):
-        batch = keys[i : i + BATCH]
-        deleted, errors = delete_batch(client, args.bucket, batch)
-        total_deleted += deleted
-        all_errors.extend(errors)
-        print(f"  [{min(i + BATCH, len(keys))}/{len(keys)}] {total_deleted} deleted, {len(all_errors)} errors")
-
+    if args.purge_versions:
+        print(f"=== Purging {len(keys)} versions from {args.bucket} ===")
+        total_deleted, all_errors, kept_markers = purge_versions(client, args.bucket, keys, args.delete_threads)
+        if kept_markers:
+            print(f"Kept {kept_markers} current delete marker(s) whose older versions failed to delete")
+    else:
+        print(f"=== Deleting {len(keys)} files from {args.bucket} ===")
+        total_deleted, all_errors = delete_all(client, args.bucket, keys, delete_batch, args.delete_threads)
     print(f"\nDeleted: {total_deleted}")
     if all_errors:
         print(f"\nErrors ({len(all_errors)}):")
         for err in all_errors[:10]:
-            print(f"  {err.get('Key')}: {err.get('Message')}")
+            version = f" [{err['VersionId']}]" if err.get("VersionId") else ""
+            print(f"  {err.get('Key')}{version}: {err.get('Message')}")
         if len(all_errors) > 10:
             print(f"  … and {len(all_errors) - 10} more")
         sys.exit(1)
@@ -1,51 +1,217 @@
 #!/usr/bin/env python3
 
 import argparse
-import boto3
-import yaml
+import fnmatch
+import json
 import os
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import aws_delete
+import aws_invalidate_cloudfront
+import aws_warm
+import olmsted_data
+import olmsted_hashes
+import olmsted_headers
+import olmsted_releases
+import olmsted_session
+import olmsted_storage
+import olmsted_transfer
+import olmsted_watch
 
 
 elide = [".git", "data"]
 
-format_mapping = {
-    ".json": "application/json",
-    ".html": "text/html",
-    ".css": "text/css",
-    "": "text/plain",
-    ".txt": "text/plain",
-    ".js": "text/javascript",
-    ".jpg": "image/jpeg",
-    ".jpeg": "image/jpeg",
-    ".svg": "image/svg+xml",
-    ".png": "image/png",
-}
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Editor swap/backup files that --watch never publishes.
+WATCH_IGNORE = ["*~", ".*.sw?", ".#*", "*.tmp"]
+
+# Beyond this many changed paths, --watch invalidates /* instead.
+MAX_TARGETED_INVALIDATIONS = 15
+
+
+def load_client(creds_filename):
+    return olmsted_session.client("s3", olmsted_session.load_credentials(creds_filename))
+
+
+class Destination:
+    """One `-b` target of a deploy: its client and bucket, its listing for
+    --changed-only, and what was published to it.
+
+    `spec` is a bucket name, `s3://bucket` or `file:///dir`, optionally
+    followed by `,creds=PATH` to use other credentials (and so another
+    account or region) than `-c`, and `,distribution=ID` for the
+    CloudFront distribution serving it.
+    """
+
+    def __init__(self, spec, default_creds_filename):
+        target, _, options = spec.partition(",")
+        self.creds_filename = default_creds_filename
+        self.distribution_id = None
+        for option in filter(None, options.split(",")):
+            name, _, value = option.partition("=")
+            if name == "creds" and value:
+                self.creds_filename = os.path.expanduser(value)
+            elif name == "distribution" and value:
+                self.distribution_id = value
+            else:
+                raise ValueError(
+                    f"unknown destination option {option!r} in {spec!r}; expected creds=PATH or distribution=ID"
+                )
+        self.name = target
+        self.client, self.bucket = olmsted_storage.connect(
+            target, lambda: load_client(self.creds_filename), lazy=True
+        )
+        self.local_target = isinstance(self.client, olmsted_storage.LocalS3Client)
+        self.remote_objects = None
+        self.uploaded = 0
+        self.copied = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def record(self, key, error=None, size=0, etag=None):
+        with self.lock:
+            if error is not None:
+                self.failed.append((key, error))
+                return
+            self.uploaded += 1
+            self.bytes += size
+            if self.remote_objects is not None and etag:
+                self.remote_objects[key] = (size, etag)
 
 
-def load_client(args):
-    with open(args.creds_filename) as handle:
-        credentials = yaml.load(handle, Loader=yaml.SafeLoader)
-        return boto3.client("s3", **credentials)
+def format_file_size(size):
+    """Format file size in human-readable format"""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} PB"
 
 
-def content_type(path):
-    _, ext = os.path.splitext(path)
-    return format_mapping.get(ext, "text/plain")
+def list_remote_objects(dest, prefix=""):
+    """Map each key under `prefix` in the destination bucket to its
+    (size, ETag)."""
+    remote = {}
+    paginator = dest.client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=dest.bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            remote[obj["Key"]] = (obj["Size"], obj["ETag"].strip('"'))
+    return remote
 
 
-def push_asset(args, localpath, key):
+def is_unchanged(args, dest, localpath, key):
+    """True if `key` in `dest` already holds exactly the bytes of
+    `localpath`, judged by size and S3 ETag. Always False unless
+    --changed-only is on."""
+    if dest.remote_objects is None or key not in dest.remote_objects:
+        return False
+    size, etag = dest.remote_objects[key]
+    if os.path.getsize(localpath) != size:
+        return False
+    return olmsted_hashes.etag_matches(args.hash_cache.get(localpath), etag)
+
+
+def local_files(args):
+    """Every local file the current scope may publish."""
+    roots = []
+    if args.scope in ["app", "full"]:
+        roots.append(args.app_dir)
+    if args.scope in ["data", "full"]:
+        roots.append(args.data_dir)
+    paths = set()
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            if root == args.app_dir:
+                dirnames[:] = [d for d in dirnames if d not in elide]
+            paths.update(os.path.join(dirpath, name) for name in filenames)
+    return sorted(paths)
+
+
+def destination_suffix(args, destinations):
+    if len(args.destinations) == 1:
+        return ""
+    return " to " + ", ".join(dest.name for dest in destinations)
+
+
+def upload_args(args, key, cache_control=None):
+    """ExtraArgs for publishing `key`: every header the header policy
+    declares for it, with `cache_control` (if given) overriding its
+    Cache-Control."""
+    extra_args = olmsted_headers.upload_headers(key, args.header_policy)
+    if cache_control:
+        extra_args["CacheControl"] = cache_control
+    extra_args["ACL"] = "public-read"
+    return extra_args
+
+
+def push_asset(args, localpath, key, cache_control=None, destinations=None):
+    """Publish `localpath` as `key` to every destination (default: all)
+    that doesn't already hold it, reading the file once however many
+    destinations there are. Failures are recorded per destination."""
+    if args.only_keys is not None and key not in args.only_keys:
+        return
+    pending = []
+    for dest in args.destinations if destinations is None else destinations:
+        if is_unchanged(args, dest, localpath, key):
+            with dest.lock:
+                dest.skipped += 1
+            if args.verbose:
+                print(f"unchanged {key}{destination_suffix(args, [dest])}")
+        else:
+            pending.append(dest)
+    if not pending:
+        return
+    extra_args = upload_args(args, key, cache_control)
     if args.verbose or args.dry_run:
         prefix = "[DRY RUN] " if args.dry_run else ""
-        print(f"{prefix}publishing {key} {content_type(key)} from local file {localpath}")
-    if not args.dry_run:
-        args.client.upload_file(
-            Filename=localpath,
-            Bucket=args.bucket,
+        print(
+            f"{prefix}publishing {key} {extra_args.get('ContentType', '')} from local file {localpath}"
+            f"{destination_suffix(args, pending)}"
+        )
+    if args.dry_run:
+        return
+    errors = olmsted_transfer.fan_out_upload(
+        [(dest.client, dest.bucket) for dest in pending], localpath, key, extra_args, args.limiter, args.hedger
+    )
+    size = os.path.getsize(localpath)
+    etag = args.hash_cache.get(localpath)["etag"] if any(d.remote_objects is not None for d in pending) else None
+    for dest, error in zip(pending, errors):
+        if error is not None:
+            print(f"✗ {key}{destination_suffix(args, [dest])}: {error}")
+        dest.record(key, error, size, etag)
+
+
+def copy_asset(args, dest, source_key, key, cache_control=None):
+    """Server-side copy of an object already in the destination bucket."""
+    if args.verbose or args.dry_run:
+        prefix = "[DRY RUN] " if args.dry_run else ""
+        print(f"{prefix}copying {key} from {source_key}{destination_suffix(args, [dest])}")
+    if args.dry_run:
+        return
+    extra_args = upload_args(args, key, cache_control)
+    try:
+        dest.client.copy_object(
+            Bucket=dest.bucket,
             Key=key,
-            ExtraArgs={"ContentType": content_type(key), "ACL": "public-read"},
+            CopySource={"Bucket": dest.bucket, "Key": source_key},
+            MetadataDirective="REPLACE",
+            **extra_args,
         )
+    except Exception as e:
+        print(f"✗ {key}{destination_suffix(args, [dest])}: {e}")
+        dest.record(key, e)
+        return
+    with dest.lock:
+        dest.copied += 1
 
 
 def push_app(args, basepath=None):
@@ -61,27 +227,542 @@ def push_app(args, basepath=None):
                 push_app(args, os.path.join(basepath, path) if basepath else path)
 
 
+def app_files(args):
+    """(localpath, relpath) for every app file push_app would publish."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(args.app_dir):
+        dirnames[:] = [d for d in dirnames if d not in elide]
+        for name in filenames:
+            if name in elide:
+                continue
+            localpath = os.path.join(dirpath, name)
+            files.append((localpath, os.path.relpath(localpath, args.app_dir).replace(os.sep, "/")))
+    return sorted(files, key=lambda item: item[1])
+
+
+def push_release(args):
+    """Upload the app into a new immutable releases/<id>/ prefix in every
+    destination and activate it there (see olmsted_releases). Returns the
+    entry-point keys that changed."""
+    release_id = args.release_id or olmsted_releases.new_release_id()
+    states = {}
+    for dest in args.destinations:
+        states[dest.name] = olmsted_releases.load_state(dest.client, dest.bucket)
+        if olmsted_releases.find_release(states[dest.name], release_id):
+            print(f"✗ Release {release_id} already exists in {dest.name}; releases are immutable")
+            sys.exit(1)
+    files = app_files(args)
+    missing = [entry for entry in args.entry_points if entry not in {rel for _, rel in files}]
+    if missing:
+        print(f"✗ Entry point(s) not found in {args.app_dir}: {', '.join(missing)}")
+        sys.exit(1)
+
+    prefix = olmsted_releases.release_prefix(release_id)
+    print(f"Uploading release {release_id} ({len(files)} file(s)) to {prefix}")
+    with ThreadPoolExecutor(max_workers=args.upload_threads) as pool:
+        futures = []
+        for localpath, rel in files:
+            key = prefix + rel
+            upload_to = []
+            for dest in args.destinations:
+                active = states[dest.name]["active"]
+                source_key = olmsted_releases.release_prefix(active) + rel if active else None
+                if source_key and is_unchanged(args, dest, localpath, source_key):
+                    # Same bytes as the active release: copy server-side.
+                    cache_control = olmsted_releases.IMMUTABLE_CACHE_CONTROL
+                    futures.append(pool.submit(copy_asset, args, dest, source_key, key, cache_control))
+                else:
+                    upload_to.append(dest)
+            if upload_to:
+                futures.append(
+                    pool.submit(
+                        push_asset, args, localpath, key, olmsted_releases.IMMUTABLE_CACHE_CONTROL, upload_to
+                    )
+                )
+        for future in futures:
+            future.result()
+
+    rewritten = []
+    for dest in args.destinations:
+        state = states[dest.name]
+        if dest.failed:
+            print(f"✗ Not activating release {release_id} in {dest.name}: {len(dest.failed)} upload(s) failed")
+            continue
+        if dest.copied:
+            print(f"  {dest.name}: {dest.uploaded} uploaded, {dest.copied} copied from release {state['active']}")
+        state["releases"].append(
+            {
+                "id": release_id,
+                "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "top_level": sorted({rel.split("/")[0] for _, rel in files}),
+            }
+        )
+        if not args.dry_run:
+            olmsted_releases.save_state(dest.client, dest.bucket, state)
+        rewritten = olmsted_releases.activate(
+            dest.client, dest.bucket, state, release_id, args.entry_points, args.dry_run, args.verbose
+        )
+        print(f"✓ Activated release {release_id}{destination_suffix(args, [dest]).replace(' to ', ' in ')}")
+        olmsted_releases.prune(dest.client, dest.bucket, state, args.keep_releases, args.dry_run)
+    return rewritten
+
+
+def rollback(args):
+    """Re-activate an earlier release (the one active before the active
+    release, or --release-id) in every destination. Returns the entry-point keys
+    that changed."""
+    rewritten = []
+    for dest in args.destinations:
+        state = olmsted_releases.load_state(dest.client, dest.bucket)
+        target = args.release_id or olmsted_releases.previous_release_id(state)
+        where = destination_suffix(args, [dest]).replace(" to ", " in ")
+        if target is None:
+            print(f"✗ Nothing to roll back to{where}: {len(state['releases'])} release(s), active {state['active']}")
+            sys.exit(1)
+        if olmsted_releases.find_release(state, target) is None:
+            known = ", ".join(release["id"] for release in state["releases"]) or "none"
+            print(f"✗ No release {target}{where} (known: {known})")
+            sys.exit(1)
+        print(f"Rolling back from {state['active']} to {target}{where}")
+        rewritten = olmsted_releases.activate(
+            dest.client, dest.bucket, state, target, args.entry_points, args.dry_run, args.verbose
+        )
+        print(f"✓ Activated release {target}{where}")
+    return rewritten
+
+
+def invalidation_paths(args, entry_points):
+    """CloudFront paths a deploy made stale: everything for an in-place
+    app deploy, else just the rewritten entry points (plus data)."""
+    if args.scope in ["app", "full"] and not args.release:
+        return ["/*"]
+    paths = []
+    for entry_point in entry_points or []:
+        paths.append("/" + entry_point)
+        if entry_point == "index.html":
+            paths.append("/")
+    if args.scope in ["data", "full"]:
+        paths.append("/data/*")
+    return paths
+
+
+def invalidate_cloudfront(args, paths, wait=True):
+    """Invalidate `paths` in-process via aws_invalidate_cloudfront, for
+    every S3 destination. Returns False if any invalidation failed."""
+    remote = [dest for dest in args.destinations if not dest.local_target]
+    if len(remote) < len(args.destinations):
+        print("Skipping CloudFront invalidation for local target(s)")
+    if not remote:
+        return True
+    if args.dry_run:
+        print(f"[DRY RUN] Would invalidate CloudFront cache for {' '.join(paths)}{destination_suffix(args, remote)}")
+        return True
+    all_ok = True
+    for dest in remote:
+        distribution_id = dest.distribution_id
+        if len(remote) == 1:
+            distribution_id = distribution_id or args.cloudfront_distribution_id
+        elif not distribution_id:
+            # The fallbacks (--cloudfront-distribution-id, the config file)
+            # name a single distribution, which would be invalidated once
+            # per bucket while the other buckets' caches stay stale.
+            print(
+                f"⚠ Skipping CloudFront invalidation for {dest.name}: with several targets, "
+                f"give each one its distribution with {dest.name},distribution=ID"
+            )
+            continue
+        print(f"Invalidating CloudFront cache{destination_suffix(args, [dest]).replace(' to ', ' for ')}...")
+        try:
+            ok = aws_invalidate_cloudfront.invalidate(
+                dest.bucket, paths, dest.creds_filename, distribution_id, wait=wait
+            )
+        except Exception as e:
+            ok = False
+            print(f"  {e}")
+        if ok:
+            print("✓ CloudFront invalidation completed")
+        else:
+            print("✗ CloudFront invalidation failed")
+        all_ok = all_ok and ok
+    return all_ok
+
+
+def watched_key(args, path):
+    """The key a changed local file publishes to, or None if the current
+    scope doesn't publish it. Mirrors push_app/push_data."""
+    name = os.path.basename(path)
+    if any(fnmatch.fnmatchcase(name, pattern) for pattern in WATCH_IGNORE):
+        return None
+    data_dir = os.path.abspath(args.data_dir)
+    app_dir = os.path.abspath(args.app_dir)
+    if args.scope in ["data", "full"] and path.startswith(data_dir + os.sep):
+        return "data/" + os.path.relpath(path, data_dir).replace(os.sep, "/")
+    if args.scope in ["app", "full"] and path.startswith(app_dir + os.sep):
+        rel = os.path.relpath(path, app_dir).replace(os.sep, "/")
+        if not any(part in elide for part in rel.split("/")):
+            return rel
+    return None
+
+
+def publish_changes(args, paths):
+    """Publish one debounced batch of changed local files: validate any
+    changed consolidated files, optionally rebuild the manifest, upload
+    what differs from the bucket, then the manifest, then invalidate
+    exactly the uploaded paths."""
+    manifest_key = "data/" + olmsted_data.MANIFEST_FILENAME
+    manifest_path = os.path.join(args.data_dir, olmsted_data.MANIFEST_FILENAME)
+    items = []
+    removed = []
+    manifest_changed = False
+    datasets_changed = False
+    for path in sorted(paths):
+        key = watched_key(args, path)
+        if key is None:
+            continue
+        if not os.path.isfile(path):
+            removed.append(key)
+            datasets_changed = datasets_changed or key.startswith("data/")
+            continue
+        if key == manifest_key:
+            manifest_changed = True
+            continue
+        if key.startswith("data/") and olmsted_data.is_candidate_consolidated_file(os.path.basename(path)):
+            datasets_changed = True
+            if not args.skip_validation:
+                result = olmsted_data.validate_consolidated_file(path)
+                if not result["ok"]:
+                    print(f"  ✗ {key}: {result['error']} (not uploaded)")
+                    continue
+        items.append((path, key))
+
+    if datasets_changed and args.rebuild_manifest:
+        cmd = ["node", os.path.join(REPO_ROOT, "scripts", "build-datasets-manifest.js"), args.data_dir]
+        if subprocess.run(cmd).returncode == 0:
+            manifest_changed = True
+        else:
+            print("  ✗ build-datasets-manifest.js failed; manifest not uploaded")
+            manifest_changed = False
+    if manifest_changed and os.path.isfile(manifest_path):
+        items.append((manifest_path, manifest_key))
+
+    changed = [
+        (localpath, key)
+        for localpath, key in items
+        if not all(is_unchanged(args, dest, localpath, key) for dest in args.destinations)
+    ]
+    for key in removed:
+        print(f"  - {key} removed locally; left in the bucket (see aws_delete.py --gc)")
+    if not changed:
+        return
+    # The manifest goes last, once everything it references is live.
+    ordered = [item for item in changed if item[1] != manifest_key]
+    failures = {dest.name: len(dest.failed) for dest in args.destinations}
+    push_assets(args, ordered)
+    for localpath, key in changed:
+        if key == manifest_key:
+            push_manifest(args, localpath, since=failures)
+    for localpath, key in changed:
+        print(f"  ↑ {key}")
+    args.hash_cache.save()
+
+    if args.invalidate_cloudfront:
+        paths = []
+        for _, key in changed:
+            paths.append("/" + key)
+            if key == "index.html":
+                paths.append("/")
+        if len(paths) > MAX_TARGETED_INVALIDATIONS:
+            paths = ["/*"]
+        invalidate_cloudfront(args, paths, wait=False)
+
+
+def watch(args):
+    """Publish local changes as they happen, until interrupted."""
+    roots = []
+    if args.scope in ["app", "full"]:
+        roots.append(args.app_dir)
+    if args.scope in ["data", "full"]:
+        roots.append(args.data_dir)
+    data_dir = os.path.abspath(args.data_dir)
+
+    def skip_dir(path):
+        return os.path.basename(path) in elide and not path.startswith(data_dir + os.sep) and path != data_dir
+
+    watcher = olmsted_watch.make_watcher(roots, skip_dir)
+    print(f"Watching {', '.join(roots)} for changes (Ctrl-C to stop)...")
+    try:
+        for paths in olmsted_watch.batches(watcher, args.watch_quiet):
+            print(f"{time.strftime('%H:%M:%S')} {len(paths)} change(s)")
+            publish_changes(args, paths)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        watcher.close()
+        args.hash_cache.save()
+
+
 def push_data(args, basepath=None):
     local_basepath = (
         os.path.join(args.data_dir, basepath) if basepath else args.data_dir
     )
     for path in os.listdir(local_basepath):
         localpath = os.path.join(local_basepath, path)
+        relpath = os.path.join(basepath, path) if basepath else path
+        if relpath == olmsted_data.MANIFEST_FILENAME:
+            # Pushed last by push_manifest, once everything it names is live.
+            continue
         if os.path.isfile(localpath):
-            push_asset(args, localpath, os.path.join("data", path))
+            push_asset(args, dataset_path(args, relpath), os.path.join("data", relpath))
         elif os.path.isdir(localpath):
-            push_data(args, os.path.join(basepath, path) if basepath else path)
+            push_data(args, relpath)
+
+
+def dataset_path(args, relpath):
+    """Local file to publish for `data/<relpath>`: the re-encoded copy if
+    the re-encode stage produced one, else the file in the data dir."""
+    return args.replacements.get(relpath.replace(os.sep, "/"), os.path.join(args.data_dir, relpath))
+
+
+def push_manifest(args, manifest_path, since=None):
+    """Upload the manifest to each destination where no upload failed
+    (since the `since` failure counts, if given), so no destination lists
+    a dataset it doesn't hold."""
+    if not os.path.isfile(manifest_path):
+        return
+    since = since or {}
+    ready = []
+    for dest in args.destinations:
+        if len(dest.failed) > since.get(dest.name, 0):
+            print(f"✗ Not uploading {olmsted_data.MANIFEST_FILENAME} to {dest.name}: upload(s) failed")
+        else:
+            ready.append(dest)
+    if ready:
+        push_asset(args, manifest_path, os.path.join("data", olmsted_data.MANIFEST_FILENAME), destinations=ready)
+
+
+def push_assets(args, items):
+    """Upload (localpath, key) pairs concurrently on `args.upload_threads`
+    threads. boto3 clients are thread-safe, so each destination's client
+    is shared."""
+    with ThreadPoolExecutor(max_workers=args.upload_threads) as pool:
+        for future in [pool.submit(push_asset, args, localpath, key) for localpath, key in items]:
+            future.result()
+
+
+def shard_data(args, staging_dir):
+    """Split each consolidated file into a header, an index and shards of
+    clonal families under `staging_dir`, one worker process per file.
+
+    Returns (items, shard_entries): the (localpath, key) pairs to upload
+    and, per `consolidated_path`, the `shards` field for its manifest entry.
+    """
+    relpaths = olmsted_data.find_consolidated_files(args.data_dir)
+    items = []
+    shard_entries = {}
+    if not relpaths:
+        return items, shard_entries
+    mode = "one per family" if args.shard_max_bytes == 0 else f"up to {format_file_size(args.shard_max_bytes)}"
+    print(f"Sharding {len(relpaths)} consolidated file(s) ({mode} per shard)...")
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(
+                olmsted_data.shard_consolidated_file,
+                dataset_path(args, rel),
+                os.path.join(staging_dir, "shards", olmsted_data.dataset_stem(rel)),
+                args.shard_max_bytes,
+            ): rel
+            for rel in relpaths
+        }
+        for future in as_completed(futures):
+            rel = futures[future]
+            index = future.result()
+            shard_prefix = "/".join(["shards", olmsted_data.dataset_stem(rel)])
+            local_prefix = os.path.join(staging_dir, *shard_prefix.split("/"))
+            for name in ["header.json.gz", "index.json"] + [shard["path"] for shard in index["shards"]]:
+                items.append((os.path.join(local_prefix, name), f"data/{shard_prefix}/{name}"))
+            shard_entries[rel] = {
+                "shards": {
+                    "header": f"{shard_prefix}/header.json.gz",
+                    "index": f"{shard_prefix}/index.json",
+                    "shard_count": len(index["shards"]),
+                }
+            }
+            total = sum(shard["bytes"] for shard in index["shards"])
+            print(f"  {rel}: {len(index['shards'])} shard(s), {format_file_size(total)}")
+    print()
+    return items, shard_entries
+
+
+def validate_data(args):
+    """Decompress and structurally check every consolidated file under
+    `args.data_dir` in a process pool, printing one line per file.
+
+    Returns the list of failed result dicts; the caller blocks the deploy
+    if it's non-empty.
+    """
+    relpaths = olmsted_data.find_consolidated_files(args.data_dir)
+    if not relpaths:
+        return []
+    print(f"Validating {len(relpaths)} consolidated file(s) in {args.data_dir} ({args.jobs} workers)...")
+    failures = []
+    total_bytes = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [
+            pool.submit(olmsted_data.validate_consolidated_file, os.path.join(args.data_dir, rel))
+            for rel in relpaths
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            rel = os.path.relpath(result["path"], args.data_dir)
+            total_bytes += result["bytes"]
+            if result["ok"]:
+                if args.verbose:
+                    print(
+                        f"  ✓ {rel} ({format_file_size(result['bytes'])}, "
+                        f"{result['clones']} clones, {result['trees']} trees, {result['seconds']:.2f}s)"
+                    )
+            else:
+                failures.append(result)
+                print(f"  ✗ {rel} ({result['seconds']:.2f}s): {result['error']}")
+    print(
+        f"Validated {len(relpaths) - len(failures)}/{len(relpaths)} file(s), "
+        f"{format_file_size(total_bytes)} on disk"
+    )
+    print()
+    return failures
+
+
+def reencode_data(args, staging_dir):
+    """Re-encode each consolidated file as canonical minified JSON into
+    `staging_dir` (one worker process per file) and register the copies in
+    `args.replacements`, so every later stage and the upload use them."""
+    relpaths = olmsted_data.find_consolidated_files(args.data_dir)
+    if not relpaths:
+        return
+    precision = "unchanged" if args.float_precision is None else f"{args.float_precision} decimal places"
+    print(f"Re-encoding {len(relpaths)} consolidated file(s) (floats {precision}, gzip level {args.compress_level})...")
+    total_in = total_out = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {}
+        for rel in relpaths:
+            out_path = os.path.join(staging_dir, "reencoded", *rel.split("/"))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            future = pool.submit(
+                olmsted_data.reencode_consolidated_file,
+                os.path.join(args.data_dir, rel),
+                out_path,
+                args.float_precision,
+                args.compress_level,
+            )
+            futures[future] = (rel, out_path)
+        for future in as_completed(futures):
+            rel, out_path = futures[future]
+            result = future.result()
+            total_in += result["bytes_in"]
+            total_out += result["bytes_out"]
+            saved = result["bytes_in"] - result["bytes_out"]
+            if saved <= 0:
+                # Already minimal; keep publishing the original bytes.
+                print(f"  {rel}: no savings, uploading original")
+                total_out += saved
+                continue
+            args.replacements[rel] = out_path
+            print(
+                f"  {rel}: {format_file_size(result['bytes_in'])} → {format_file_size(result['bytes_out'])} "
+                f"(saved {format_file_size(saved)}, {100.0 * saved / result['bytes_in']:.1f}%, {result['seconds']:.2f}s)"
+            )
+    print(f"Re-encoding saved {format_file_size(total_in - total_out)} of {format_file_size(total_in)}")
+    print()
+
+
+def summarize_data(args, staging_dir):
+    """Write a summary sidecar for each consolidated file into
+    `staging_dir`, one worker process per file (cached by content hash in
+    `args.summary_cache`, with the SHA-256 taken from `args.hash_cache`
+    so unchanged files aren't re-read).
+
+    Returns (items, summary_entries): the (localpath, key) pairs to upload
+    and, per `consolidated_path`, the `summary_path` for its manifest entry.
+    """
+    relpaths = olmsted_data.find_consolidated_files(args.data_dir)
+    items = []
+    summary_entries = {}
+    if not relpaths:
+        return items, summary_entries
+    print(f"Summarizing {len(relpaths)} consolidated file(s)...")
+    digests = args.hash_cache.get_many([dataset_path(args, rel) for rel in relpaths], args.jobs)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(
+                olmsted_data.summarize_consolidated_file,
+                dataset_path(args, rel),
+                args.summary_cache,
+                digests[dataset_path(args, rel)]["sha256"],
+            ): rel
+            for rel in relpaths
+        }
+        for future in as_completed(futures):
+            rel = futures[future]
+            summary = future.result()
+            cached = summary.pop("cached")
+            summary["consolidated_path"] = rel
+            summary_path = f"summaries/{olmsted_data.dataset_stem(rel)}.summary.json"
+            localpath = os.path.join(staging_dir, *summary_path.split("/"))
+            os.makedirs(os.path.dirname(localpath), exist_ok=True)
+            with open(localpath, "w") as handle:
+                handle.write(olmsted_data.compact_json(summary))
+            items.append((localpath, f"data/{summary_path}"))
+            summary_entries[rel] = {"summary_path": summary_path}
+            print(
+                f"  {rel}: {summary['clones']} clones, {summary['trees']} trees"
+                f"{' (cached)' if cached else ''}"
+            )
+    print()
+    return items, summary_entries
+
+
+def write_staged_manifest(args, entry_updates, staging_dir):
+    """Copy the local manifest into `staging_dir`, merging `entry_updates`
+    (fields keyed by `consolidated_path`) into the matching entries. The
+    local manifest is left untouched. Returns the path to upload."""
+    manifest_path = os.path.join(args.data_dir, olmsted_data.MANIFEST_FILENAME)
+    if not entry_updates:
+        return manifest_path
+    if not os.path.isfile(manifest_path):
+        print(f"Warning: no {manifest_path}; sidecars were uploaded but nothing points at them")
+        return manifest_path
+    with open(manifest_path) as handle:
+        entries = json.load(handle)
+    for entry in entries:
+        entry.update(entry_updates.get(entry.get("consolidated_path"), {}))
+    staged = os.path.join(staging_dir, olmsted_data.MANIFEST_FILENAME)
+    with open(staged, "w") as handle:
+        handle.write(json.dumps(entries, indent=2) + "\n")
+    return staged
 
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "scope",
-        choices=["app", "data", "full"],
+        choices=["app", "data", "full", "rollback"],
         default="full",
-        help="app, data, or full",
+        help="app, data, or full; or rollback to re-activate an earlier --release",
+    )
+    parser.add_argument(
+        "-b",
+        "--bucket",
+        dest="buckets",
+        action="append",
+        required=True,
+        metavar="TARGET[,creds=FILE][,distribution=ID]",
+        help=(
+            "S3 bucket name (or s3://bucket), or file:///path/to/dir to deploy into a local directory. "
+            "Repeat to deploy to several targets at once, reading each file once; append ,creds=FILE "
+            "to use other credentials than -c for one target, and ,distribution=ID for the CloudFront "
+            "distribution --invalidate-cloudfront should invalidate for it"
+        ),
     )
-    parser.add_argument("-b", "--bucket", required=True)
     parser.add_argument("-d", "--data-dir", default="_deploy/data")
     parser.add_argument("-a", "--app-dir", default="_deploy")
     parser.add_argument("-v", "--verbose", action="store_true")
@@ -90,12 +771,191 @@ def get_args():
         action="store_true",
         help="Preview files that would be uploaded without actually uploading"
     )
+    parser.add_argument(
+        "--skip-validation",
+        action="store_true",
+        help="Upload data without first checking that each consolidated file decompresses and parses",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for validation, data stages and hashing (default: CPU count)",
+    )
+    parser.add_argument(
+        "--shard",
+        action="store_true",
+        help=(
+            "Also split each consolidated file into a header plus shards of clonal families "
+            "under data/shards/, and record them in the uploaded datasets.json entries"
+        ),
+    )
+    parser.add_argument(
+        "--shard-max-bytes",
+        type=int,
+        default=8 << 20,
+        help="Target uncompressed size per shard; 0 means one shard per clonal family (default: 8 MiB)",
+    )
+    parser.add_argument(
+        "--reencode",
+        action="store_true",
+        help=(
+            "Upload consolidated files re-encoded as canonical minified JSON (sorted keys, no "
+            "whitespace) instead of byte-for-byte; the local files are not modified"
+        ),
+    )
+    parser.add_argument(
+        "--float-precision",
+        type=int,
+        help="With --reencode, round floats to this many decimal places (default: keep full precision)",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        choices=range(1, 10),
+        default=9,
+        metavar="{1..9}",
+        help="With --reencode, gzip level for .json.gz files (default: 9)",
+    )
+    parser.add_argument(
+        "--summaries",
+        action="store_true",
+        help=(
+            "Also upload a compact summary sidecar (counts, size histograms, per-family sizes) "
+            "for each consolidated file under data/summaries/, referenced as summary_path in datasets.json"
+        ),
+    )
+    parser.add_argument(
+        "--summary-cache",
+        default=os.path.join(os.path.expanduser("~"), ".olmsted/summary-cache"),
+        help="Directory caching summaries by file SHA-256, so unchanged files aren't re-parsed",
+    )
+    parser.add_argument(
+        "--header-policy",
+        metavar="FILE",
+        help=(
+            "JSON rules for Content-Type/Content-Encoding/Cache-Control that take precedence over "
+            "the defaults in olmsted_headers.py (same file as aws_explore.py --audit --policy)"
+        ),
+    )
+    parser.add_argument(
+        "--keys-from",
+        metavar="FILE",
+        help=(
+            "Only publish the keys listed in FILE, one per line (e.g. from "
+            "`aws_diff.py _deploy s3://BUCKET --show only-left --show changed --format keys`)"
+        ),
+    )
+    parser.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="Skip files whose size and S3 ETag already match the object in the bucket",
+    )
+    parser.add_argument(
+        "--hash-cache",
+        default=olmsted_hashes.DEFAULT_CACHE_PATH,
+        help=(
+            "File caching local digests by path, inode, size and mtime, so --changed-only "
+            "doesn't re-read unchanged files (default: ~/.olmsted/hash-cache.json)"
+        ),
+    )
+    parser.add_argument(
+        "--upload-threads",
+        type=int,
+        default=8,
+        help="Concurrent uploads for shard and summary files (default: 8)",
+    )
+    parser.add_argument(
+        "--bandwidth-limit",
+        type=olmsted_transfer.parse_rate,
+        metavar="RATE",
+        help="Cap the combined upload rate, e.g. 500K, 10M (bytes per second; default: unlimited)",
+    )
+    parser.add_argument(
+        "--lane-threshold",
+        type=int,
+        default=olmsted_transfer.DEFAULT_LANE_THRESHOLD,
+        help=(
+            "With --bandwidth-limit, files smaller than this many bytes get priority over larger "
+            "uploads; 0 puts everything in one lane (default: 1 MiB)"
+        ),
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help=(
+            "Duplicate small uploads that run longer than usual (see --hedge-percentile) and keep "
+            "whichever copy finishes first, to cut the slowest few percent of requests"
+        ),
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=olmsted_transfer.DEFAULT_HEDGE_PERCENTILE,
+        help="With --hedge, duplicate a request once it outlasts this percentile of observed latencies (default: 95)",
+    )
+    parser.add_argument(
+        "--hedge-max-size",
+        type=int,
+        default=olmsted_transfer.DEFAULT_HEDGE_MAX_SIZE,
+        help="With --hedge, only hedge files of at most this many bytes (default: 1 MiB)",
+    )
+    parser.add_argument(
+        "--release",
+        action="store_true",
+        help=(
+            "Upload the app into an immutable releases/<id>/ prefix and activate it by rewriting "
+            "only the entry point(s), instead of overwriting the live app files in place"
+        ),
+    )
+    parser.add_argument(
+        "--release-id",
+        help="Id for the new --release (default: UTC timestamp), or the release to roll back to",
+    )
+    parser.add_argument(
+        "--keep-releases",
+        type=int,
+        default=olmsted_releases.DEFAULT_KEEP,
+        help="Releases to keep after a --release; older ones are deleted (default: 5)",
+    )
+    parser.add_argument(
+        "--entry-point",
+        dest="entry_points",
+        action="append",
+        help="App file rewritten on activation, repeatable (default: index.html)",
+    )
+    parser.add_argument(
+        "--warm-url",
+        help=(
+            "After deploying (and invalidating), pre-warm the edge cache by fetching the entry points, "
+            "their assets and datasets.json through this site URL, e.g. https://www.olmstedviz.org"
+        ),
+    )
+    aws_warm.add_warm_arguments(parser, prefix="warm-")
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "After deploying, keep running and publish local changes under the app and data dirs "
+            "as they happen (implies --changed-only)"
+        ),
+    )
+    parser.add_argument(
+        "--watch-quiet",
+        type=float,
+        default=olmsted_watch.DEFAULT_QUIET,
+        help="With --watch, seconds without changes that end a burst before it is published (default: 1)",
+    )
+    parser.add_argument(
+        "--rebuild-manifest",
+        action="store_true",
+        help="With --watch, run scripts/build-datasets-manifest.js whenever a dataset file changes",
+    )
     parser.add_argument(
         "-c",
         "--creds-filename",
-        default=os.path.join(
-            os.path.expanduser("~"), ".olmsted/aws-credentials.yaml"
-        ),
+        default=olmsted_session.DEFAULT_CREDENTIALS_PATH,
         help="Must have s3 credentials here (don't forget to run `chmod go-rwx` on this file)",
     )
     parser.add_argument(
@@ -105,9 +965,30 @@ def get_args():
     )
     parser.add_argument(
         "--cloudfront-distribution-id",
-        help="CloudFront distribution ID (required if AWS credentials lack ListDistributions permission)",
+        help=(
+            "CloudFront distribution ID (required if AWS credentials lack ListDistributions permission). "
+            "Only used with a single target; give several targets ,distribution=ID each"
+        ),
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    args.entry_points = args.entry_points or list(olmsted_releases.DEFAULT_ENTRY_POINTS)
+    if args.watch:
+        if args.scope == "rollback" or args.release:
+            parser.error("--watch publishes files in place; it can't be combined with rollback or --release")
+        if args.reencode or args.shard or args.summaries:
+            parser.error("--watch uploads files as-is; it can't be combined with --reencode, --shard or --summaries")
+        args.changed_only = True
+    if args.keys_from and (args.scope == "rollback" or args.release or args.watch):
+        parser.error("--keys-from lists keys published in place; it can't be combined with rollback, --release or --watch")
+    if args.keys_from and (args.reencode or args.shard or args.summaries):
+        parser.error("--keys-from uploads files as-is; it can't be combined with --reencode, --shard or --summaries")
+    if args.rebuild_manifest and not args.watch:
+        parser.error("--rebuild-manifest only applies with --watch")
+    if not 0 < args.hedge_percentile < 100:
+        parser.error("--hedge-percentile must be between 0 and 100")
+    if args.keep_releases < 2:
+        parser.error("--keep-releases must be at least 2, so there is always something to roll back to")
+    return args
 
 
 def main():
@@ -118,32 +999,104 @@ def main():
         print("No files will be uploaded. Preview only.")
         print()
 
-    args.client = load_client(args)
-    if args.scope in ["app", "full"]:
+    if args.scope in ["data", "full"] and not args.skip_validation:
+        failures = validate_data(args)
+        if failures:
+            print(f"✗ Deploy blocked: {len(failures)} invalid dataset file(s). Fix them or pass --skip-validation.")
+            sys.exit(1)
+
+    try:
+        args.destinations = [Destination(spec, args.creds_filename) for spec in args.buckets]
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(2)
+    args.replacements = {}
+    args.header_policy = olmsted_headers.load_policy(args.header_policy)
+    args.only_keys = None
+    if args.keys_from:
+        args.only_keys = set(aws_delete.read_keys_from_file(args.keys_from))
+        print(f"Publishing only the {len(args.only_keys)} key(s) listed in {args.keys_from}")
+    args.hash_cache = olmsted_hashes.HashCache(args.hash_cache)
+    args.hedger = None
+    if args.hedge:
+        args.hedger = olmsted_transfer.Hedger(args.hedge_percentile, args.hedge_max_size)
+    args.limiter = None
+    if args.bandwidth_limit:
+        args.limiter = olmsted_transfer.BandwidthLimiter(args.bandwidth_limit, lane_threshold=args.lane_threshold)
+    if args.changed_only:
+        for dest in args.destinations:
+            dest.remote_objects = list_remote_objects(dest, "data/" if args.scope == "data" else "")
+        paths = local_files(args)
+        args.hash_cache.get_many(paths, args.jobs)
+        remote_counts = "/".join(str(len(dest.remote_objects)) for dest in args.destinations)
+        print(
+            f"Change detection: {remote_counts} remote object(s), {len(paths)} local file(s) "
+            f"({args.hash_cache.hits} digest(s) cached, {args.hash_cache.misses} hashed)"
+        )
+        print()
+    rewritten = []
+    if args.scope == "rollback":
+        rewritten = rollback(args)
+    elif args.scope in ["app", "full"] and args.release:
+        rewritten = push_release(args)
+    elif args.scope in ["app", "full"]:
         push_app(args)
     if args.scope in ["data", "full"]:
-        push_data(args)
+        with tempfile.TemporaryDirectory(prefix="olmsted-deploy-") as staging_dir:
+            if args.reencode:
+                reencode_data(args, staging_dir)
+            push_data(args)
+            entry_updates = {}
+            stages = [(args.summaries, summarize_data), (args.shard, shard_data)]
+            for enabled, stage in stages:
+                if not enabled:
+                    continue
+                items, updates = stage(args, staging_dir)
+                push_assets(args, items)
+                for rel, fields in updates.items():
+                    entry_updates.setdefault(rel, {}).update(fields)
+            push_manifest(args, write_staged_manifest(args, entry_updates, staging_dir))
 
-    if args.invalidate_cloudfront:
+    if len(args.destinations) > 1:
+        print()
+        for dest in args.destinations:
+            print(
+                f"{dest.name}: {dest.uploaded} uploaded ({format_file_size(dest.bytes)}), "
+                f"{dest.skipped} unchanged, {len(dest.failed)} failed"
+            )
+    elif args.changed_only:
+        print(f"Skipped {args.destinations[0].skipped} unchanged file(s)")
+    if args.changed_only:
+        args.hash_cache.prune()
+        args.hash_cache.save()
+    failed = [dest for dest in args.destinations if dest.failed]
+
+    if args.limiter and args.limiter.consumed:
+        print(
+            f"Bandwidth limit {format_file_size(args.limiter.rate)}/s: uploaded "
+            f"{format_file_size(args.limiter.consumed)}, throttled for {args.limiter.waited:.1f}s in total"
+        )
+
+    if args.hedger and args.hedger.report():
+        print(args.hedger.report())
+
+    if failed:
+        print(f"✗ {sum(len(dest.failed) for dest in failed)} upload(s) failed on {', '.join(d.name for d in failed)}")
+
+    if args.invalidate_cloudfront and not invalidate_cloudfront(args, invalidation_paths(args, rewritten)):
+        sys.exit(1)
+
+    if args.warm_url:
         if args.dry_run:
-            print("[DRY RUN] Would invalidate CloudFront cache")
+            print(f"[DRY RUN] Would warm the edge cache via {args.warm_url}")
         else:
-            print("Invalidating CloudFront cache...")
-            try:
-                cmd = [
-                    sys.executable,
-                    os.path.join(os.path.dirname(__file__), "aws_invalidate_cloudfront.py"),
-                    "-b", args.bucket,
-                    "-c", args.creds_filename
-                ]
-                if args.cloudfront_distribution_id:
-                    cmd.extend(["-d", args.cloudfront_distribution_id])
-
-                subprocess.run(cmd, check=True)
-                print("✓ CloudFront invalidation completed")
-            except subprocess.CalledProcessError as e:
-                print(f"✗ CloudFront invalidation failed: {e}")
-                sys.exit(1)
+            aws_warm.run_warm(args, args.warm_url, args.entry_points)
+
+    if args.watch:
+        watch(args)
+
+    if failed:
+        sys.exit(1)
 
     if args.dry_run:
         print()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Compare two object trees without downloading them: buckets
+(`s3://bucket[/prefix]`), `file://` rehearsal targets, or local
+directories such as `_deploy` or an aws_download.py snapshot. Keys are
+classified as only-left, only-right, changed (size or content) or
+identical. Both listings are merge-joined in key order, so memory stays
+flat however many objects there are.
+
+Exits 0 if the trees match, 1 if they differ, 2 on errors.
+
+Examples:
+  # What would a deploy change?
+  %(prog)s _deploy s3://www.olmstedviz.org
+
+  # Only the datasets, against a snapshot taken earlier
+  %(prog)s s3-current/data s3://www.olmstedviz.org/data/
+
+  # Delete what the bucket has but _deploy doesn't (review, then --confirm)
+  %(prog)s _deploy s3://www.olmstedviz.org --show only-right --format keys > /tmp/extra.txt
+  aws_delete.py -b www.olmstedviz.org -f /tmp/extra.txt
+
+  # Upload only what is missing or changed
+  %(prog)s _deploy s3://www.olmstedviz.org --show only-left --show changed --format keys > /tmp/todo.txt
+  aws_deploy.py full -b www.olmstedviz.org --keys-from /tmp/todo.txt
+"""
+
+import argparse
+import json
+import sys
+
+import olmsted_diff
+import olmsted_filters
+import olmsted_hashes
+import olmsted_session
+
+MARKERS = {
+    olmsted_diff.ONLY_LEFT: "-",
+    olmsted_diff.ONLY_RIGHT: "+",
+    olmsted_diff.CHANGED: "~",
+    olmsted_diff.IDENTICAL: "=",
+}
+
+
+def format_file_size(size):
+    """Format file size in human-readable form."""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} PB"
+
+
+def describe(entry):
+    if entry is None:
+        return None
+    _, size, etag, _ = entry
+    return {"size": size, "etag": etag} if etag is not None else {"size": size}
+
+
+def print_row(args, sources, status, key, reason, left, right):
+    if args.format == "keys":
+        print(sources[args.side].full_key(key))
+    elif args.format == "jsonl":
+        row = {"status": status, "key": key, "left": describe(left), "right": describe(right)}
+        if reason:
+            row["reason"] = reason
+        print(json.dumps(row))
+    elif status == olmsted_diff.CHANGED and reason == "size":
+        print(f"  {MARKERS[status]} {key} ({left[1]} → {right[1]} bytes)")
+    elif status == olmsted_diff.CHANGED:
+        print(f"  {MARKERS[status]} {key} ({reason} differs)")
+    else:
+        size = (left or right)[1]
+        print(f"  {MARKERS[status]} {key} ({format_file_size(size)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("left", help="s3://bucket[/prefix], file:///dir, or a local directory")
+    parser.add_argument("right", help="s3://bucket[/prefix], file:///dir, or a local directory")
+    parser.add_argument(
+        "--show",
+        action="append",
+        choices=olmsted_diff.STATUSES,
+        help="Only report keys with this status, repeatable (default: everything but identical)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "keys", "jsonl"],
+        default="text",
+        help=(
+            "text: a readable listing; keys: one key per line, for aws_delete.py --from-file or "
+            "aws_deploy.py --keys-from; jsonl: one JSON object per key (default: text)"
+        ),
+    )
+    parser.add_argument(
+        "--side",
+        choices=["left", "right"],
+        default="right",
+        help="With --format keys, print keys as they are (or would be) named in this source (default: right)",
+    )
+    parser.add_argument("--include", action="append", metavar="GLOB", help="Only keys matching this glob (repeatable)")
+    parser.add_argument("--exclude", action="append", metavar="GLOB", help="Skip keys matching this glob (repeatable)")
+    parser.add_argument(
+        "--size-only",
+        action="store_true",
+        help="Compare sizes only; don't hash local files (same-size objects count as identical)",
+    )
+    parser.add_argument(
+        "--hash-cache",
+        default=olmsted_hashes.DEFAULT_CACHE_PATH,
+        help="Local digest cache shared with aws_deploy.py (default: ~/.olmsted/hash-cache.json)",
+    )
+    parser.add_argument("-c", "--creds", help="Path to AWS credentials YAML file")
+    parser.add_argument("--anonymous", action="store_true", help="Access public buckets without credentials")
+    args = parser.parse_args()
+    shown = set(args.show or [olmsted_diff.ONLY_LEFT, olmsted_diff.ONLY_RIGHT, olmsted_diff.CHANGED])
+    # Machine-readable output owns stdout; the summary goes to stderr.
+    log = sys.stdout if args.format == "text" else sys.stderr
+
+    def make_client():
+        if args.creds:
+            return olmsted_session.client("s3", olmsted_session.load_credentials(args.creds))
+        return olmsted_session.client("s3", anonymous=args.anonymous)
+
+    hash_cache = None
+    try:
+        sources = {
+            "left": olmsted_diff.Source(args.left, make_client),
+            "right": olmsted_diff.Source(args.right, make_client),
+        }
+        key_filter = None
+        if args.include or args.exclude:
+            key_filter = olmsted_filters.KeyFilter("", None, False, args.include, args.exclude, True)
+        if not args.size_only:
+            hash_cache = olmsted_hashes.HashCache(args.hash_cache)
+        counts = dict.fromkeys(olmsted_diff.STATUSES, 0)
+        if args.format == "text":
+            print(f"--- {args.left}\n+++ {args.right}\n")
+        rows = olmsted_diff.diff(sources["left"], sources["right"], hash_cache, args.size_only, key_filter)
+        for status, key, reason, left, right in rows:
+            counts[status] += 1
+            if status in shown:
+                print_row(args, sources, status, key, reason, left, right)
+    except Exception as e:
+        print(f"✗ {e}", file=sys.stderr)
+        sys.exit(2)
+    finally:
+        if hash_cache is not None:
+            hash_cache.save()
+
+    print(
+        f"\n{counts[olmsted_diff.ONLY_LEFT]} only in {args.left}, {counts[olmsted_diff.ONLY_RIGHT]} only in "
+        f"{args.right}, {counts[olmsted_diff.CHANGED]} changed, {counts[olmsted_diff.IDENTICAL]} identical",
+        file=log,
+    )
+    differences = counts[olmsted_diff.ONLY_LEFT] + counts[olmsted_diff.ONLY_RIGHT] + counts[olmsted_diff.CHANGED]
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,76 @@
 #!/usr/bin/env python3
 
-import boto3
-import yaml
 import os
+import sys
 import argparse
+import contextlib
 import re
 from pathlib import Path
 
+import olmsted_archive
+import olmsted_filters
+import olmsted_session
+import olmsted_storage
+import olmsted_transfer
+
 
 def load_credentials(creds_filename):
     """Load AWS credentials from YAML file"""
-    with open(creds_filename) as handle:
-        return yaml.load(handle, Loader=yaml.SafeLoader)
+    return olmsted_session.load_credentials(creds_filename)
 
 
 def create_s3_client(credentials=None):
     """Create S3 client with or without credentials"""
     if credentials:
-        return boto3.client("s3", **credentials)
+        return olmsted_session.client('s3', credentials)
     else:
         # Try anonymous access for public buckets
-        from botocore import UNSIGNED
-        from botocore.config import Config
-        return boto3.client('s3', config=Config(signature_version=UNSIGNED))
+        return olmsted_session.client('s3', anonymous=True)
+
 
+def download_file(client, bucket_name, key, local_path, obj=None, ranges=None, limiter=None, hedger=None):
+    """Download a single file from S3.
 
-def download_file(client, bucket_name, key, local_path):
-    """Download a single file from S3"""
+    Objects of at least `ranges['threshold']` bytes (when `ranges` is given
+    and the listing entry `obj` supplies the size) are fetched with
+    concurrent ranged GETs instead of boto3's download_file. Either way
+    the bytes are throttled by `limiter` (a BandwidthLimiter), if given,
+    and small whole-object downloads are hedged by `hedger`, if given.
+    """
     try:
         # Create directory if needed
         local_file = Path(local_path) / key
         local_file.parent.mkdir(parents=True, exist_ok=True)
 
         # Download the file
-        client.download_file(bucket_name, key, str(local_file))
+        if ranges and obj and obj['Size'] >= ranges['threshold']:
+            olmsted_transfer.download_ranged(
+                client, bucket_name, key, str(local_file), obj['Size'],
+                etag=obj.get('ETag'),
+                range_size=ranges['size'],
+                concurrency=ranges['concurrency'],
+                retries=ranges['retries'],
+                limiter=limiter,
+            )
+        else:
+            size = obj['Size'] if obj else None
+
+            def fetch():
+                callback = limiter.callback(size) if limiter else None
+                client.download_file(bucket_name, key, str(local_file), Callback=callback)
+
+            if hedger:
+                hedger.call('GET', size, fetch)
+            else:
+                fetch()
         return True
     except Exception as e:
         print(f"  ❌ Error downloading {key}: {e}")
         return False
 
 
-def download_bucket(client, bucket_name, local_path, prefix='', search_term=None, use_regex=False):
+def download_bucket(client, bucket_name, local_path, prefix='', search_term=None, use_regex=False, ranges=None,
+                    includes=None, excludes=None, case_sensitive=False, limiter=None, hedger=None):
     """Download files from an S3 bucket with optional search filtering"""
     print(f"\n=== Downloading from bucket: {bucket_name} ===")
     print(f"Local path: {local_path}")
@@ -57,59 +87,26 @@ def download_bucket(client, bucket_name, local_path, prefix='', search_term=None
     local_dir.mkdir(parents=True, exist_ok=True)
 
     # Compile regex pattern if needed
-    pattern = None
-    if search_term and use_regex:
-        try:
-            pattern = re.compile(search_term, re.IGNORECASE)
-        except re.error as e:
-            print(f"❌ Invalid regex pattern: {e}")
-            return
-
     try:
-        # List ALL objects (no pagination limit)
-        paginator = client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(
-            Bucket=bucket_name,
-            Prefix=prefix
-        )
+        key_filter = olmsted_filters.KeyFilter(prefix, search_term, use_regex, includes, excludes, case_sensitive)
+    except re.error as e:
+        print(f"❌ Invalid regex pattern: {e}")
+        return
+    print_listed_prefixes(key_filter)
 
+    try:
         total_files = 0
         downloaded = 0
         failed = 0
         skipped = 0
         total_size = 0
 
-        # First pass: count total files and filter
-        all_objects = []
-        filtered_objects = []
-        for page in page_iterator:
-            if 'Contents' in page:
-                all_objects.extend(page['Contents'])
-
-        # Apply search filter if provided
-        for obj in all_objects:
-            key = obj['Key']
-            if key.endswith('/'):
-                continue
-            if search_term:
-                # Use regex or simple search based on flag
-                if use_regex:
-                    if pattern.search(key):
-                        filtered_objects.append(obj)
-                    else:
-                        skipped += 1
-                else:
-                    # Case-insensitive substring search
-                    if search_term.lower() in key.lower():
-                        filtered_objects.append(obj)
-                    else:
-                        skipped += 1
-            else:
-                filtered_objects.append(obj)
+        # First pass: list (only the prefixes that can match) and filter
+        filtered_objects, skipped = filter_objects(client, bucket_name, key_filter)
 
         total_files = len(filtered_objects)
 
-        if search_term:
+        if search_term or includes or excludes:
             print(f"Found {total_files} files matching '{search_term}' (skipped {skipped} non-matching files)\n")
         else:
             print(f"Found {total_files} files to download\n")
@@ -125,7 +122,7 @@ def download_bucket(client, bucket_name, local_path, prefix='', search_term=None
 
             print(f"[{i}/{total_files}] Downloading: {key} ({format_file_size(size)})")
 
-            if download_file(client, bucket_name, key, local_path):
+            if download_file(client, bucket_name, key, local_path, obj, ranges, limiter, hedger):
                 downloaded += 1
                 total_size += size
             else:
@@ -135,7 +132,7 @@ def download_bucket(client, bucket_name, local_path, prefix='', search_term=None
         print(f"✅ Successfully downloaded: {downloaded} files")
         if failed > 0:
             print(f"❌ Failed: {failed} files")
-        if search_term and skipped > 0:
+        if skipped > 0:
             print(f"⏭️  Skipped (didn't match search): {skipped} files")
         print(f"Total size: {format_file_size(total_size)}")
         print(f"Files saved to: {local_path}")
@@ -144,7 +141,85 @@ def download_bucket(client, bucket_name, local_path, prefix='', search_term=None
         print(f"Error accessing bucket: {e}")
 
 
-def list_all_files(client, bucket_name, prefix='', search_term=None, use_regex=False):
+def filter_objects(client, bucket_name, key_filter):
+    """List the objects `key_filter` matches, in key order. Returns
+    (objects, number of non-matching keys skipped)."""
+    objects = []
+    skipped = 0
+    for obj in key_filter.iter_listing(client, bucket_name):
+        key = obj['Key']
+        if key.endswith('/'):
+            continue
+        if key_filter.matches(key):
+            objects.append(obj)
+        else:
+            skipped += 1
+    return objects, skipped
+
+
+def archive_bucket(client, bucket_name, archive_path, prefix='', search_term=None, use_regex=False,
+                   includes=None, excludes=None, case_sensitive=False, limiter=None, compression=None,
+                   concurrency=olmsted_archive.DEFAULT_CONCURRENCY,
+                   buffer_bytes=olmsted_archive.DEFAULT_BUFFER_BYTES, out=None, hedger=None):
+    """Stream the matching files into one tar archive at `archive_path`
+    (written to `out` instead if given, e.g. stdout). Returns True if
+    every file made it into the archive."""
+    compression = compression or olmsted_archive.guess_compression(archive_path)
+    print(f"\n=== Archiving bucket: {bucket_name} ===")
+    print(f"Archive: {archive_path if out is None else 'stdout'} ({compression})")
+    print(f"Prefix: '{prefix}'")
+    print()
+
+    try:
+        olmsted_archive.zstd_module(compression)
+        key_filter = olmsted_filters.KeyFilter(prefix, search_term, use_regex, includes, excludes, case_sensitive)
+    except re.error as e:
+        print(f"❌ Invalid regex pattern: {e}")
+        return False
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return False
+    print_listed_prefixes(key_filter)
+
+    objects, skipped = filter_objects(client, bucket_name, key_filter)
+    print(f"Found {len(objects)} files to archive ({format_file_size(sum(o['Size'] for o in objects))})\n")
+
+    def progress(obj, error):
+        if error is None:
+            print(f"  + {obj['Key']} ({format_file_size(obj['Size'])})")
+        else:
+            print(f"  ❌ Error downloading {obj['Key']}: {error}")
+
+    # Write files to a temporary name so an interrupted run never leaves a
+    # truncated archive that looks complete.
+    partial_path = archive_path + '.partial'
+    try:
+        with contextlib.ExitStack() as stack:
+            stream = out if out is not None else stack.enter_context(open(partial_path, 'wb'))
+            written, failed, total_size = olmsted_archive.write_archive(
+                client, bucket_name, objects, stream, compression, concurrency, buffer_bytes, limiter, progress,
+                hedger)
+    except Exception as e:
+        print(f"❌ Archive failed: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return False
+    if os.path.exists(partial_path):
+        os.replace(partial_path, archive_path)
+
+    print(f"\n=== Archive Summary ===")
+    print(f"✅ Archived: {written} files, {format_file_size(total_size)}")
+    if failed > 0:
+        print(f"❌ Failed: {failed} files (left out of the archive)")
+    if skipped > 0:
+        print(f"⏭️  Skipped (didn't match search): {skipped} files")
+    if out is None:
+        print(f"Archive saved to: {archive_path}")
+    return failed == 0
+
+
+def list_all_files(client, bucket_name, prefix='', search_term=None, use_regex=False,
+                   includes=None, excludes=None, case_sensitive=False):
     """List all files in bucket (no limit) with optional search filtering"""
     print(f"\n=== All files in bucket: {bucket_name} ===")
     if prefix:
@@ -157,57 +232,43 @@ def list_all_files(client, bucket_name, prefix='', search_term=None, use_regex=F
     print()
 
     # Compile regex pattern if needed
-    pattern = None
-    if search_term and use_regex:
-        try:
-            pattern = re.compile(search_term, re.IGNORECASE)
-        except re.error as e:
-            print(f"❌ Invalid regex pattern: {e}")
-            return
-
     try:
-        paginator = client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(
-            Bucket=bucket_name,
-            Prefix=prefix
-        )
+        key_filter = olmsted_filters.KeyFilter(prefix, search_term, use_regex, includes, excludes, case_sensitive)
+    except re.error as e:
+        print(f"❌ Invalid regex pattern: {e}")
+        return
+    print_listed_prefixes(key_filter)
 
+    try:
         total_size = 0
         file_count = 0
         skipped_count = 0
 
-        for page in page_iterator:
-            if 'Contents' in page:
-                for obj in page['Contents']:
-                    key = obj['Key']
-                    size = obj['Size']
-                    modified = obj['LastModified']
-
-                    # Skip if doesn't match search term
-                    if search_term:
-                        # Use regex or simple search based on flag
-                        if use_regex:
-                            if not pattern.search(key):
-                                skipped_count += 1
-                                continue
-                        else:
-                            # Case-insensitive substring search
-                            if search_term.lower() not in key.lower():
-                                skipped_count += 1
-                                continue
-
-                    # Display file info
-                    size_str = format_file_size(size)
-                    print(f"  📄 {key}")
-                    print(f"     Size: {size_str}, Modified: {modified}")
-
-                    total_size += size
-                    file_count += 1
+        for obj in key_filter.iter_listing(client, bucket_name):
+            key = obj['Key']
+            size = obj['Size']
+            modified = obj['LastModified']
+
+            # Skip if doesn't match search term or globs
+            if not key_filter.matches(key):
+                skipped_count += 1
+                continue
+
+            # Display file info
+            size_str = format_file_size(size)
+            print(f"  📄 {key}")
+            print(f"     Size: {size_str}, Modified: {modified}")
+
+            total_size += size
+            file_count += 1
 
         print(f"\n=== Summary ===")
-        if search_term:
+        if search_term or includes or excludes:
             filter_type = "regex" if use_regex else "search"
-            print(f"Files matching {filter_type} '{search_term}': {file_count}")
+            if search_term:
+                print(f"Files matching {filter_type} '{search_term}': {file_count}")
+            else:
+                print(f"Files matching include/exclude globs: {file_count}")
             if skipped_count > 0:
                 print(f"Files not matching: {skipped_count}")
         else:
@@ -218,6 +279,15 @@ def list_all_files(client, bucket_name, prefix='', search_term=None, use_regex=F
         print(f"Error accessing bucket: {e}")
 
 
+def print_listed_prefixes(key_filter):
+    """Show which prefixes will actually be listed, when the filter
+    narrowed them beyond --prefix."""
+    prefixes = key_filter.list_prefixes()
+    if prefixes != [key_filter.prefix]:
+        shown = ', '.join(f"'{p}'" for p in prefixes) or '(none — filters cannot match under this prefix)'
+        print(f"Listing only: {shown}\n")
+
+
 def format_file_size(size):
     """Format file size in human-readable format"""
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -243,11 +313,15 @@ Examples:
 
   # Simple substring search (no regex)
   %(prog)s -b mybucket -s main
+
+  # Snapshot the datasets as one compressed archive, or pipe it elsewhere
+  %(prog)s -b mybucket -p data/ --archive data.tar.gz
+  %(prog)s -b mybucket --archive - | aws s3 cp - s3://backups/olmsted.tar
         """,
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
     parser.add_argument('-b', '--bucket', required=True,
-                        help='S3 bucket name')
+                        help='S3 bucket name (or s3://bucket), or file:///path/to/dir for a local target')
     parser.add_argument('-o', '--output', default='./s3-download',
                         help='Local directory to save files (default: ./s3-download)')
     parser.add_argument('-p', '--prefix', default='',
@@ -255,34 +329,125 @@ Examples:
     parser.add_argument('-s', '--search',
                         help='Search term to filter files (case-insensitive)')
     parser.add_argument('-r', '--regex', action='store_true',
-                        help='Treat search term as regex pattern')
+                        help='Treat search term as regex pattern (anchor it with ^ so only '
+                             'matching prefixes are listed)')
+    parser.add_argument('--case-sensitive', action='store_true',
+                        help='Match --regex case-sensitively, so its literal prefix is listed exactly '
+                             '(by default it is only pushed down up to its first letter)')
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                        help='Only keys matching this glob (repeatable; case-sensitive)')
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                        help='Skip keys matching this glob (repeatable; case-sensitive)')
     parser.add_argument('-c', '--creds',
                         help='Path to AWS credentials YAML file')
     parser.add_argument('--list-only', action='store_true',
                         help='Only list files without downloading')
+    parser.add_argument('--hedge', action='store_true',
+                        help='Duplicate small downloads that run longer than usual (see --hedge-percentile) '
+                             'and keep whichever copy finishes first, to cut the slowest few percent of requests')
+    parser.add_argument('--hedge-percentile', type=float, default=olmsted_transfer.DEFAULT_HEDGE_PERCENTILE,
+                        help='With --hedge, duplicate a request once it outlasts this percentile of observed '
+                             'latencies (default: 95)')
+    parser.add_argument('--hedge-max-size', type=int, default=olmsted_transfer.DEFAULT_HEDGE_MAX_SIZE,
+                        help='With --hedge, only hedge objects of at most this many bytes (default: 1 MiB)')
+    parser.add_argument('--archive', metavar='PATH',
+                        help="Stream the files into one tar archive at PATH ('-' for stdout) instead of "
+                             "one file per key under --output")
+    parser.add_argument('--compression', choices=olmsted_archive.COMPRESSIONS,
+                        help='Compress the --archive (default: from its extension, .tar.gz/.tgz or '
+                             '.tar.zst; zstd needs the zstandard package)')
+    parser.add_argument('--archive-concurrency', type=int, default=olmsted_archive.DEFAULT_CONCURRENCY,
+                        help='Concurrent downloads feeding the --archive (default: 8)')
+    parser.add_argument('--archive-buffer', type=int, default=olmsted_archive.DEFAULT_BUFFER_BYTES,
+                        help='Bytes of downloaded files held in memory waiting for their turn in the '
+                             '--archive; larger files are streamed into it directly (default: 256 MiB)')
     parser.add_argument('--anonymous', action='store_true',
                         help='Access public bucket without credentials')
+    parser.add_argument('--range-threshold', type=int, default=256 * 1024 * 1024,
+                        help='Download objects of at least this many bytes with concurrent '
+                             'ranged GETs (default: 256 MiB; 0 disables)')
+    parser.add_argument('--range-size', type=int, default=olmsted_transfer.DEFAULT_RANGE_SIZE,
+                        help='Bytes per ranged GET (default: 64 MiB)')
+    parser.add_argument('--range-concurrency', type=int, default=olmsted_transfer.DEFAULT_RANGE_CONCURRENCY,
+                        help='Concurrent ranged GETs per large object (default: 8)')
+    parser.add_argument('--range-retries', type=int, default=olmsted_transfer.DEFAULT_RANGE_RETRIES,
+                        help='Retries per failed range before giving up on the object (default: 3)')
+    parser.add_argument('--bandwidth-limit', type=olmsted_transfer.parse_rate, metavar='RATE',
+                        help='Cap the combined download rate, e.g. 500K, 10M (bytes per second; default: unlimited)')
+    parser.add_argument('--lane-threshold', type=int, default=olmsted_transfer.DEFAULT_LANE_THRESHOLD,
+                        help='With --bandwidth-limit, files smaller than this many bytes get priority over '
+                             'larger downloads; 0 puts everything in one lane (default: 1 MiB)')
 
     args = parser.parse_args()
+    if args.archive and args.list_only:
+        parser.error('--archive and --list-only are mutually exclusive')
+    if args.compression and not args.archive:
+        parser.error('--compression only applies with --archive')
+    if not 0 < args.hedge_percentile < 100:
+        parser.error('--hedge-percentile must be between 0 and 100')
+
+    # With --archive -, stdout carries the archive; messages go to stderr.
+    archive_out = None
+    if args.archive == '-':
+        if sys.stdout.isatty():
+            parser.error('refusing to write an archive to a terminal; redirect stdout or give --archive a path')
+        archive_out = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            run(args, archive_out)
+    else:
+        run(args, archive_out)
+
 
+def run(args, archive_out=None):
     # Create S3 client
-    if args.creds:
-        print(f"Loading credentials from: {args.creds}")
-        creds = load_credentials(args.creds)
-        client = create_s3_client(creds)
-    elif args.anonymous:
-        print("Using anonymous access (public bucket)")
-        client = create_s3_client()
-    else:
-        # Try default credentials
-        print("Using default AWS credentials")
-        client = boto3.client('s3')
+    def make_client():
+        if args.creds:
+            print(f"Loading credentials from: {args.creds}")
+            creds = load_credentials(args.creds)
+            return create_s3_client(creds)
+        elif args.anonymous:
+            print("Using anonymous access (public bucket)")
+            return create_s3_client()
+        else:
+            # Try default credentials
+            print("Using default AWS credentials")
+            return olmsted_session.client('s3')
+
+    client, bucket = olmsted_storage.connect(args.bucket, make_client)
+
+    ranges = None
+    if args.range_threshold > 0:
+        ranges = {
+            'threshold': args.range_threshold,
+            'size': args.range_size,
+            'concurrency': args.range_concurrency,
+            'retries': args.range_retries,
+        }
+
+    limiter = None
+    if args.bandwidth_limit:
+        limiter = olmsted_transfer.BandwidthLimiter(args.bandwidth_limit, lane_threshold=args.lane_threshold)
+    hedger = olmsted_transfer.Hedger(args.hedge_percentile, args.hedge_max_size) if args.hedge else None
 
     # List or download
+    ok = True
     if args.list_only:
-        list_all_files(client, args.bucket, args.prefix, args.search, args.regex)
+        list_all_files(client, bucket, args.prefix, args.search, args.regex,
+                       args.include, args.exclude, args.case_sensitive)
+    elif args.archive:
+        ok = archive_bucket(client, bucket, args.archive, args.prefix, args.search, args.regex,
+                            args.include, args.exclude, args.case_sensitive, limiter, args.compression,
+                            args.archive_concurrency, args.archive_buffer, archive_out, hedger)
     else:
-        download_bucket(client, args.bucket, args.output, args.prefix, args.search, args.regex)
+        download_bucket(client, bucket, args.output, args.prefix, args.search, args.regex, ranges,
+                        args.include, args.exclude, args.case_sensitive, limiter, hedger)
+    if limiter and limiter.consumed:
+        print(f"Bandwidth limit {format_file_size(limiter.rate)}/s: downloaded "
+              f"{format_file_size(limiter.consumed)}, throttled for {limiter.waited:.1f}s in total")
+    if hedger and hedger.report():
+        print(hedger.report())
+    if not ok:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
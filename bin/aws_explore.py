@@ -1,21 +1,26 @@
 #!/usr/bin/env python3
 
-import boto3
-import yaml
 import os
+import sys
 import argparse
+import heapq
+import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import olmsted_headers
+import olmsted_session
+import olmsted_storage
+
 
 def load_credentials(creds_filename):
     """Load AWS credentials from YAML file"""
-    with open(creds_filename) as handle:
-        return yaml.load(handle, Loader=yaml.SafeLoader)
+    return olmsted_session.load_credentials(creds_filename)
 
 
 def create_s3_client(credentials):
     """Create S3 client with credentials"""
-    return boto3.client("s3", **credentials)
+    return olmsted_session.client("s3", credentials)
 
 
 def list_buckets(client):
@@ -90,6 +95,186 @@ def explore_bucket(client, bucket_name, prefix='', max_keys=20):
         print(f"Error accessing bucket: {e}")
 
 
+class PrefixStats:
+    """Running totals for one prefix: object count, bytes, oldest/newest
+    LastModified and the `top` largest objects (kept in a min-heap, so
+    memory per prefix is bounded no matter how many keys it holds)."""
+
+    def __init__(self, top):
+        self.top = top
+        self.count = 0
+        self.size = 0
+        self.oldest = None
+        self.newest = None
+        self.largest = []
+
+    def add(self, key, size, modified):
+        self.count += 1
+        self.size += size
+        if self.oldest is None or modified < self.oldest:
+            self.oldest = modified
+        if self.newest is None or modified > self.newest:
+            self.newest = modified
+        if self.top:
+            if len(self.largest) < self.top:
+                heapq.heappush(self.largest, (size, key))
+            elif size > self.largest[0][0]:
+                heapq.heapreplace(self.largest, (size, key))
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'size': self.size,
+            'oldest': self.oldest.isoformat() if self.oldest else None,
+            'newest': self.newest.isoformat() if self.newest else None,
+            'largest': [{'key': key, 'size': size} for size, key in sorted(self.largest, reverse=True)],
+        }
+
+
+def prefix_levels(key, base, depth):
+    """Yield `base` and each '/'-delimited prefix of `key` below it, down
+    to `depth` levels (objects deeper than that roll up into the last)."""
+    yield base
+    parts = key[len(base):].split('/')[:-1]
+    for i in range(min(depth, len(parts))):
+        yield base + '/'.join(parts[:i + 1]) + '/'
+
+
+def disk_usage(client, bucket_name, prefix='', depth=2, top=3, sort='size', json_path=None):
+    """Stream the full listing under `prefix` once and report object count,
+    total bytes, oldest/newest LastModified and largest objects for every
+    prefix up to `depth` levels below it."""
+    print(f"\n=== Disk usage of bucket: {bucket_name} ===")
+    print(f"Prefix: '{prefix}' (depth {depth}, sorted by {sort})\n")
+
+    stats = {}
+    children = {}
+    try:
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                parent = None
+                for level in prefix_levels(obj['Key'], prefix, depth):
+                    if level not in stats:
+                        stats[level] = PrefixStats(top)
+                        children[level] = []
+                        if parent is not None:
+                            children[parent].append(level)
+                    stats[level].add(obj['Key'], obj['Size'], obj['LastModified'])
+                    parent = level
+    except Exception as e:
+        print(f"Error accessing bucket: {e}")
+        return
+
+    if not stats:
+        print("No objects found.")
+        return
+
+    sort_keys = {
+        'size': lambda p: (-stats[p].size, p),
+        'count': lambda p: (-stats[p].count, p),
+        'name': lambda p: p,
+    }
+
+    def print_level(parent, indent):
+        for child in sorted(children[parent], key=sort_keys[sort]):
+            entry = stats[child]
+            label = child[len(parent):]
+            newest = entry.newest.strftime('%Y-%m-%d') if entry.newest else '-'
+            oldest = entry.oldest.strftime('%Y-%m-%d') if entry.oldest else '-'
+            print(f"{'  ' * indent}📁 {label:<40} {format_file_size(entry.size):>12} {entry.count:>10} objects  {oldest} … {newest}")
+            for size, key in sorted(entry.largest, reverse=True):
+                print(f"{'  ' * (indent + 2)}📄 {key} ({format_file_size(size)})")
+            print_level(child, indent + 1)
+
+    root = stats[prefix]
+    print(f"{'Prefix':<43} {'Size':>12} {'Count':>10}")
+    print(f"📁 {prefix or '(bucket root)':<40} {format_file_size(root.size):>12} {root.count:>10} objects")
+    for size, key in sorted(root.largest, reverse=True):
+        print(f"    📄 {key} ({format_file_size(size)})")
+    print_level(prefix, 1)
+
+    if json_path:
+        report = {
+            'bucket': bucket_name,
+            'prefix': prefix,
+            'depth': depth,
+            'prefixes': {p: stats[p].to_dict() for p in sorted(stats, key=sort_keys[sort])},
+        }
+        with open(json_path, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"\nJSON report written to {json_path}")
+
+
+def describe_header(value):
+    return repr(value) if value else 'missing'
+
+
+def audit_headers(client, bucket_name, prefix='', policy=olmsted_headers.POLICY,
+                  threads=olmsted_headers.DEFAULT_THREADS, fix=False):
+    """HEAD every object under `prefix` and report those whose
+    Content-Type, Content-Encoding or Cache-Control don't match `policy`
+    (see olmsted_headers). With `fix`, rewrite their headers in place.
+    Returns True if nothing is left out of policy."""
+    print(f"\n=== Header audit of bucket: {bucket_name} ===")
+    print(f"Prefix: '{prefix}' ({threads} concurrent HEAD requests)\n")
+
+    try:
+        objects = []
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            objects.extend(obj for obj in page.get('Contents', []) if not obj['Key'].endswith('/'))
+    except Exception as e:
+        print(f"Error accessing bucket: {e}")
+        return False
+
+    wrong = []
+    errors = 0
+    counts = {name: 0 for name in olmsted_headers.HEADERS}
+    for obj, head, problems in olmsted_headers.audit(client, bucket_name, objects, policy, threads):
+        if head is None:
+            errors += 1
+            print(f"  ❌ {obj['Key']}: {problems}")
+            continue
+        if not problems:
+            continue
+        wrong.append((obj['Key'], head))
+        for name, have, want in problems:
+            counts[name] += 1
+        details = '; '.join(f"{name} {describe_header(have)} → {describe_header(want)}"
+                            for name, have, want in problems)
+        print(f"  ⚠️  {obj['Key']}: {details}")
+
+    print(f"\nAudited {len(objects)} objects: {len(wrong)} out of policy, {errors} unreadable")
+    for name, count in counts.items():
+        if count:
+            print(f"  {name}: {count} wrong or missing")
+
+    if not fix or not wrong:
+        if wrong and not fix:
+            print("\nPass --fix to rewrite their headers in place (metadata-only copy, no re-upload).")
+        return not wrong and not errors
+
+    print(f"\nFixing {len(wrong)} objects...")
+
+    def fix_one(item):
+        key, head = item
+        try:
+            olmsted_headers.fix(client, bucket_name, key, head, policy)
+            return key, None
+        except Exception as e:
+            return key, e
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        for key, error in pool.map(fix_one, wrong):
+            if error is not None:
+                failed += 1
+                print(f"  ❌ {key}: {error}")
+    print(f"Fixed {len(wrong) - failed} objects, {failed} failed")
+    return failed == 0 and not errors
+
+
 def get_bucket_info(client, bucket_name):
     """Get detailed information about a bucket"""
     print(f"\n=== Bucket Information: {bucket_name} ===")
@@ -141,6 +326,7 @@ def interactive_explore(client, known_bucket=None):
         print("  list                    - List all buckets (if permitted)")
         print("  explore <bucket> [prefix] - Explore bucket contents")
         print("  info <bucket>           - Get bucket information")
+        print("  du <bucket> [prefix]    - Storage used per prefix")
         print("  quit                    - Exit")
 
         if known_bucket:
@@ -161,6 +347,8 @@ def interactive_explore(client, known_bucket=None):
             explore_bucket(client, bucket, prefix)
         elif cmd[0] == 'info' and len(cmd) > 1:
             get_bucket_info(client, cmd[1])
+        elif cmd[0] == 'du' and len(cmd) > 1:
+            disk_usage(client, cmd[1], cmd[2] if len(cmd) > 2 else '')
         else:
             print("Invalid command")
 
@@ -171,7 +359,8 @@ def main():
                        default=os.path.join(os.path.expanduser("~"),
                                           ".olmsted/aws-credentials.yaml"),
                        help='Path to AWS credentials YAML file')
-    parser.add_argument('-b', '--bucket', help='Specific bucket to explore')
+    parser.add_argument('-b', '--bucket',
+                       help='Specific bucket to explore (or file:///path/to/dir for a local target)')
     parser.add_argument('-p', '--prefix', default='', help='Prefix to filter objects')
     parser.add_argument('-i', '--interactive', action='store_true',
                        help='Interactive exploration mode')
@@ -179,17 +368,42 @@ def main():
                        help='Show bucket information')
     parser.add_argument('-m', '--max-keys', type=int, default=20,
                        help='Maximum number of objects to display')
+    parser.add_argument('--du', action='store_true',
+                       help='Report storage per prefix over the full listing (ignores --max-keys)')
+    parser.add_argument('--depth', type=int, default=2,
+                       help='With --du, prefix levels below --prefix to report (default: 2)')
+    parser.add_argument('--top', type=int, default=3,
+                       help='With --du, largest objects to show per prefix (default: 3)')
+    parser.add_argument('--sort', choices=['size', 'count', 'name'], default='size',
+                       help='With --du, order of prefixes at each level (default: size)')
+    parser.add_argument('--audit', action='store_true',
+                        help='Check Content-Type, Content-Encoding and Cache-Control of every object under '
+                             '--prefix against the header policy (see olmsted_headers.py)')
+    parser.add_argument('--policy',
+                        help='With --audit, JSON rules that take precedence over the default header policy')
+    parser.add_argument('--fix', action='store_true',
+                        help='With --audit, rewrite out-of-policy headers in place with a metadata-only copy')
+    parser.add_argument('--threads', type=int, default=olmsted_headers.DEFAULT_THREADS,
+                        help='With --audit, concurrent HEAD/copy requests (default: 16)')
+    parser.add_argument('--json', dest='json_path',
+                       help='With --du, also write the report as JSON to this path')
 
     args = parser.parse_args()
+    if (args.policy or args.fix) and not args.audit:
+        parser.error('--policy and --fix only apply with --audit')
 
     # Load credentials and create client
     try:
-        credentials = load_credentials(args.creds_filename)
-        client = create_s3_client(credentials)
+        client, bucket = olmsted_storage.connect(
+            args.bucket or '',
+            lambda: create_s3_client(load_credentials(args.creds_filename)),
+        )
     except Exception as e:
         print(f"Error loading credentials: {e}")
         print(f"Make sure {args.creds_filename} exists and has proper AWS credentials")
         return
+    if args.bucket:
+        args.bucket = bucket
 
     # Execute requested operations
     if args.interactive:
@@ -197,6 +411,12 @@ def main():
     elif args.bucket:
         if args.info:
             get_bucket_info(client, args.bucket)
+        elif args.audit:
+            if not audit_headers(client, args.bucket, args.prefix, olmsted_headers.load_policy(args.policy),
+                                 args.threads, args.fix):
+                sys.exit(1)
+        elif args.du:
+            disk_usage(client, args.bucket, args.prefix, args.depth, args.top, args.sort, args.json_path)
         else:
             explore_bucket(client, args.bucket, args.prefix, args.max_keys)
     else:
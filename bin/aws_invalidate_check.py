@@ -1,14 +1,13 @@
 #!/usr/bin/env python3
 
 import argparse
-import boto3
-import yaml
 import os
 
+import olmsted_session
+
 def load_credentials(creds_filename):
     """Load AWS credentials from YAML file"""
-    with open(creds_filename) as handle:
-        return yaml.load(handle, Loader=yaml.SafeLoader)
+    return olmsted_session.load_credentials(creds_filename)
 
 def check_invalidation_status(client, distribution_id, invalidation_id):
     """Check the status of a specific invalidation"""
@@ -52,7 +51,7 @@ def main():
     credentials = load_credentials(args.creds_filename)
 
     # Create CloudFront client
-    client = boto3.client('cloudfront', **credentials)
+    client = olmsted_session.client('cloudfront', credentials)
 
     # Check invalidation status
     completed = check_invalidation_status(client, args.distribution_id, args.invalidation_id)
@@ -1,23 +1,23 @@
 #!/usr/bin/env python3
 
 import argparse
-import boto3
-import yaml
 import time
 import sys
 import os
 
+import olmsted_session
+
+DEFAULT_CLOUDFRONT_CONFIG = os.path.join(os.path.expanduser("~"), ".olmsted/cloudfront-distribution-id.yaml")
+
 
 def load_credentials(creds_filename):
     """Load AWS credentials from YAML file"""
-    with open(creds_filename) as handle:
-        return yaml.load(handle, Loader=yaml.SafeLoader)
+    return olmsted_session.load_credentials(creds_filename)
 
 def load_cloudfront_config(cloudfront_config_filename):
     """Load CloudFront configuration from YAML file"""
     try:
-        with open(cloudfront_config_filename) as handle:
-            return yaml.load(handle, Loader=yaml.SafeLoader)
+        return olmsted_session.load_yaml(cloudfront_config_filename)
     except FileNotFoundError:
         return None
 
@@ -90,6 +90,49 @@ def wait_for_invalidation(client, distribution_id, invalidation_id, max_wait=300
     return False
 
 
+def invalidate(bucket, paths, creds_filename, distribution_id=None,
+               cloudfront_config_filename=DEFAULT_CLOUDFRONT_CONFIG, wait=True):
+    """Invalidate `paths` on the distribution serving `bucket`. Returns
+    False if no distribution was found or the invalidation failed."""
+    # Load credentials
+    print(f"Loading credentials from {creds_filename}")
+    credentials = load_credentials(creds_filename)
+
+    # Create CloudFront client
+    client = olmsted_session.client('cloudfront', credentials)
+
+    # Get distribution ID if not provided
+    if not distribution_id:
+        # Try to get distribution ID from CloudFront config file
+        cloudfront_config = load_cloudfront_config(cloudfront_config_filename)
+        if cloudfront_config and 'distribution_id' in cloudfront_config:
+            distribution_id = cloudfront_config['distribution_id']
+            print(f"Using distribution ID from config file: {distribution_id}")
+        else:
+            print(f"Finding CloudFront distribution for bucket {bucket}...")
+            distribution_id = get_distribution_id(client, bucket)
+
+        if not distribution_id:
+            print("\n✗ Could not find CloudFront distribution")
+            print("Please provide distribution ID with -d flag")
+            return False
+
+    print(f"Using CloudFront distribution: {distribution_id}")
+    print(f"Invalidating paths: {', '.join(paths)}")
+
+    # Create invalidation
+    invalidation_id = create_invalidation(client, distribution_id, paths)
+    if not invalidation_id:
+        return False
+
+    if wait:
+        wait_for_invalidation(client, distribution_id, invalidation_id)
+
+    print("\n✓ CloudFront cache invalidation process complete")
+    print("Note: It may take 5-10 minutes for the cache to fully clear globally")
+    return True
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Invalidate CloudFront cache for Olmsted deployment'
@@ -118,9 +161,7 @@ def main():
     )
     parser.add_argument(
         '--cloudfront-config',
-        default=os.path.join(
-            os.path.expanduser("~"), ".olmsted/cloudfront-distribution-id.yaml"
-        ),
+        default=DEFAULT_CLOUDFRONT_CONFIG,
         help='CloudFront configuration file'
     )
     parser.add_argument(
@@ -131,41 +172,9 @@ def main():
 
     args = parser.parse_args()
 
-    # Load credentials
-    print(f"Loading credentials from {args.creds_filename}")
-    credentials = load_credentials(args.creds_filename)
-
-    # Create CloudFront client
-    client = boto3.client('cloudfront', **credentials)
-
-    # Get distribution ID if not provided
-    distribution_id = args.distribution_id
-    if not distribution_id:
-        # Try to get distribution ID from CloudFront config file
-        cloudfront_config = load_cloudfront_config(args.cloudfront_config)
-        if cloudfront_config and 'distribution_id' in cloudfront_config:
-            distribution_id = cloudfront_config['distribution_id']
-            print(f"Using distribution ID from config file: {distribution_id}")
-        else:
-            print(f"Finding CloudFront distribution for bucket {args.bucket}...")
-            distribution_id = get_distribution_id(client, args.bucket)
-
-        if not distribution_id:
-            print("\n✗ Could not find CloudFront distribution")
-            print("Please provide distribution ID with -d flag")
-            sys.exit(1)
-
-    print(f"Using CloudFront distribution: {distribution_id}")
-    print(f"Invalidating paths: {', '.join(args.paths)}")
-
-    # Create invalidation
-    invalidation_id = create_invalidation(client, distribution_id, args.paths)
-
-    if invalidation_id and not args.no_wait:
-        wait_for_invalidation(client, distribution_id, invalidation_id)
-
-    print("\n✓ CloudFront cache invalidation process complete")
-    print("Note: It may take 5-10 minutes for the cache to fully clear globally")
+    if not invalidate(args.bucket, args.paths, args.creds_filename, args.distribution_id,
+                      args.cloudfront_config, wait=not args.no_wait):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Pre-warm the CloudFront edge cache for an Olmsted deployment by fetching
+the entry points, the assets they load, datasets.json and (optionally)
+datasets through the distribution, then report latency and X-Cache
+results.
+
+Examples:
+  # Warm the app shell after a deploy
+  %(prog)s -u https://www.olmstedviz.org
+
+  # Also warm two datasets, large ones as 32 MiB ranged GETs
+  %(prog)s -u https://www.olmstedviz.org --dataset pcp-2024 \\
+      --dataset consolidated/big.json.gz --range-size 33554432
+
+  # Rehearse against a local stand-in for CloudFront
+  python3 -m http.server -d /tmp/olmsted-mirror 8000 &
+  %(prog)s -u http://localhost:8000 --dataset all
+"""
+
+import argparse
+import json
+import sys
+
+import olmsted_warm
+
+
+def format_file_size(size):
+    """Format file size in human-readable form."""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} PB"
+
+
+def add_warm_arguments(parser, prefix=""):
+    """Warm-up options, shared with aws_deploy.py (which prefixes them
+    with `warm-`)."""
+    parser.add_argument(
+        f"--{prefix}dataset",
+        dest="warm_datasets",
+        action="append",
+        metavar="ID_OR_PATH",
+        help="Dataset to warm: a dataset_id or consolidated_path from datasets.json, or 'all' (repeatable)",
+    )
+    parser.add_argument(
+        f"--{prefix}concurrency",
+        dest="warm_concurrency",
+        type=int,
+        default=olmsted_warm.DEFAULT_CONCURRENCY,
+        help="Concurrent warm-up requests (default: 8)",
+    )
+    parser.add_argument(
+        f"--{prefix}range-size",
+        dest="warm_range_size",
+        type=int,
+        default=0,
+        help="Warm datasets larger than this many bytes as concurrent ranged GETs (default: 0, whole objects)",
+    )
+
+
+def run_warm(args, base_url, entry_points):
+    """Warm `base_url` with the options from add_warm_arguments. Returns
+    the summary dict."""
+    print(f"Warming {base_url} ({args.warm_concurrency} concurrent requests)...")
+    results = olmsted_warm.warm(
+        base_url,
+        entry_points,
+        args.warm_datasets or [],
+        args.warm_concurrency,
+        args.warm_range_size,
+    )
+    summary = olmsted_warm.print_report(results, format_file_size)
+    summary["results"] = results
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-u", "--url", required=True, help="Site URL served by the distribution (or a local stand-in)")
+    parser.add_argument(
+        "-e",
+        "--entry-point",
+        dest="entry_points",
+        action="append",
+        help="Page whose scripts and stylesheets to warm, repeatable (default: index.html)",
+    )
+    add_warm_arguments(parser)
+    parser.add_argument("--json", dest="json_path", help="Also write every request's result as JSON to this path")
+    args = parser.parse_args()
+
+    summary = run_warm(args, args.url, args.entry_points or ["index.html"])
+    if args.json_path:
+        with open(args.json_path, "w") as handle:
+            json.dump(summary, handle, indent=2)
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
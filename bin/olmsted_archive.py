@@ -0,0 +1,189 @@
+"""Stream bucket objects into a single tar archive for aws_download.py --archive."""
+
+import io
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import olmsted_transfer
+
+COMPRESSIONS = ["none", "gzip", "zstd"]
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BUFFER_BYTES = 256 * 1024 * 1024
+
+_SUFFIXES = {
+    ".tar.gz": "gzip",
+    ".tgz": "gzip",
+    ".tar.zst": "zstd",
+    ".tzst": "zstd",
+}
+
+
+def guess_compression(path):
+    """Compression implied by an archive path's extension ("none" for
+    stdout and plain .tar)."""
+    for suffix, compression in _SUFFIXES.items():
+        if path.lower().endswith(suffix):
+            return compression
+    return "none"
+
+
+def zstd_module(compression):
+    """The zstandard module if `compression` is zstd, else None. Raises
+    RuntimeError if zstd is asked for but zstandard isn't installed, so
+    callers can fail before listing anything."""
+    if compression != "zstd":
+        return None
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd compression needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+class _ThrottledReader:
+    """File object over a response body that reports each read to a
+    boto3-style callback (so --bandwidth-limit applies)."""
+
+    def __init__(self, body, callback):
+        self.body = body
+        self.callback = callback
+
+    def read(self, size=-1):
+        data = self.body.read(size) if size is not None and size >= 0 else self.body.read()
+        if self.callback and data:
+            self.callback(len(data))
+        return data
+
+
+class _ArchiveStream:
+    """The output stream and compressor behind a tarfile in stream mode."""
+
+    def __init__(self, out, compression):
+        self.compressor = None
+        zstandard = zstd_module(compression)
+        if zstandard is not None:
+            self.compressor = zstandard.ZstdCompressor().stream_writer(out, closefd=False)
+            self.tar = tarfile.open(fileobj=self.compressor, mode="w|")
+        else:
+            self.tar = tarfile.open(fileobj=out, mode="w|gz" if compression == "gzip" else "w|")
+        self.out = out
+
+    def close(self):
+        self.tar.close()
+        if self.compressor is not None:
+            self.compressor.close()
+        self.out.flush()
+
+
+def _tarinfo(obj):
+    info = tarfile.TarInfo(obj["Key"])
+    info.size = obj["Size"]
+    info.mode = 0o644
+    if obj.get("LastModified") is not None:
+        info.mtime = int(obj["LastModified"].timestamp())
+    return info
+
+
+def write_archive(
+    client,
+    bucket_name,
+    objects,
+    out,
+    compression="none",
+    concurrency=DEFAULT_CONCURRENCY,
+    buffer_bytes=DEFAULT_BUFFER_BYTES,
+    limiter=None,
+    progress=None,
+    hedger=None,
+):
+    """Write the listed `objects` (dicts with Key, Size and LastModified,
+    in key order) to the binary stream `out` as a tar archive.
+
+    Objects finish downloading out of order, but are written in order:
+    finished ones wait in memory for their turn, and fetches only start
+    while waiting and in-flight objects total at most `buffer_bytes`. An
+    object larger than that is streamed from S3 straight into the archive.
+
+    Small fetches are hedged by `hedger` (an olmsted_transfer.Hedger), if
+    given. `progress(obj, error)` is called as each object is written (error
+    None) or skipped (error the exception). A failure mid-way through a
+    streamed object can't be skipped, since part of it is already in the
+    archive, so it is raised. Returns (written, failed, bytes).
+    """
+    archive = _ArchiveStream(out, compression)
+
+    def get(obj):
+        callback = limiter.callback(obj["Size"]) if limiter else None
+        body = client.get_object(Bucket=bucket_name, Key=obj["Key"])["Body"]
+        try:
+            reader = _ThrottledReader(body, callback)
+            return b"".join(iter(lambda: reader.read(olmsted_transfer.READ_CHUNK), b""))
+        finally:
+            body.close()
+
+    def fetch(obj):
+        # Buffered objects are fetched whole, so they can be hedged.
+        if hedger:
+            return hedger.call("GET", obj["Size"], lambda: get(obj))
+        return get(obj)
+
+    written = failed = total = 0
+    window = deque()
+    buffered = 0
+    position = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+
+        def fill():
+            # Start fetches in key order while the buffer has room; the
+            # next object to write is always started.
+            nonlocal buffered, position
+            while position < len(objects):
+                obj = objects[position]
+                if obj["Size"] > buffer_bytes:
+                    window.append((obj, None))
+                elif buffered + obj["Size"] <= buffer_bytes or not window:
+                    buffered += obj["Size"]
+                    window.append((obj, pool.submit(fetch, obj)))
+                else:
+                    break
+                position += 1
+
+        try:
+            fill()
+            while window:
+                obj, future = window.popleft()
+                if future is None:
+                    body = client.get_object(Bucket=bucket_name, Key=obj["Key"])["Body"]
+                    try:
+                        callback = limiter.callback(obj["Size"]) if limiter else None
+                        archive.tar.addfile(_tarinfo(obj), _ThrottledReader(body, callback))
+                    finally:
+                        body.close()
+                else:
+                    try:
+                        data = future.result()
+                        if len(data) != obj["Size"]:
+                            raise OSError(f"expected {obj['Size']} bytes, got {len(data)}")
+                    except Exception as e:
+                        data = None
+                        failed += 1
+                        if progress:
+                            progress(obj, e)
+                    if data is not None:
+                        archive.tar.addfile(_tarinfo(obj), io.BytesIO(data))
+                    buffered -= obj["Size"]
+                    if data is None:
+                        fill()
+                        continue
+                written += 1
+                total += obj["Size"]
+                if progress:
+                    progress(obj, None)
+                fill()
+        finally:
+            for _, future in window:
+                if future is not None:
+                    future.cancel()
+    archive.close()
+    return written, failed, total
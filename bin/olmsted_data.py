@@ -0,0 +1,590 @@
+"""Streaming readers and writers for consolidated olmsted-cli dataset files."""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import time
+import zlib
+
+MANIFEST_FILENAME = "datasets.json"
+
+# Bytes of decompressed text pulled per read. Each failed decode doubles
+# the next read, so one huge element costs O(size), not O(size^2).
+READ_SIZE = 1 << 20
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+
+class ConsolidatedFormatError(ValueError):
+    """Raised when a file is not a well-formed consolidated dataset."""
+
+
+def is_candidate_consolidated_file(name):
+    """Mirror of `isCandidateConsolidatedFile` in build-datasets-manifest.js."""
+    if name == MANIFEST_FILENAME:
+        return False
+    return name.endswith(".json") or name.endswith(".json.gz")
+
+
+def find_consolidated_files(data_dir):
+    """Return sorted paths (relative to `data_dir`, posix separators) of
+    every candidate consolidated file under `data_dir`. Like the manifest
+    builder, symlinks are not followed."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(data_dir):
+        dirnames.sort()
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            if os.path.islink(full) or not is_candidate_consolidated_file(name):
+                continue
+            found.append(os.path.relpath(full, data_dir).replace(os.sep, "/"))
+    return sorted(found)
+
+
+def open_text(path):
+    """Open a `.json` or `.json.gz` file for reading as UTF-8 text."""
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+class JSONStream:
+    """Incremental reader over a JSON text stream.
+
+    Structural characters (`{`, `[`, `,`, `:`) are consumed by hand;
+    every leaf value and every array element / object member value is
+    handed to the C-accelerated `json.JSONDecoder.raw_decode`, so the
+    peak memory is one element rather than the whole document.
+    """
+
+    def __init__(self, handle, read_size=READ_SIZE):
+        self.handle = handle
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.consumed = 0
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, minimum=None):
+        """Append at least `minimum` more characters to the buffer.
+        Returns False at end of input."""
+        if self.eof:
+            return False
+        if self.pos:
+            self.consumed += self.pos
+            self.buf = self.buf[self.pos :]
+            self.pos = 0
+        chunk = self.handle.read(max(minimum or 0, self.read_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def _error(self, message):
+        return ConsolidatedFormatError(f"{message} at character {self.consumed + self.pos}")
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it,
+        or "" at end of input."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise self._error(f"expected {char!r}, found {found or 'end of input'!r}")
+        self.pos += 1
+
+    def read_value(self):
+        """Decode and return the next complete JSON value."""
+        self.peek()
+        want = self.read_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self._fill(want):
+                    want *= 2
+                    continue
+                raise self._error(f"truncated or invalid JSON ({e.msg})") from None
+            # A number may continue in the next chunk: raw_decode reads
+            # "0." as 0 and "-2.5e" as -2.5. If only number characters
+            # follow it up to the end of the buffer, re-decode once more
+            # text is available.
+            if self._may_continue(value, end) and self._fill(want):
+                want *= 2
+                continue
+            self.pos = end
+            return value
+
+    def _may_continue(self, value, end):
+        if end >= len(self.buf):
+            return True
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return all(char in _NUMBER_CHARS for char in self.buf[end:])
+
+    def _iter_items(self, close):
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            found = self.peek()
+            self.pos += 1
+            if found == close:
+                return
+            if found != ",":
+                self.pos -= 1
+                raise self._error(f"expected ',' or {close!r}, found {found or 'end of input'!r}")
+
+    def iter_array(self):
+        """Yield the elements of the array at the current position."""
+        self.expect("[")
+        for _ in self._iter_items("]"):
+            yield self.read_value()
+
+    def iter_object(self):
+        """Yield the keys of the object at the current position. The caller
+        MUST consume each member's value (`read_value`, `iter_array`,
+        `iter_object` or `skip_value`) before advancing the generator."""
+        self.expect("{")
+        for _ in self._iter_items("}"):
+            if self.peek() != '"':
+                raise self._error("expected object key")
+            key = self.read_value()
+            self.expect(":")
+            yield key
+
+    def skip_value(self):
+        """Consume the next value, streaming through arrays and objects."""
+        char = self.peek()
+        if char == "[":
+            for _ in self.iter_array():
+                pass
+        elif char == "{":
+            for _ in self.iter_object():
+                self.skip_value()
+        else:
+            self.read_value()
+
+    def finish(self):
+        """Assert nothing but whitespace follows the top-level value."""
+        if self.peek():
+            raise self._error("unexpected data after top-level value")
+
+
+def iter_consolidated(path, stats=None):
+    """Stream a consolidated file as a sequence of events:
+
+      ("metadata", value)
+      ("dataset", dataset)                  # one per `datasets` element
+      ("clones_group", dataset_id)          # one per `clones` member
+      ("clone", dataset_id, clone)          # one per clone, per dataset
+      ("tree", tree)                        # one per `trees` element
+      ("other", key, value)                 # any other top-level member
+
+    Each of the four required members must be present and well typed;
+    `ConsolidatedFormatError` is raised as soon as that's known not to
+    hold, and gzip/JSON truncation surfaces as the underlying error.
+
+    If `stats` is a dict, `uncompressed_bytes` is set in it once the file
+    has been read to the end.
+    """
+    with open_text(path) as handle:
+        stream = JSONStream(handle)
+        if stream.peek() != "{":
+            raise ConsolidatedFormatError("top-level value is not an object")
+        seen = set()
+        for key in stream.iter_object():
+            seen.add(key)
+            kind = stream.peek()
+            if key == "metadata":
+                value = stream.read_value()
+                if not isinstance(value, dict):
+                    raise ConsolidatedFormatError("`metadata` must be an object")
+                yield ("metadata", value)
+            elif key == "datasets":
+                if kind != "[":
+                    raise ConsolidatedFormatError("`datasets` must be an array")
+                for dataset in stream.iter_array():
+                    yield ("dataset", dataset)
+            elif key == "clones":
+                if kind != "{":
+                    raise ConsolidatedFormatError("`clones` must be an object")
+                for dataset_id in stream.iter_object():
+                    if stream.peek() != "[":
+                        raise ConsolidatedFormatError(f"`clones.{dataset_id}` must be an array")
+                    yield ("clones_group", dataset_id)
+                    for clone in stream.iter_array():
+                        yield ("clone", dataset_id, clone)
+            elif key == "trees":
+                if kind != "[":
+                    raise ConsolidatedFormatError("`trees` must be an array")
+                for tree in stream.iter_array():
+                    yield ("tree", tree)
+            else:
+                yield ("other", key, stream.read_value())
+        stream.finish()
+        if stats is not None:
+            stats["uncompressed_bytes"] = handle.buffer.tell()
+    missing = [k for k in ("metadata", "datasets", "clones", "trees") if k not in seen]
+    if missing:
+        raise ConsolidatedFormatError(f"missing top-level member(s): {', '.join(missing)}")
+
+
+def validate_consolidated_file(path):
+    """Fully decompress and parse `path`, checking the consolidated shape.
+
+    Never raises: returns a result dict suitable for sending back from a
+    worker process, with `ok`, `error`, `seconds`, `bytes` (on disk) and
+    the dataset/clone/tree counts seen.
+    """
+    start = time.perf_counter()
+    result = {"path": path, "ok": False, "error": None, "bytes": 0, "datasets": 0, "clones": 0, "trees": 0}
+    try:
+        result["bytes"] = os.path.getsize(path)
+        for event in iter_consolidated(path):
+            kind = event[0]
+            if kind == "dataset":
+                result["datasets"] += 1
+            elif kind == "clone":
+                result["clones"] += 1
+            elif kind == "tree":
+                result["trees"] += 1
+        if result["datasets"] == 0:
+            raise ConsolidatedFormatError("`datasets` is empty")
+        result["ok"] = True
+    except (OSError, EOFError, ValueError, zlib.error) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def dataset_stem(relpath):
+    """Strip the `.json` / `.json.gz` suffix from a consolidated path."""
+    for suffix in (".json.gz", ".json"):
+        if relpath.endswith(suffix):
+            return relpath[: -len(suffix)]
+    return relpath
+
+
+def compact_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def write_gzipped_json(path, value, compresslevel=6):
+    """Write `value` as compact gzipped JSON. The gzip header's mtime is
+    zeroed so the same value always gives the same bytes, and unchanged
+    shards aren't re-uploaded by --changed-only."""
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=compresslevel, mtime=0) as out:
+            out.write(compact_json(value).encode("utf-8"))
+
+
+def shard_consolidated_file(path, out_dir, max_bytes=8 << 20, compresslevel=6):
+    """Split a consolidated file into a dataset header plus shards of
+    clonal families, written under `out_dir`:
+
+      header.json.gz       {metadata, datasets, shard_count, ...}
+      shard-00000.json.gz  {clones: {dataset_id: [...]}, trees: [...]}
+      index.json           {shards: [...], clones: {clone_id: shard}}
+
+    A family (one clone plus every tree whose `clone_id` points at it) is
+    never split across shards. Families are packed, in file order, into
+    the current shard until its serialised size reaches `max_bytes`;
+    `max_bytes=0` gives one shard per family.
+
+    The streaming pass spools each clone/tree to a scratch file and keeps
+    only its offset, so memory is bounded by the largest shard rather
+    than the whole dataset. Returns the index dict (also written to
+    index.json).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    header = {}
+    datasets = []
+    families = {}  # clone_id -> [(offset, length), ...], in first-seen order
+    family_bytes = {}
+    spool_path = os.path.join(out_dir, ".spool")
+
+    try:
+        with open(spool_path, "wb") as spool:
+            for event in iter_consolidated(path):
+                kind = event[0]
+                if kind == "metadata":
+                    header["metadata"] = event[1]
+                    continue
+                if kind == "dataset":
+                    datasets.append(event[1])
+                    continue
+                if kind == "other":
+                    header[event[1]] = event[2]
+                    continue
+                if kind == "clones_group":
+                    continue
+                if kind == "clone":
+                    _, dataset_id, clone = event
+                    clone_id = clone.get("clone_id", clone.get("ident"))
+                    data = compact_json(["clone", dataset_id, clone]).encode("utf-8")
+                else:
+                    clone_id = event[1].get("clone_id")
+                    data = compact_json(["tree", None, event[1]]).encode("utf-8")
+                families.setdefault(clone_id, []).append((spool.tell(), len(data)))
+                family_bytes[clone_id] = family_bytes.get(clone_id, 0) + len(data)
+                spool.write(data)
+
+        shards = []
+        shard_of = {}
+        for clone_id, nbytes in family_bytes.items():
+            if not shards or shards[-1][1] >= max_bytes:
+                shards.append([[], 0])
+            shards[-1][0].append(clone_id)
+            shards[-1][1] += nbytes
+            shard_of[clone_id] = len(shards) - 1
+
+        index = {"source": os.path.basename(path), "max_bytes": max_bytes, "shards": [], "clones": shard_of}
+        with open(spool_path, "rb") as spool:
+            for number, (clone_ids, _) in enumerate(shards):
+                clones = {}
+                trees = []
+                for clone_id in clone_ids:
+                    for offset, length in families[clone_id]:
+                        spool.seek(offset)
+                        kind, dataset_id, item = json.loads(spool.read(length))
+                        if kind == "clone":
+                            clones.setdefault(dataset_id, []).append(item)
+                        else:
+                            trees.append(item)
+                name = f"shard-{number:05d}.json.gz"
+                shard_path = os.path.join(out_dir, name)
+                write_gzipped_json(shard_path, {"clones": clones, "trees": trees}, compresslevel)
+                index["shards"].append(
+                    {
+                        "path": name,
+                        "clones": sum(len(group) for group in clones.values()),
+                        "trees": len(trees),
+                        "bytes": os.path.getsize(shard_path),
+                    }
+                )
+
+        header["datasets"] = datasets
+        header["shard_count"] = len(shards)
+        header_path = os.path.join(out_dir, "header.json.gz")
+        write_gzipped_json(header_path, header, compresslevel)
+        with open(os.path.join(out_dir, "index.json"), "w", encoding="utf-8") as out:
+            out.write(compact_json(index))
+        return index
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+def file_sha256(path, block_size=READ_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _log2_bin(value):
+    """Lower bound of the power-of-two bucket holding `value` (0 for <= 0)."""
+    value = int(value or 0)
+    return 0 if value <= 0 else 1 << (value.bit_length() - 1)
+
+
+def _histogram(counter):
+    return [[low, counter[low]] for low in sorted(counter)]
+
+
+def summarize_consolidated_file(path, cache_dir=None, sha256=None):
+    """Compute a compact summary of a consolidated file in one streaming
+    pass: dataset/clone/tree counts, per-family sizes, log2 histograms of
+    family sequence counts and tree node counts, and on-disk/uncompressed
+    byte sizes.
+
+    Summaries are cached in `cache_dir` (if given) under the file's
+    SHA-256, so an unchanged file is never re-parsed. Pass `sha256` if it
+    is already known (e.g. from olmsted_hashes.HashCache) to skip hashing
+    the file too. Returns the summary dict; `cached` says whether it came
+    from cache.
+    """
+    sha256 = sha256 or file_sha256(path)
+    cache_path = os.path.join(cache_dir, f"{sha256}.json") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as handle:
+            summary = json.load(handle)
+        summary["cached"] = True
+        return summary
+
+    stats = {}
+    families = {}  # clone_id -> [unique_seqs_count, tree_count, max_tree_nodes, bytes]
+    clones_per_dataset = {}
+    seqs_histogram = {}
+    nodes_histogram = {}
+    counts = {"datasets": 0, "clones": 0, "trees": 0}
+
+    for event in iter_consolidated(path, stats):
+        kind = event[0]
+        if kind == "dataset":
+            counts["datasets"] += 1
+        elif kind == "clone":
+            _, dataset_id, clone = event
+            counts["clones"] += 1
+            clones_per_dataset[dataset_id] = clones_per_dataset.get(dataset_id, 0) + 1
+            family = families.setdefault(clone.get("clone_id", clone.get("ident")), [0, 0, 0, 0])
+            family[0] = clone.get("unique_seqs_count") or 0
+            family[3] += len(compact_json(clone))
+            low = _log2_bin(family[0])
+            seqs_histogram[low] = seqs_histogram.get(low, 0) + 1
+        elif kind == "tree":
+            tree = event[1]
+            counts["trees"] += 1
+            nodes = len(tree.get("nodes") or [])
+            family = families.setdefault(tree.get("clone_id"), [0, 0, 0, 0])
+            family[1] += 1
+            family[2] = max(family[2], nodes)
+            family[3] += len(compact_json(tree))
+            low = _log2_bin(nodes)
+            nodes_histogram[low] = nodes_histogram.get(low, 0) + 1
+
+    summary = {
+        "source": os.path.basename(path),
+        "sha256": sha256,
+        "bytes": os.path.getsize(path),
+        "uncompressed_bytes": stats.get("uncompressed_bytes"),
+        **counts,
+        "clones_per_dataset": clones_per_dataset,
+        "histograms": {
+            "unique_seqs_count": _histogram(seqs_histogram),
+            "tree_nodes": _histogram(nodes_histogram),
+        },
+        "family_columns": ["clone_id", "unique_seqs_count", "trees", "max_tree_nodes", "bytes"],
+        "families": [[clone_id] + values for clone_id, values in families.items()],
+    }
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            handle.write(compact_json(summary))
+        os.replace(tmp_path, cache_path)
+    summary["cached"] = False
+    return summary
+
+
+def _round_floats(value, ndigits):
+    if isinstance(value, float):
+        return round(value, ndigits)
+    if isinstance(value, dict):
+        return {key: _round_floats(item, ndigits) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_round_floats(item, ndigits) for item in value]
+    return value
+
+
+def reencode_consolidated_file(path, out_path, float_precision=None, compresslevel=9):
+    """Stream `path` into `out_path` as canonical minified JSON: no
+    insignificant whitespace, object keys sorted within every value, and
+    floats rounded to `float_precision` decimal places (None keeps them).
+    Top-level members keep their file order, so olmsted-cli output always
+    re-encodes to the same bytes.
+
+    `.json.gz` output is gzipped at `compresslevel` with a zeroed mtime so
+    the compressed bytes are deterministic too. Returns a result dict with
+    the input/output sizes and timing.
+    """
+    start = time.perf_counter()
+    encoder = json.JSONEncoder(separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+
+    def encode(value):
+        if float_precision is not None:
+            value = _round_floats(value, float_precision)
+        return encoder.encode(value)
+
+    if out_path.endswith(".gz"):
+        raw = open(out_path, "wb")
+        binary = gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=compresslevel, mtime=0)
+    else:
+        raw = None
+        binary = open(out_path, "wb")
+    out = io.TextIOWrapper(binary, encoding="utf-8")
+    try:
+        written = []  # top-level keys, in output order
+        current = None  # top-level key whose container is still open
+        group = None  # open `clones` member
+        first = True  # first element of the innermost open container
+
+        def open_member(key, opener):
+            nonlocal current, first
+            close_member()
+            out.write(("," if written else "") + encoder.encode(key) + ":" + opener)
+            written.append(key)
+            current = key
+            first = True
+
+        def close_member():
+            nonlocal current, group
+            if current == "clones":
+                out.write("]}" if group is not None else "}")
+            elif current in ("datasets", "trees"):
+                out.write("]")
+            current = group = None
+
+        def element(text):
+            nonlocal first
+            out.write(text if first else "," + text)
+            first = False
+
+        out.write("{")
+        for event in iter_consolidated(path):
+            kind = event[0]
+            if kind in ("metadata", "other"):
+                key, value = ("metadata", event[1]) if kind == "metadata" else event[1:]
+                close_member()
+                out.write(("," if written else "") + encoder.encode(key) + ":" + encode(value))
+                written.append(key)
+            elif kind == "dataset":
+                if current != "datasets":
+                    open_member("datasets", "[")
+                element(encode(event[1]))
+            elif kind == "clones_group":
+                if current != "clones":
+                    open_member("clones", "{")
+                if group is not None:
+                    out.write("],")
+                out.write(encoder.encode(event[1]) + ":[")
+                group = event[1]
+                first = True
+            elif kind == "clone":
+                element(encode(event[2]))
+            elif kind == "tree":
+                if current != "trees":
+                    open_member("trees", "[")
+                element(encode(event[1]))
+        close_member()
+        # Empty containers produce no events; restore them.
+        for key, empty in (("datasets", "[]"), ("clones", "{}"), ("trees", "[]")):
+            if key not in written:
+                out.write(("," if written else "") + encoder.encode(key) + ":" + empty)
+                written.append(key)
+        out.write("}")
+    finally:
+        out.close()
+        if raw is not None:
+            raw.close()
+    return {
+        "path": path,
+        "bytes_in": os.path.getsize(path),
+        "bytes_out": os.path.getsize(out_path),
+        "seconds": time.perf_counter() - start,
+    }
@@ -0,0 +1,133 @@
+"""Streaming merge-join diff of two object trees for aws_diff.py."""
+
+import os
+
+import olmsted_hashes
+import olmsted_storage
+
+ONLY_LEFT = "only-left"
+ONLY_RIGHT = "only-right"
+CHANGED = "changed"
+IDENTICAL = "identical"
+STATUSES = [ONLY_LEFT, ONLY_RIGHT, CHANGED, IDENTICAL]
+
+
+class Source:
+    """One side of a diff: a bucket and prefix (always ending in "/"), a
+    file:// target, or a local directory. Entries are listed in S3 key
+    order, with keys relative to the prefix."""
+
+    def __init__(self, spec, make_s3_client):
+        self.spec = spec
+        self.client = None
+        self.bucket = None
+        self.prefix = ""
+        self.root = None
+        if spec.startswith("s3://"):
+            bucket, _, self.prefix = spec[len("s3://") :].partition("/")
+            # Keys are relative to the prefix, so they mustn't start with "/".
+            if self.prefix and not self.prefix.endswith("/"):
+                self.prefix += "/"
+            self.client, self.bucket = olmsted_storage.connect(bucket, make_s3_client, lazy=True)
+        elif olmsted_storage.is_local(spec):
+            self.client, self.bucket = olmsted_storage.connect(spec, make_s3_client)
+        else:
+            self.root = os.path.abspath(os.path.expanduser(spec))
+            if not os.path.isdir(self.root):
+                raise ValueError(f"{spec} is not a directory (use s3://bucket[/prefix] for a bucket)")
+
+    @property
+    def is_local(self):
+        return self.root is not None
+
+    def full_key(self, key):
+        """The key (or local path) `key` has, or would have, in this
+        source."""
+        if self.is_local:
+            return os.path.join(self.root, *key.split("/"))
+        return self.prefix + key
+
+    def entries(self, key_filter=None):
+        """Yield (key, size, etag, path) in S3 key order."""
+        if self.is_local:
+            yield from _walk(self.root, "", key_filter)
+            return
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                key = obj["Key"][len(self.prefix) :]
+                if not key or key.endswith("/") or (key_filter and not key_filter.matches(key)):
+                    continue
+                yield key, obj["Size"], obj["ETag"].strip('"'), None
+
+
+def _walk(directory, key_prefix, key_filter):
+    names = []
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            if not key_prefix and entry.name == olmsted_storage.META_DIR:
+                continue
+            is_dir = entry.is_dir()
+            names.append(((entry.name + "/" if is_dir else entry.name).encode("utf-8"), entry.name, is_dir))
+    # A directory sorts as "d/", which gives S3 key order while holding
+    # only one directory's entries in memory.
+    for _, name, is_dir in sorted(names):
+        path = os.path.join(directory, name)
+        key = key_prefix + name
+        if is_dir:
+            yield from _walk(path, key + "/", key_filter)
+        elif os.path.isfile(path) and (key_filter is None or key_filter.matches(key)):
+            yield key, os.path.getsize(path), None, path
+
+
+def merge_join(left, right):
+    """Walk two key-ordered entry iterators in step. Yields
+    (key, left_entry, right_entry), with None for a missing side."""
+    sentinel = object()
+    left, right = iter(left), iter(right)
+    a, b = next(left, sentinel), next(right, sentinel)
+    while a is not sentinel or b is not sentinel:
+        if b is sentinel or (a is not sentinel and a[0].encode("utf-8") < b[0].encode("utf-8")):
+            yield a[0], a, None
+            a = next(left, sentinel)
+        elif a is sentinel or b[0].encode("utf-8") < a[0].encode("utf-8"):
+            yield b[0], None, b
+            b = next(right, sentinel)
+        else:
+            yield a[0], a, b
+            a, b = next(left, sentinel), next(right, sentinel)
+
+
+def _same_content(left, right, hash_cache):
+    """Compare two same-size entries by ETag (two bucket objects), MD5
+    (two local files), or a local file's digests against an ETag."""
+    if left[2] is not None and right[2] is not None:
+        return left[2] == right[2]
+    if left[2] is None and right[2] is None:
+        return hash_cache.get(left[3])["md5"] == hash_cache.get(right[3])["md5"]
+    local, remote = (left, right) if left[2] is None else (right, left)
+    return olmsted_hashes.etag_matches(hash_cache.get(local[3]), remote[2])
+
+
+def classify(left, right, hash_cache=None, size_only=False):
+    """(status, reason) for one merge_join row. Without a hash cache (or
+    with `size_only`), same-size objects count as identical."""
+    if right is None:
+        return ONLY_LEFT, None
+    if left is None:
+        return ONLY_RIGHT, None
+    if left[1] != right[1]:
+        return CHANGED, "size"
+    if size_only or (hash_cache is None and (left[2] is None or right[2] is None)):
+        return IDENTICAL, None
+    if not _same_content(left, right, hash_cache):
+        return CHANGED, "etag" if left[2] is not None and right[2] is not None else "content"
+    return IDENTICAL, None
+
+
+def diff(left, right, hash_cache=None, size_only=False, key_filter=None):
+    """Yield (status, key, reason, left_entry, right_entry) for every key
+    in either source, in key order."""
+    for key, a, b in merge_join(left.entries(key_filter), right.entries(key_filter)):
+        status, reason = classify(a, b, hash_cache, size_only)
+        yield status, key, reason, a, b
@@ -0,0 +1,187 @@
+"""Key filters that list only the prefixes a match can start with."""
+
+import fnmatch
+import re
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+MAX_PREFIXES = 16
+
+
+def _sequence_prefixes(items, limit):
+    """Literal prefixes for a sequence of parsed regex items.
+
+    Returns (prefixes, complete): every match of the sequence starts with
+    one of `prefixes`, and if `complete` the match is exactly one of them
+    (so whatever follows can extend the prefixes further).
+    """
+    prefixes = [""]
+    for op, av in items:
+        alternatives, complete = _item_prefixes(op, av, limit)
+        extended = [p + q for p in prefixes for q in alternatives]
+        if len(extended) > limit:
+            return prefixes, False
+        prefixes = extended
+        if not complete:
+            return prefixes, False
+    return prefixes, True
+
+
+def _item_prefixes(op, av, limit):
+    if op is sre_constants.LITERAL:
+        return [chr(av)], True
+    if op is sre_constants.IN and all(item_op is sre_constants.LITERAL for item_op, _ in av):
+        # `[ab]`, and also what sre_parse turns `a|b` into.
+        return [chr(code) for _, code in av], True
+    if op is sre_constants.SUBPATTERN:
+        _group, add_flags, _del_flags, body = av
+        if add_flags & (re.IGNORECASE | re.MULTILINE):
+            return [""], False
+        return _sequence_prefixes(body, limit)
+    if op is sre_constants.BRANCH:
+        alternatives = []
+        complete = True
+        for branch in av[1]:
+            prefixes, branch_complete = _sequence_prefixes(branch, limit)
+            alternatives.extend(prefixes)
+            complete = complete and branch_complete
+        if len(alternatives) > limit:
+            return [""], False
+        return alternatives, complete
+    if op is sre_constants.MAX_REPEAT or op is sre_constants.MIN_REPEAT:
+        low, high, body = av
+        if low < 1:
+            return [""], False
+        prefixes, complete = _sequence_prefixes(body, limit)
+        return prefixes, complete and low == high == 1
+    return [""], False
+
+
+def regex_prefixes(pattern, limit=MAX_PREFIXES):
+    """Literal prefixes every key matched by `re.search(pattern, key)`
+    must start with, or `[""]` if none can be derived (unanchored
+    pattern, unsupported syntax, or more than `limit` alternatives).
+    Case folding is not considered here; see `caseless_prefixes`."""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError):
+        return [""]
+    if parsed.state.flags & re.MULTILINE:
+        # ^ may match after any newline in the key.
+        return [""]
+    items = list(parsed)
+    anchors = [(sre_constants.AT, sre_constants.AT_BEGINNING), (sre_constants.AT, sre_constants.AT_BEGINNING_STRING)]
+    if not items or items[0] not in anchors:
+        return [""]
+    prefixes, _ = _sequence_prefixes(items[1:], limit)
+    return prefixes
+
+
+def glob_prefix(pattern):
+    """Literal text before the first glob metacharacter."""
+    match = re.search(r"[*?\[]", pattern)
+    return pattern[: match.start()] if match else pattern
+
+
+def caseless_prefixes(prefixes):
+    """Cut each prefix before its first cased character, leaving what a
+    case-insensitive match must start with exactly."""
+    cut = []
+    for prefix in prefixes:
+        for i, char in enumerate(prefix):
+            if char.lower() != char.upper():
+                prefix = prefix[:i]
+                break
+        cut.append(prefix)
+    return minimize_prefixes(cut)
+
+
+def minimize_prefixes(prefixes):
+    """Sorted prefixes with any prefix covered by a shorter one dropped,
+    so listing each of them never returns the same key twice."""
+    result = []
+    for prefix in sorted(set(prefixes)):
+        if result and prefix.startswith(result[-1]):
+            continue
+        result.append(prefix)
+    return result
+
+
+def narrow(base, prefixes):
+    """Intersect the user's `--prefix` with derived prefixes. Returns the
+    prefixes to list; empty if they can't both hold."""
+    narrowed = []
+    for prefix in prefixes:
+        if prefix.startswith(base):
+            narrowed.append(prefix)
+        elif base.startswith(prefix):
+            narrowed.append(base)
+    return minimize_prefixes(narrowed)
+
+
+class KeyFilter:
+    """Decides which keys a script acts on, and which prefixes it needs
+    to list to find them all:
+
+      -r -s '^data/consolidated/foo.*\\.json\\.gz$'  ->  data/consolidated/foo
+      -r -s '^data/(summaries|shards)/'              ->  data/summaries/, data/shards/
+      --include 'data/*.json.gz'                     ->  data/
+
+    Unanchored regexes and substring searches list all of `prefix`.
+    Regexes are case-insensitive unless `case_sensitive` is set, but S3
+    prefixes aren't, so by default a regex's prefix is only pushed down
+    up to its first letter: `^2024/` is listed exactly, `^data/...` not
+    at all. The examples above assume `case_sensitive`.
+    """
+
+    def __init__(self, prefix="", search_term=None, use_regex=False, includes=None, excludes=None, case_sensitive=False):
+        self.prefix = prefix or ""
+        self.search_term = search_term
+        self.use_regex = use_regex
+        self.includes = list(includes or [])
+        self.excludes = list(excludes or [])
+        self.case_sensitive = case_sensitive
+        self.pattern = None
+        if search_term and use_regex:
+            # Raises re.error; callers report it as before.
+            self.pattern = re.compile(search_term, 0 if case_sensitive else re.IGNORECASE)
+
+    def matches(self, key):
+        if not key.startswith(self.prefix):
+            return False
+        if self.search_term:
+            if self.pattern is not None:
+                if not self.pattern.search(key):
+                    return False
+            elif self.search_term.lower() not in key.lower():
+                return False
+        if self.includes and not any(fnmatch.fnmatchcase(key, g) for g in self.includes):
+            return False
+        if any(fnmatch.fnmatchcase(key, g) for g in self.excludes):
+            return False
+        return True
+
+    def list_prefixes(self):
+        """Prefixes to pass to ListObjectsV2, in key order."""
+        prefixes = [self.prefix]
+        if self.pattern is not None:
+            derived = regex_prefixes(self.search_term)
+            if not self.case_sensitive or self.pattern.flags & re.IGNORECASE:
+                derived = caseless_prefixes(derived)
+            prefixes = narrow(self.prefix, derived)
+        if self.includes:
+            prefixes = [p for base in prefixes for p in narrow(base, [glob_prefix(g) for g in self.includes])]
+        return minimize_prefixes(prefixes)
+
+    def iter_listing(self, client, bucket_name, **paginate_args):
+        """Yield every listed object under `list_prefixes()`, in key order,
+        matched or not, so callers can count what they skipped."""
+        paginator = client.get_paginator("list_objects_v2")
+        for prefix in self.list_prefixes():
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, **paginate_args):
+                yield from page.get("Contents", [])
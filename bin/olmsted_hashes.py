@@ -0,0 +1,150 @@
+"""Local file digests and S3 ETags, cached across deploys."""
+
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".olmsted/hash-cache.json")
+
+# boto3's TransferConfig defaults: files at or above the threshold are
+# uploaded in parts of this size, which determines their ETag.
+S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+
+def _stat_key(st):
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def compute_digests(path, part_size=S3_MULTIPART_CHUNKSIZE):
+    """Hash `path` in one pass over a read-only mmap.
+
+    Returns {"md5", "sha256", "etag", "part_size"}, where `etag` is what
+    S3 reports after a boto3 upload with `part_size` as both multipart
+    threshold and chunk size: the plain MD5 below the threshold, else the
+    MD5 of the concatenated part MD5s suffixed with `-<part count>`.
+    """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    part_digests = []
+    size = os.path.getsize(path)
+    if size:
+        with open(path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, part_size):
+                    part = view[offset : offset + part_size]
+                    md5.update(part)
+                    sha256.update(part)
+                    if size >= part_size:
+                        part_digests.append(hashlib.md5(part).digest())
+                    part.release()
+            finally:
+                view.release()
+    if part_digests:
+        etag = f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+    else:
+        etag = md5.hexdigest()
+    return {"md5": md5.hexdigest(), "sha256": sha256.hexdigest(), "etag": etag, "part_size": part_size}
+
+
+def etag_matches(digests, etag):
+    """True if an object with S3 ETag `etag` holds the bytes `digests`
+    (from `compute_digests`) describe. An object written by a single PUT
+    or by a server-side copy has its plain MD5 as ETag, whatever its
+    size, so a plain ETag is also compared with the MD5."""
+    return etag == digests["etag"] or ("-" not in etag and etag == digests["md5"])
+
+
+def _compute_for_pool(args):
+    path, part_size = args
+    return path, compute_digests(path, part_size)
+
+
+class HashCache:
+    """Digests of local files, persisted as JSON at `path`.
+
+    Entries are keyed by absolute path and reused only while the file's
+    inode, size and mtime are unchanged. Call `save()` to persist; it
+    writes atomically, so an interrupted deploy never corrupts the cache.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, part_size=S3_MULTIPART_CHUNKSIZE):
+        self.path = path
+        self.part_size = part_size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path) as handle:
+                    self.entries = json.load(handle)
+            except ValueError:
+                print(f"Warning: ignoring unreadable hash cache {path}")
+
+    def _lookup(self, abspath, st):
+        entry = self.entries.get(abspath)
+        if entry and entry["stat"] == _stat_key(st) and entry["digests"]["part_size"] == self.part_size:
+            return entry["digests"]
+        return None
+
+    def _store(self, abspath, st, digests):
+        self.entries[abspath] = {"stat": _stat_key(st), "digests": digests}
+        self.dirty = True
+
+    def get(self, path):
+        """Digests for one file, hashing it in-process on a cache miss."""
+        abspath = os.path.abspath(path)
+        st = os.stat(abspath)
+        digests = self._lookup(abspath, st)
+        if digests is not None:
+            self.hits += 1
+            return digests
+        self.misses += 1
+        digests = compute_digests(abspath, self.part_size)
+        self._store(abspath, st, digests)
+        return digests
+
+    def get_many(self, paths, jobs=None):
+        """Digests for many files: {path: digests}. Cache misses are hashed
+        in a pool of `jobs` processes."""
+        results = {}
+        misses = []
+        for path in paths:
+            abspath = os.path.abspath(path)
+            st = os.stat(abspath)
+            digests = self._lookup(abspath, st)
+            if digests is not None:
+                self.hits += 1
+                results[path] = digests
+            else:
+                misses.append((path, abspath, st))
+        self.misses += len(misses)
+        if misses:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                work = [(abspath, self.part_size) for _, abspath, _ in misses]
+                chunksize = max(1, len(work) // (4 * (jobs or os.cpu_count() or 1)))
+                computed = dict(pool.map(_compute_for_pool, work, chunksize=chunksize))
+            for path, abspath, st in misses:
+                results[path] = computed[abspath]
+                self._store(abspath, st, computed[abspath])
+        return results
+
+    def prune(self):
+        """Drop entries for files that no longer exist."""
+        for abspath in [p for p in self.entries if not os.path.exists(p)]:
+            del self.entries[abspath]
+            self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as handle:
+            json.dump(self.entries, handle, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self.dirty = False
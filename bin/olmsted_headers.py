@@ -0,0 +1,133 @@
+"""Served-header policy: what aws_deploy.py uploads with and aws_explore.py --audit checks."""
+
+import fnmatch
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import olmsted_releases
+
+HEADERS = ["ContentType", "ContentEncoding", "CacheControl"]
+DEFAULT_THREADS = 16
+
+# S3 copies objects up to 5 GB in one copy_object call.
+MAX_COPY_SIZE = 5 * 1024**3
+
+CONTENT_TYPES = {
+    ".json": "application/json",
+    ".gz": "application/gzip",
+    ".html": "text/html",
+    ".css": "text/css",
+    "": "text/plain",
+    ".txt": "text/plain",
+    ".js": "text/javascript",
+    ".map": "application/json",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".ico": "image/x-icon",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+}
+
+# (glob, headers) rules. For each header, the first matching rule that
+# declares it wins; "" means the header must be absent, and an undeclared
+# header isn't checked. .json.gz datasets are gunzipped by the app, so
+# they are served as application/gzip with no Content-Encoding. Keys
+# with no Cache-Control rule keep the CloudFront distribution's TTL.
+POLICY = [
+    (olmsted_releases.STATE_KEY, {"CacheControl": olmsted_releases.ENTRY_POINT_CACHE_CONTROL}),
+    ("releases/*", {"CacheControl": olmsted_releases.IMMUTABLE_CACHE_CONTROL}),
+    ("*.html", {"CacheControl": olmsted_releases.ENTRY_POINT_CACHE_CONTROL}),
+    ("data/datasets.json", {"CacheControl": olmsted_releases.ENTRY_POINT_CACHE_CONTROL}),
+    ("*", {"ContentEncoding": ""}),
+]
+
+
+def content_type(key):
+    _, ext = os.path.splitext(key)
+    return CONTENT_TYPES.get(ext.lower(), "application/octet-stream")
+
+
+def load_policy(path=None):
+    """The default POLICY, preceded by the rules in the JSON file at
+    `path`, if given."""
+    rules = []
+    if path:
+        with open(path) as handle:
+            for rule in json.load(handle):
+                globs = rule["match"] if isinstance(rule["match"], list) else [rule["match"]]
+                headers = {name: rule[name] for name in HEADERS if name in rule}
+                rules.extend((glob, headers) for glob in globs)
+    return rules + POLICY
+
+
+def expected_headers(key, policy=POLICY):
+    """{header: value} the policy declares for `key` ("" for absent),
+    with the extension's Content-Type if no rule declares one."""
+    expected = {}
+    for glob, headers in policy:
+        if fnmatch.fnmatchcase(key, glob):
+            for name, value in headers.items():
+                expected.setdefault(name, value)
+    expected.setdefault("ContentType", content_type(key))
+    return expected
+
+
+def upload_headers(key, policy=POLICY):
+    """The headers to upload `key` with: the expected ones, minus those
+    that must be absent."""
+    return {name: value for name, value in expected_headers(key, policy).items() if value}
+
+
+def mismatches(key, head, policy=POLICY):
+    """[(header, actual, expected)] where the `head_object` response
+    `head` differs from the policy; "" stands for a missing header."""
+    problems = []
+    for name, want in expected_headers(key, policy).items():
+        have = head.get(name) or ""
+        if have != want:
+            problems.append((name, have, want))
+    return problems
+
+
+def audit(client, bucket_name, objects, policy=POLICY, threads=DEFAULT_THREADS):
+    """HEAD every listed object concurrently. Yields (obj, head, problems)
+    in listing order; `head` is None and `problems` the exception if the
+    HEAD failed."""
+
+    def check(obj):
+        try:
+            head = client.head_object(Bucket=bucket_name, Key=obj["Key"])
+        except Exception as e:
+            return obj, None, e
+        return obj, head, mismatches(obj["Key"], head, policy)
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        yield from pool.map(check, objects)
+
+
+def fix(client, bucket_name, key, head, policy=POLICY, acl="public-read"):
+    """Rewrite `key`'s headers in place to match the policy, keeping its
+    other metadata. Copying with MetadataDirective=REPLACE resets the ACL,
+    so `acl` (what aws_deploy.py uploads with) is set again."""
+    if head["ContentLength"] > MAX_COPY_SIZE:
+        raise ValueError("larger than 5 GB; re-upload it with aws_deploy.py instead")
+    extra_args = {}
+    for name in ["ContentDisposition", "ContentLanguage", "Expires"] + HEADERS:
+        if head.get(name):
+            extra_args[name] = head[name]
+    for name in expected_headers(key, policy):
+        extra_args.pop(name, None)
+    extra_args.update(upload_headers(key, policy))
+    if acl:
+        extra_args["ACL"] = acl
+    client.copy_object(
+        Bucket=bucket_name,
+        Key=key,
+        CopySource={"Bucket": bucket_name, "Key": key},
+        MetadataDirective="REPLACE",
+        Metadata=head.get("Metadata", {}),
+        **extra_args,
+    )
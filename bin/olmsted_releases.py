@@ -0,0 +1,167 @@
+"""Immutable app releases under releases/<id>/, activated by rewriting the entry points."""
+
+import html
+import json
+import re
+from datetime import datetime, timezone
+
+import olmsted_storage
+
+RELEASES_PREFIX = "releases/"
+# {"active": id, "previous": id, "releases": [{"id", "created", "top_level"}, ...]},
+# releases oldest first; `previous` was active before `active`.
+STATE_KEY = RELEASES_PREFIX + "releases.json"
+DEFAULT_ENTRY_POINTS = ["index.html"]
+DEFAULT_KEEP = 5
+
+# Release files never change once uploaded; entry points and the state
+# file change on every activation.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ENTRY_POINT_CACHE_CONTROL = "no-cache"
+
+
+def new_release_id(now=None):
+    """A sortable id for a release created at `now` (UTC)."""
+    now = now or datetime.now(timezone.utc)
+    return now.strftime("%Y%m%dT%H%M%SZ")
+
+
+def release_prefix(release_id):
+    return f"{RELEASES_PREFIX}{release_id}/"
+
+
+def _is_missing(error):
+    return error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound")
+
+
+def load_state(client, bucket_name):
+    """The release history, or an empty one if nothing was released yet."""
+    try:
+        response = client.get_object(Bucket=bucket_name, Key=STATE_KEY)
+    except olmsted_storage.ClientError as e:
+        if _is_missing(e):
+            return {"active": None, "releases": []}
+        raise
+    body = response["Body"]
+    try:
+        return json.loads(body.read())
+    finally:
+        body.close()
+
+
+def save_state(client, bucket_name, state):
+    client.put_object(
+        Bucket=bucket_name,
+        Key=STATE_KEY,
+        Body=(json.dumps(state, indent=2) + "\n").encode(),
+        ContentType="application/json",
+        CacheControl=ENTRY_POINT_CACHE_CONTROL,
+    )
+
+
+def find_release(state, release_id):
+    for release in state["releases"]:
+        if release["id"] == release_id:
+            return release
+    return None
+
+
+def previous_release_id(state):
+    """The release activated before the active one, i.e. the rollback
+    target: `previous` as recorded by `activate`, or, for a history
+    written before it was recorded, the newest release older than the
+    active one."""
+    ids = [release["id"] for release in state["releases"]]
+    previous = state.get("previous")
+    if previous and previous != state["active"] and previous in ids:
+        return previous
+    if state["active"] not in ids:
+        return ids[-1] if ids else None
+    position = ids.index(state["active"])
+    return ids[position - 1] if position > 0 else None
+
+
+def rewrite_entry_point(text, release_id, top_level):
+    """Point an entry-point HTML document at the files of `release_id`.
+
+    Adds a `<base>` so relative URLs (webpack's `dist/` public path, used
+    for lazy chunks and images) resolve inside the release, and rewrites
+    `src`/`href` attributes that are root-absolute paths into one of the
+    release's `top_level` entries. Paths outside the release (`/data/...`)
+    and external URLs are left alone.
+    """
+    prefix = "/" + release_prefix(release_id)
+    names = sorted((name for name in top_level if name), key=len, reverse=True)
+    if names:
+        alternatives = "|".join(re.escape(name) for name in names)
+        pattern = re.compile(r"""(\b(?:src|href)\s*=\s*["'])/(?=(?:%s)(?:[/"'?#]))""" % alternatives)
+        text = pattern.sub(lambda m: m.group(1) + prefix, text)
+    base = f'<base href="{html.escape(prefix)}">'
+    text, count = re.subn(r"<head(\s[^>]*)?>", lambda m: m.group(0) + "\n    " + base, text, count=1, flags=re.I)
+    if not count:
+        text = base + "\n" + text
+    return text
+
+
+def activate(client, bucket_name, state, release_id, entry_points, dry_run=False, verbose=False):
+    """Rewrite each entry point from its copy in `release_id` and record
+    the release as active. Returns the keys rewritten."""
+    release = find_release(state, release_id)
+    if release is None:
+        raise ValueError(f"no release {release_id!r} in {STATE_KEY}")
+    rewritten = []
+    for entry_point in entry_points:
+        source_key = release_prefix(release_id) + entry_point
+        if dry_run:
+            print(f"[DRY RUN] would activate {entry_point} from {source_key}")
+            rewritten.append(entry_point)
+            continue
+        response = client.get_object(Bucket=bucket_name, Key=source_key)
+        body = response["Body"]
+        try:
+            text = body.read().decode("utf-8")
+        finally:
+            body.close()
+        client.put_object(
+            Bucket=bucket_name,
+            Key=entry_point,
+            Body=rewrite_entry_point(text, release_id, release["top_level"]).encode("utf-8"),
+            ContentType=response.get("ContentType", "text/html"),
+            CacheControl=ENTRY_POINT_CACHE_CONTROL,
+            ACL="public-read",
+        )
+        if verbose:
+            print(f"activated {entry_point} from {source_key}")
+        rewritten.append(entry_point)
+    if not dry_run:
+        if state["active"] and state["active"] != release_id:
+            state["previous"] = state["active"]
+        state["active"] = release_id
+        save_state(client, bucket_name, state)
+    return rewritten
+
+
+def prune(client, bucket_name, state, keep=DEFAULT_KEEP, dry_run=False):
+    """Delete all but the newest `keep` releases, never the active one or
+    its rollback target. Returns the ids removed."""
+    protected = {state["active"], previous_release_id(state)}
+    ids = [release["id"] for release in state["releases"]]
+    doomed = [release_id for release_id in ids[: max(0, len(ids) - keep)] if release_id not in protected]
+    for release_id in doomed:
+        keys = []
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=release_prefix(release_id)):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        if dry_run:
+            print(f"[DRY RUN] would delete release {release_id} ({len(keys)} object(s))")
+            continue
+        for start in range(0, len(keys), 1000):
+            batch = keys[start : start + 1000]
+            client.delete_objects(
+                Bucket=bucket_name, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+            )
+        print(f"Deleted release {release_id} ({len(keys)} object(s))")
+    if not dry_run and doomed:
+        state["releases"] = [release for release in state["releases"] if release["id"] not in doomed]
+        save_state(client, bucket_name, state)
+    return doomed
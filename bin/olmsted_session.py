@@ -0,0 +1,46 @@
+"""Lazily imported, per-process cached boto3 clients."""
+
+import os
+import threading
+
+DEFAULT_CREDENTIALS_PATH = os.path.join(os.path.expanduser("~"), ".olmsted/aws-credentials.yaml")
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def load_yaml(filename):
+    import yaml
+
+    with open(filename) as handle:
+        return yaml.load(handle, Loader=yaml.SafeLoader)
+
+
+def load_credentials(creds_filename):
+    """Load AWS credentials (keyword arguments for boto3.client) from a
+    YAML file."""
+    return load_yaml(creds_filename)
+
+
+def client(service, credentials=None, anonymous=False):
+    """A boto3 client for `service`, created once per process and
+    credentials, so olmsted-aws subcommands share it. boto3 is only
+    imported here, so runs that never reach S3 don't pay for it.
+
+    With `credentials`, they are passed to boto3; with `anonymous`,
+    requests are unsigned (public buckets); otherwise boto3's default
+    credential chain applies.
+    """
+    key = (service, tuple(sorted((credentials or {}).items())), anonymous)
+    with _lock:
+        if key not in _clients:
+            import boto3
+
+            if anonymous:
+                from botocore import UNSIGNED
+                from botocore.config import Config
+
+                _clients[key] = boto3.client(service, config=Config(signature_version=UNSIGNED))
+            else:
+                _clients[key] = boto3.client(service, **(credentials or {}))
+        return _clients[key]
@@ -0,0 +1,441 @@
+"""Parse -b targets, and serve file:// targets with a local stand-in for the S3 client."""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+import olmsted_hashes
+import olmsted_transfer
+
+META_DIR = ".s3meta"
+PAGE_SIZE = 1000
+
+_client_error = None
+
+
+class _FallbackClientError(Exception):
+    """Stand-in for botocore's ClientError: local targets work without
+    boto3 installed."""
+
+    def __init__(self, error_response, operation_name):
+        self.response = error_response
+        self.operation_name = operation_name
+        error = error_response.get("Error", {})
+        super().__init__(
+            f"An error occurred ({error.get('Code')}) when calling the {operation_name} "
+            f"operation: {error.get('Message')}"
+        )
+
+
+def client_error_class():
+    """botocore's ClientError, imported on first use (botocore is slow to
+    import), or a stand-in if botocore isn't installed."""
+    global _client_error
+    if _client_error is None:
+        try:
+            from botocore.exceptions import ClientError
+        except ImportError:
+            ClientError = _FallbackClientError
+        _client_error = ClientError
+    return _client_error
+
+
+def __getattr__(name):
+    # `olmsted_storage.ClientError` resolves lazily, so `except` clauses
+    # naming it only import botocore once an exception is being matched.
+    if name == "ClientError":
+        return client_error_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def is_local(target):
+    return target.startswith("file://")
+
+
+def parse_target(target):
+    """Split a `-b` value into (scheme, bucket, root): ("s3", name, None)
+    or ("file", basename, directory)."""
+    if is_local(target):
+        root = os.path.abspath(target[len("file://") :] or ".")
+        return "file", os.path.basename(root.rstrip(os.sep)) or root, root
+    if target.startswith("s3://"):
+        target = target[len("s3://") :]
+    return "s3", target.strip("/"), None
+
+
+class LazyClient:
+    """Calls `make_client` (once, thread-safely) when a client method is
+    first used, so runs that never reach S3 never import boto3."""
+
+    def __init__(self, make_client):
+        self._make_client = make_client
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._make_client()
+        return getattr(self._client, name)
+
+
+def connect(target, make_s3_client, lazy=False):
+    """Return (client, bucket) for a `-b` value. `make_s3_client` is only
+    called for S3 targets, so local runs need no credentials; with
+    `lazy`, not until the client is first used."""
+    scheme, bucket, root = parse_target(target)
+    if scheme == "file":
+        return LocalS3Client(root), bucket
+    if lazy:
+        return LazyClient(make_s3_client), bucket
+    return make_s3_client(), bucket
+
+
+def _copy_with_callback(source, destination, callback):
+    """Copy a file, reporting progress to a boto3-style `callback` chunk
+    by chunk as boto3 does, so bandwidth limits apply to local targets."""
+    if callback is None:
+        shutil.copyfile(source, destination)
+        return
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        for chunk in iter(lambda: src.read(olmsted_transfer.READ_CHUNK), b""):
+            dst.write(chunk)
+            callback(len(chunk))
+
+
+def _error(code, message, operation):
+    status = {"NoSuchKey": 404, "404": 404, "NoSuchBucket": 404, "InvalidRange": 416}.get(code, 400)
+    return client_error_class()(
+        {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        operation,
+    )
+
+
+class _Exceptions:
+    @property
+    def ClientError(self):
+        return client_error_class()
+
+
+class _Paginator:
+    """Pages over one listing walk, rather than re-walking the tree for
+    every continuation token as repeated `list_objects_v2` calls would."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket=None, Prefix="", StartAfter="", PaginationConfig=None, **_):
+        config = PaginationConfig or {}
+        max_items = config.get("MaxItems")
+        page_size = config.get("PageSize") or PAGE_SIZE
+        contents = []
+        yielded = 0
+        for obj in self.client._iter_objects(Prefix, StartAfter or ""):
+            if max_items is not None and yielded >= max_items:
+                break
+            contents.append(obj)
+            yielded += 1
+            if len(contents) == page_size:
+                yield self.client._page(Prefix, contents, page_size, True)
+                contents = []
+        yield self.client._page(Prefix, contents, page_size, False)
+
+
+class LocalS3Client:
+    """Filesystem-backed subset of the boto3 S3 client API.
+
+    The directory is the bucket: `data/x.json` lives at `<root>/data/x.json`
+    and its metadata in `<root>/.s3meta/data/x.json.meta`. ETags follow
+    S3 (multipart for `upload_file` at or above boto3's threshold), and
+    LastModified is the file's mtime.
+    """
+
+    exceptions = _Exceptions()
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    # -- paths and metadata -------------------------------------------------
+
+    def _path(self, key, operation):
+        path = os.path.normpath(os.path.join(self.root, *key.split("/")))
+        if not path.startswith(self.root + os.sep) or key.split("/")[0] == META_DIR:
+            raise _error("InvalidKey", f"Key {key!r} is not allowed in a local target", operation)
+        return path
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, META_DIR, *key.split("/")) + ".meta"
+
+    def _read_meta(self, key, path):
+        try:
+            with open(self._meta_path(key)) as handle:
+                meta = json.load(handle)
+        except (OSError, ValueError):
+            meta = {}
+        st = os.stat(path)
+        # A body changed behind our back (e.g. copied in by hand) gets a
+        # fresh ETag rather than a stale one.
+        if meta.get("size") != st.st_size or meta.get("mtime_ns") != st.st_mtime_ns:
+            meta = {
+                "etag": olmsted_hashes.compute_digests(path)["md5"],
+                "ContentType": meta.get("ContentType", "binary/octet-stream"),
+            }
+            self._write_meta(key, path, meta)
+        return meta, st
+
+    def _write_meta(self, key, path, meta):
+        st = os.stat(path)
+        meta = dict(meta, size=st.st_size, mtime_ns=st.st_mtime_ns)
+        meta_path = self._meta_path(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        with open(meta_path, "w") as handle:
+            json.dump(meta, handle)
+
+    @staticmethod
+    def _meta_from_args(args):
+        meta = {}
+        for name in ("ContentType", "ContentEncoding", "CacheControl", "ContentDisposition", "Metadata"):
+            if args.get(name) is not None:
+                meta[name] = args[name]
+        meta.setdefault("ContentType", "binary/octet-stream")
+        return meta
+
+    def _commit(self, key, tmp_path, meta, operation):
+        """Atomically move a fully written temp file into place, so readers
+        never see a partial object (as with S3)."""
+        path = self._path(key, operation)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        self._write_meta(key, path, meta)
+
+    def _temp_file(self):
+        tmp_dir = os.path.join(self.root, META_DIR, ".tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        return tempfile.mkstemp(dir=tmp_dir)
+
+    @staticmethod
+    def _last_modified(st):
+        return datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+
+    def _existing(self, key, operation):
+        path = self._path(key, operation)
+        if not os.path.isfile(path):
+            raise _error("NoSuchKey", "The specified key does not exist.", operation)
+        return path
+
+    # -- listing ------------------------------------------------------------
+
+    def _iter_keys(self, directory, prefix_parts):
+        """Yield keys under `directory` in S3's lexicographic key order."""
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        entries = []
+        for name in names:
+            if not prefix_parts and name == META_DIR:
+                continue
+            full = os.path.join(directory, name)
+            if os.path.isdir(full):
+                # "a/" sorts by its trailing "/", exactly as S3 sorts "a/b".
+                entries.append((name + "/", full, True))
+            else:
+                entries.append((name, full, False))
+        for sort_name, full, is_dir in sorted(entries):
+            if is_dir:
+                yield from self._iter_keys(full, prefix_parts + [sort_name[:-1]])
+            else:
+                yield "/".join(prefix_parts + [sort_name])
+
+    def _iter_objects(self, prefix, after=""):
+        # Only descend into the directory that can hold the prefix.
+        dir_parts = prefix.split("/")[:-1]
+        for key in self._iter_keys(os.path.join(self.root, *dir_parts), dir_parts):
+            if not key.startswith(prefix) or key <= after:
+                continue
+            path = os.path.join(self.root, *key.split("/"))
+            meta, st = self._read_meta(key, path)
+            yield {
+                "Key": key,
+                "Size": st.st_size,
+                "ETag": f'"{meta["etag"]}"',
+                "LastModified": self._last_modified(st),
+                "StorageClass": "STANDARD",
+            }
+
+    @staticmethod
+    def _page(prefix, contents, max_keys, truncated):
+        page = {"KeyCount": len(contents), "IsTruncated": truncated, "Prefix": prefix, "MaxKeys": max_keys}
+        if contents:
+            page["Contents"] = contents
+        if truncated:
+            page["NextContinuationToken"] = contents[-1]["Key"]
+        return page
+
+    def list_objects_v2(self, Bucket=None, Prefix="", MaxKeys=PAGE_SIZE, ContinuationToken=None, StartAfter=None, **_):
+        contents = []
+        for obj in self._iter_objects(Prefix, ContinuationToken or StartAfter or ""):
+            if len(contents) >= MaxKeys:
+                return self._page(Prefix, contents, MaxKeys, True)
+            contents.append(obj)
+        return self._page(Prefix, contents, MaxKeys, False)
+
+    def get_paginator(self, operation_name):
+        if operation_name != "list_objects_v2":
+            raise NotImplementedError(f"LocalS3Client has no paginator for {operation_name}")
+        return _Paginator(self)
+
+    # -- objects ------------------------------------------------------------
+
+    def put_object(self, Bucket=None, Key=None, Body=b"", **kwargs):
+        self._path(Key, "PutObject")
+        fd, tmp_path = self._temp_file()
+        md5 = hashlib.md5()
+        with os.fdopen(fd, "wb") as out:
+            if isinstance(Body, str):
+                Body = Body.encode("utf-8")
+            if isinstance(Body, (bytes, bytearray)):
+                Body = io.BytesIO(Body)
+            for block in iter(lambda: Body.read(1 << 20), b""):
+                md5.update(block)
+                out.write(block)
+        meta = dict(self._meta_from_args(kwargs), etag=md5.hexdigest())
+        self._commit(Key, tmp_path, meta, "PutObject")
+        return {"ETag": f'"{meta["etag"]}"'}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, "rb") as handle:
+            self.upload_fileobj(handle, Bucket, Key, ExtraArgs, Callback, Config)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self._path(Key, "PutObject")
+        fd, tmp_path = self._temp_file()
+        with os.fdopen(fd, "wb") as dst:
+            for chunk in iter(lambda: Fileobj.read(olmsted_transfer.READ_CHUNK), b""):
+                dst.write(chunk)
+                if Callback:
+                    Callback(len(chunk))
+        part_size = getattr(Config, "multipart_chunksize", olmsted_hashes.S3_MULTIPART_CHUNKSIZE)
+        threshold = getattr(Config, "multipart_threshold", olmsted_hashes.S3_MULTIPART_THRESHOLD)
+        digests = olmsted_hashes.compute_digests(tmp_path, part_size)
+        etag = digests["etag"] if os.path.getsize(tmp_path) >= threshold else digests["md5"]
+        self._commit(Key, tmp_path, dict(self._meta_from_args(ExtraArgs or {}), etag=etag), "PutObject")
+
+    def head_object(self, Bucket=None, Key=None, **_):
+        path = self._existing(Key, "HeadObject")
+        meta, st = self._read_meta(Key, path)
+        response = {
+            "ContentLength": st.st_size,
+            "ETag": f'"{meta["etag"]}"',
+            "LastModified": self._last_modified(st),
+            "Metadata": meta.get("Metadata", {}),
+        }
+        for name in ("ContentType", "ContentEncoding", "CacheControl", "ContentDisposition"):
+            if name in meta:
+                response[name] = meta[name]
+        return response
+
+    def get_object(self, Bucket=None, Key=None, Range=None, **_):
+        response = self.head_object(Key=Key)
+        path = self._existing(Key, "GetObject")
+        size = response["ContentLength"]
+        handle = open(path, "rb")
+        if Range:
+            start, _, end = Range[len("bytes=") :].partition("-")
+            start = int(start)
+            end = min(int(end) if end else size - 1, size - 1)
+            if start >= size or start > end:
+                handle.close()
+                raise _error("InvalidRange", "The requested range is not satisfiable", "GetObject")
+            handle.seek(start)
+            response["Body"] = io.BytesIO(handle.read(end - start + 1))
+            handle.close()
+            response["ContentLength"] = end - start + 1
+            response["ContentRange"] = f"bytes {start}-{end}/{size}"
+        else:
+            response["Body"] = handle
+        return response
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        path = self._existing(Key, "HeadObject")
+        directory = os.path.dirname(os.path.abspath(Filename))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        os.fchmod(fd, olmsted_transfer.DEFAULT_FILE_MODE)
+        os.close(fd)
+        _copy_with_callback(path, tmp_path, Callback)
+        os.replace(tmp_path, Filename)
+
+    def copy_object(self, Bucket=None, Key=None, CopySource=None, MetadataDirective="COPY", **kwargs):
+        source_key = CopySource["Key"] if isinstance(CopySource, dict) else CopySource.split("/", 1)[1]
+        source_path = self._existing(source_key, "CopyObject")
+        source_meta, _ = self._read_meta(source_key, source_path)
+        self._path(Key, "CopyObject")
+        fd, tmp_path = self._temp_file()
+        os.close(fd)
+        shutil.copyfile(source_path, tmp_path)
+        if MetadataDirective == "REPLACE":
+            meta = dict(self._meta_from_args(kwargs), etag=source_meta["etag"])
+        else:
+            meta = {k: v for k, v in source_meta.items() if k not in ("size", "mtime_ns")}
+        # S3 recomputes a single-part ETag for every copy.
+        if "-" in meta["etag"]:
+            meta["etag"] = olmsted_hashes.compute_digests(tmp_path)["md5"]
+        self._commit(Key, tmp_path, meta, "CopyObject")
+        st = os.stat(self._path(Key, "CopyObject"))
+        return {"CopyObjectResult": {"ETag": f'"{meta["etag"]}"', "LastModified": self._last_modified(st)}}
+
+    def delete_object(self, Bucket=None, Key=None, **_):
+        path = self._path(Key, "DeleteObject")
+        # S3 deletes are idempotent: a missing key is not an error.
+        for target in (path, self._meta_path(Key)):
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+        self._prune_dirs(os.path.dirname(path))
+        return {}
+
+    def delete_objects(self, Bucket=None, Delete=None, **_):
+        deleted = []
+        errors = []
+        for obj in Delete["Objects"]:
+            try:
+                self.delete_object(Key=obj["Key"])
+                deleted.append({"Key": obj["Key"]})
+            except client_error_class() as e:
+                errors.append({"Key": obj["Key"], "Code": e.response["Error"]["Code"], "Message": str(e)})
+        response = {"Errors": errors} if errors else {}
+        if not Delete.get("Quiet"):
+            response["Deleted"] = deleted
+        return response
+
+    def _prune_dirs(self, directory):
+        """Remove now-empty parent directories (S3 has no directories)."""
+        while directory.startswith(self.root + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    # -- bucket -------------------------------------------------------------
+
+    def get_bucket_location(self, Bucket=None, **_):
+        return {"LocationConstraint": f"local:{self.root}"}
+
+    def get_bucket_versioning(self, Bucket=None, **_):
+        return {}
+
+    def get_bucket_website(self, Bucket=None, **_):
+        raise _error("NoSuchWebsiteConfiguration", "Local targets have no website configuration", "GetBucketWebsite")
+
+    def list_buckets(self):
+        st = os.stat(self.root)
+        return {"Buckets": [{"Name": os.path.basename(self.root), "CreationDate": self._last_modified(st)}]}
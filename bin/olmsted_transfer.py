@@ -0,0 +1,408 @@
+"""Ranged downloads, bandwidth limiting, hedged requests and fan-out uploads."""
+
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+DEFAULT_RANGE_SIZE = 64 * 1024 * 1024
+DEFAULT_RANGE_CONCURRENCY = 8
+DEFAULT_RANGE_RETRIES = 3
+READ_CHUNK = 1024 * 1024
+DEFAULT_LANE_THRESHOLD = 1024 * 1024
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_MAX_SIZE = 1024 * 1024
+
+SMALL_LANE = 0
+BULK_LANE = 1
+
+
+def _default_file_mode():
+    # os.umask can only be read by setting it, and it is process-wide, so
+    # this runs once at import, before any transfer threads exist.
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# Permissions a plain `open(path, "w")` would create, for files made with
+# mkstemp (which always uses 0600).
+DEFAULT_FILE_MODE = _default_file_mode()
+
+
+def parse_rate(text):
+    """Bytes per second from a rate such as `500K`, `10M`, `1.5G` or
+    `10MB/s` (binary units)."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?\s*", text, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"invalid rate {text!r}; expected e.g. 500K, 10M or 1.5G (bytes per second)")
+    number, unit = match.groups()
+    rate = float(number) * {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}[unit.upper()]
+    if rate <= 0:
+        raise ValueError(f"invalid rate {text!r}; must be positive")
+    return rate
+
+
+class BandwidthLimiter:
+    """Token bucket shared by every transfer thread.
+
+    `consume(n, lane)` blocks until `n` bytes may be sent. Tokens refill
+    at `rate` bytes/s up to `burst`; a consumer may take more than is
+    available (driving the bucket negative), so chunk size doesn't
+    matter and the long-run rate is still `rate`. A consumer never takes
+    tokens while one from a higher-priority (lower-numbered) lane waits.
+    """
+
+    def __init__(self, rate, burst=None, lane_threshold=DEFAULT_LANE_THRESHOLD):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(self.rate / 4, 64 * 1024)
+        self.lane_threshold = lane_threshold
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        self.waiting = {}
+        self.consumed = 0
+        self.waited = 0.0
+
+    def lane_for(self, size):
+        if self.lane_threshold and size is not None and size < self.lane_threshold:
+            return SMALL_LANE
+        return BULK_LANE
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, n, lane=BULK_LANE):
+        if n <= 0:
+            # boto3 reports negative progress when it retries a part.
+            return
+        started = time.monotonic()
+        with self.condition:
+            self.waiting[lane] = self.waiting.get(lane, 0) + 1
+            try:
+                while True:
+                    self._refill()
+                    outranked = any(count for other, count in self.waiting.items() if other < lane)
+                    if self.tokens > 0 and not outranked:
+                        self.tokens -= n
+                        self.consumed += n
+                        break
+                    deficit = max(-self.tokens, 0) + 1
+                    self.condition.wait(deficit / self.rate if not outranked else None)
+            finally:
+                self.waiting[lane] -= 1
+                self.condition.notify_all()
+        self.waited += time.monotonic() - started
+
+    def callback(self, size):
+        """A boto3 transfer `Callback` that throttles an object of `size`
+        bytes in its lane (boto3 calls it from the thread doing the IO)."""
+        lane = self.lane_for(size)
+        return lambda n: self.consume(n, lane)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else None
+
+
+class Hedger:
+    """Hedged requests for objects of at most `max_size` bytes.
+
+    `call(kind, size, fn)` runs `fn` (which must be safe to run twice at
+    once) and, if it is still running after the `percentile` latency of
+    the last `window` completed `kind` requests, runs it again and
+    returns whichever finishes first. Nothing is hedged until
+    `min_samples` requests of that kind have completed, nor sooner than
+    `min_delay` seconds. The losing copy can't be cancelled and runs to
+    completion in the background; only latencies are kept for `report`.
+    """
+
+    def __init__(
+        self,
+        percentile=DEFAULT_HEDGE_PERCENTILE,
+        max_size=DEFAULT_HEDGE_MAX_SIZE,
+        min_samples=20,
+        min_delay=0.05,
+        window=1000,
+    ):
+        self.percentile = percentile
+        self.max_size = max_size
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+        self.delays = {}
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        # [started, effective latency, original request's latency] of the
+        # last `window` hedgeable requests; the last is None until the
+        # original request finishes. Only floats, so no results are kept.
+        self.outcomes = deque(maxlen=window)
+
+    def _record(self, kind, seconds):
+        # Learn from the original requests only: winners' latencies would
+        # drag the percentile down and hedge ever more eagerly.
+        with self.lock:
+            samples = self.samples.setdefault(kind, deque(maxlen=self.window))
+            samples.append(seconds)
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            if len(samples) >= self.min_samples and (kind not in self.delays or self.counts[kind] % 16 == 0):
+                self.delays[kind] = max(self.min_delay, _percentile(samples, self.percentile))
+
+    def delay(self, kind):
+        """Seconds a `kind` request may run before it is hedged, or None
+        while there are too few samples."""
+        with self.lock:
+            return self.delays.get(kind)
+
+    def call(self, kind, size, fn):
+        if size is None or size > self.max_size:
+            return fn()
+        started = time.monotonic()
+        outcome = [started, None, None]
+        delay = self.delay(kind)
+        primary = self._start(fn)
+        primary.add_done_callback(lambda f: self._primary_done(f, kind, outcome))
+        attempts = [primary]
+        done, _ = wait(attempts, timeout=delay)
+        if not done:
+            hedge = self._start(fn)
+            attempts.append(hedge)
+            with self.lock:
+                self.fired += 1
+        error = None
+        while attempts:
+            done, _ = wait(attempts, return_when=FIRST_COMPLETED)
+            for future in done:
+                attempts.remove(future)
+                if future.exception() is None:
+                    with self.lock:
+                        outcome[1] = time.monotonic() - started
+                        self.requests += 1
+                        self.won += future is not primary
+                        self.outcomes.append(outcome)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    @staticmethod
+    def _start(fn):
+        # A daemon thread per attempt rather than a pool: a stuck losing
+        # copy must neither hold up other requests nor keep the process
+        # alive at exit.
+        future = Future()
+
+        def run():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn())
+                except BaseException as e:
+                    future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def _primary_done(self, future, kind, outcome):
+        seconds = time.monotonic() - outcome[0]
+        with self.lock:
+            outcome[2] = seconds
+        if future.exception() is None:
+            self._record(kind, seconds)
+
+    def latencies(self):
+        """(actual, unhedged) latencies of the last `window` hedgeable
+        requests: what the caller waited, and what the original request
+        took (or has taken so far)."""
+        now = time.monotonic()
+        with self.lock:
+            actual = [seconds for _, seconds, _ in self.outcomes]
+            unhedged = [now - started if original is None else original for started, _, original in self.outcomes]
+        return actual, unhedged
+
+    def report(self):
+        """One line for the end of a run, or None if nothing was eligible."""
+        if not self.requests:
+            return None
+        actual, unhedged = self.latencies()
+        before, after = _percentile(unhedged, 99), _percentile(actual, 99)
+        return (
+            f"Hedging: {self.requests} small request(s), {self.fired} hedge(s) fired, {self.won} won; "
+            f"p99 latency {before:.2f}s without hedging, {after:.2f}s with ({max(before - after, 0):.2f}s saved)"
+        )
+
+
+class _MappedReader:
+    """Read-only, seekable file object over a shared buffer, so several
+    uploads can stream the same mapped file independently."""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.position + size, len(self.view))
+        data = self.view[self.position : end].tobytes()
+        self.position = max(self.position, end)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.position, os.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.view.release()
+
+
+def fan_out_upload(targets, localpath, key, extra_args=None, limiter=None, hedger=None):
+    """Upload `localpath` as `key` to every (client, bucket) in `targets`
+    concurrently, reading the file once. Small uploads are hedged by
+    `hedger`, if given. Returns one entry per target: None on success,
+    else the exception that upload raised."""
+    size = os.path.getsize(localpath)
+    callback = (lambda: limiter.callback(size)) if limiter else (lambda: None)
+
+    def run(fn):
+        return hedger.call("PUT", size, fn) if hedger else fn()
+
+    if len(targets) == 1:
+        client, bucket_name = targets[0]
+        try:
+            run(lambda: client.upload_file(localpath, bucket_name, key, ExtraArgs=extra_args, Callback=callback()))
+            return [None]
+        except Exception as e:
+            return [e]
+
+    def upload(target, buffer):
+        client, bucket_name = target
+
+        def attempt():
+            reader = _MappedReader(buffer)
+            try:
+                client.upload_fileobj(reader, bucket_name, key, ExtraArgs=extra_args, Callback=callback())
+            finally:
+                reader.close()
+
+        try:
+            run(attempt)
+            return None
+        except Exception as e:
+            return e
+
+    with open(localpath, "rb") as handle:
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+                return list(pool.map(lambda target: upload(target, mapped), targets))
+        finally:
+            if size:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # A losing hedged upload still reads it; the mapping
+                    # is freed when that finishes.
+                    pass
+
+
+def split_ranges(size, range_size):
+    """Inclusive (start, end) byte ranges covering `size` bytes."""
+    return [(start, min(start + range_size, size) - 1) for start in range(0, size, range_size)]
+
+
+def _fetch_range(client, bucket_name, key, fd, start, end, etag, retries, limiter=None):
+    """GET bytes `start`..`end` of `key` and pwrite them at the same offset
+    in `fd`. On error, retries with backoff, resuming after the last byte
+    written. `etag` pins every request to one version of the object."""
+    position = start
+    attempt = 0
+    while True:
+        try:
+            extra = {"IfMatch": etag} if etag else {}
+            response = client.get_object(Bucket=bucket_name, Key=key, Range=f"bytes={position}-{end}", **extra)
+            body = response["Body"]
+            try:
+                for chunk in iter(lambda: body.read(READ_CHUNK), b""):
+                    if limiter:
+                        limiter.consume(len(chunk), BULK_LANE)
+                    written = 0
+                    while written < len(chunk):
+                        written += os.pwrite(fd, chunk[written:], position + written)
+                    position += len(chunk)
+            finally:
+                body.close()
+            if position != end + 1:
+                raise IOError(f"short read for bytes {start}-{end}: got {position - start} bytes")
+            return end - start + 1
+        except Exception:
+            attempt += 1
+            if attempt > retries:
+                raise
+            time.sleep(min(2 ** attempt * 0.1, 5))
+
+
+def download_ranged(
+    client,
+    bucket_name,
+    key,
+    local_file,
+    size,
+    etag=None,
+    range_size=DEFAULT_RANGE_SIZE,
+    concurrency=DEFAULT_RANGE_CONCURRENCY,
+    retries=DEFAULT_RANGE_RETRIES,
+    limiter=None,
+):
+    """Download `key` (of known `size`) into `local_file` with concurrent
+    ranged GETs. The data lands in a preallocated temp file next to
+    `local_file`, renamed into place only once every range succeeded.
+    A failed range is retried from the last byte it wrote.
+    Every range draws from `limiter` (a BandwidthLimiter), if given."""
+    directory = os.path.dirname(os.path.abspath(local_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".part-")
+    try:
+        os.fchmod(fd, DEFAULT_FILE_MODE)
+        if hasattr(os, "posix_fallocate") and size:
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+        ranges = split_ranges(size, range_size)
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(ranges)))) as pool:
+            futures = [
+                pool.submit(_fetch_range, client, bucket_name, key, fd, start, end, etag, retries, limiter)
+                for start, end in ranges
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        os.fsync(fd)
+        os.close(fd)
+        fd = None
+        os.replace(tmp_path, local_file)
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,213 @@
+"""Warm the CloudFront edge cache by fetching the entry points, their assets and datasets."""
+
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 60
+READ_CHUNK = 1024 * 1024
+USER_AGENT = "olmsted-warm/1"
+
+
+class _AssetParser(HTMLParser):
+    """Collects <base href>, <script src> and <link href> from a page."""
+
+    def __init__(self):
+        super().__init__()
+        self.base = None
+        self.assets = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "base" and attrs.get("href") and self.base is None:
+            self.base = attrs["href"]
+        elif tag == "script" and attrs.get("src"):
+            self.assets.append(attrs["src"])
+        elif tag == "link" and attrs.get("href"):
+            self.assets.append(attrs["href"])
+
+
+def cache_status(headers):
+    """CloudFront's verdict from `X-Cache` ("Hit", "Miss", "RefreshHit",
+    ...), or "-" when the server isn't a CDN."""
+    value = headers.get("X-Cache", "")
+    return value.split(" from ")[0].strip() or "-"
+
+
+def fetch(url, byte_range=None, timeout=DEFAULT_TIMEOUT, keep_body=False):
+    """GET `url` (optionally an inclusive (start, end) byte range),
+    reading and discarding the body. Returns a result dict with `url`,
+    `range`, `status`, `bytes`, `ttfb`, `seconds`, `cache`, `error`, and
+    `body` if `keep_body`."""
+    headers = {"User-Agent": USER_AGENT}
+    if byte_range:
+        headers["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+    result = {"url": url, "range": byte_range, "status": None, "bytes": 0, "ttfb": None, "cache": "-", "error": None}
+    started = time.perf_counter()
+    chunks = []
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+            result["status"] = response.status
+            result["cache"] = cache_status(response.headers)
+            result["ttfb"] = time.perf_counter() - started
+            for chunk in iter(lambda: response.read(READ_CHUNK), b""):
+                result["bytes"] += len(chunk)
+                if keep_body:
+                    chunks.append(chunk)
+    except urllib.error.HTTPError as e:
+        result["status"] = e.code
+        result["cache"] = cache_status(e.headers)
+        result["error"] = f"HTTP {e.code}"
+    except (urllib.error.URLError, OSError) as e:
+        result["error"] = str(getattr(e, "reason", e))
+    result["seconds"] = time.perf_counter() - started
+    if keep_body:
+        result["body"] = b"".join(chunks)
+    return result
+
+
+def content_length(url, timeout=DEFAULT_TIMEOUT):
+    """(size, accepts_ranges) from a HEAD request; size is None if
+    unknown."""
+    request = urllib.request.Request(url, method="HEAD", headers={"User-Agent": USER_AGENT})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            size = response.headers.get("Content-Length")
+            return (int(size) if size else None), response.headers.get("Accept-Ranges") == "bytes"
+    except (urllib.error.URLError, OSError, ValueError):
+        return None, False
+
+
+def page_assets(page_url, text):
+    """Same-site URLs of the scripts, stylesheets and icons a page loads."""
+    parser = _AssetParser()
+    parser.feed(text)
+    base = urllib.parse.urljoin(page_url, parser.base) if parser.base else page_url
+    site = urllib.parse.urlsplit(page_url).netloc
+    assets = []
+    for href in parser.assets:
+        url = urllib.parse.urljoin(base, href)
+        if urllib.parse.urlsplit(url).netloc == site and url not in assets:
+            assets.append(url)
+    return assets
+
+
+def select_datasets(entries, specs):
+    """`consolidated_path`s of the manifest entries matching `specs`: a
+    dataset_id, a consolidated_path, or "all"."""
+    specs = set(specs or [])
+    selected = []
+    for entry in entries:
+        path = entry.get("consolidated_path")
+        if not path:
+            continue
+        if "all" in specs or path in specs or entry.get("dataset_id") in specs:
+            if path not in selected:
+                selected.append(path)
+    return selected
+
+
+def warm(
+    base_url,
+    entry_points=("index.html",),
+    datasets=(),
+    concurrency=DEFAULT_CONCURRENCY,
+    range_size=0,
+    timeout=DEFAULT_TIMEOUT,
+):
+    """Warm the edge serving this machine (so run it from where the users
+    are): the entry points, their same-site assets, data/datasets.json and
+    the datasets asked for, large ones as ranged GETs. Returns the result
+    dicts, one per request, in the order the requests were planned."""
+    base_url = base_url.rstrip("/") + "/"
+    results = []
+
+    # Entry points first: their bodies name the assets to warm.
+    urls = []
+    for entry_point in entry_points:
+        url = urllib.parse.urljoin(base_url, entry_point)
+        result = fetch(url, timeout=timeout, keep_body=True)
+        body = result.pop("body")
+        results.append(result)
+        if result["error"] is None:
+            urls.extend(u for u in page_assets(url, body.decode("utf-8", "replace")) if u not in urls)
+    if "index.html" in entry_points:
+        urls.insert(0, base_url)
+
+    dataset_urls = []
+    manifest_url = urllib.parse.urljoin(base_url, "data/datasets.json")
+    if datasets:
+        result = fetch(manifest_url, timeout=timeout, keep_body=True)
+        body = result.pop("body")
+        results.append(result)
+        if result["error"] is None:
+            try:
+                entries = json.loads(body)
+            except ValueError:
+                entries = []
+            for path in select_datasets(entries, datasets):
+                dataset_urls.append(urllib.parse.urljoin(base_url, "data/" + urllib.parse.quote(path)))
+    else:
+        urls.append(manifest_url)
+
+    # Then everything else concurrently, large datasets in ranges.
+    requests = [(url, None) for url in urls]
+    for url in dataset_urls:
+        size, ranged = content_length(url, timeout) if range_size else (None, False)
+        if ranged and size and size > range_size:
+            requests.extend((url, (start, min(start + range_size, size) - 1)) for start in range(0, size, range_size))
+        else:
+            requests.append((url, None))
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        results.extend(pool.map(lambda request: fetch(request[0], request[1], timeout), requests))
+    return results
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def summarize(results):
+    """Totals over `warm`'s results, for the report and --json."""
+    ok = [r for r in results if r["error"] is None]
+    latencies = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    caches = {}
+    for result in ok:
+        caches[result["cache"]] = caches.get(result["cache"], 0) + 1
+    return {
+        "requests": len(results),
+        "failed": len(results) - len(ok),
+        "bytes": sum(r["bytes"] for r in results),
+        "cache": caches,
+        "ttfb_p50": _percentile(latencies, 0.5),
+        "ttfb_p95": _percentile(latencies, 0.95),
+        "seconds_max": max((r["seconds"] for r in results), default=0.0),
+    }
+
+
+def print_report(results, format_file_size):
+    for result in results:
+        path = urllib.parse.urlsplit(result["url"]).path or "/"
+        if result["range"]:
+            path += f" [{result['range'][0]}-{result['range'][1]}]"
+        if result["error"]:
+            print(f"  ✗ {path}: {result['error']} ({result['seconds'] * 1000:.0f} ms)")
+        else:
+            print(
+                f"  {result['cache']:<10} {result['ttfb'] * 1000:7.0f} ms ttfb {result['seconds'] * 1000:7.0f} ms "
+                f"{format_file_size(result['bytes']):>10}  {path}"
+            )
+    summary = summarize(results)
+    caches = ", ".join(f"{count} {status}" for status, count in sorted(summary["cache"].items())) or "none"
+    print(
+        f"Warmed {summary['requests'] - summary['failed']}/{summary['requests']} request(s), "
+        f"{format_file_size(summary['bytes'])}; cache: {caches}; "
+        f"ttfb p50 {summary['ttfb_p50'] * 1000:.0f} ms, p95 {summary['ttfb_p95'] * 1000:.0f} ms"
+    )
+    return summary
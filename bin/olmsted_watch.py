@@ -0,0 +1,172 @@
+"""File watching for aws_deploy.py --watch: inotify on Linux, stat polling elsewhere."""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+DEFAULT_QUIET = 1.0
+DEFAULT_MAX_WAIT = 10.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _walk(root, skip_dir):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not skip_dir(os.path.join(dirpath, d))]
+        yield dirpath, filenames
+
+
+class PollingWatcher:
+    """Finds changes by comparing (size, mtime) of every file under
+    `roots` every `interval` seconds."""
+
+    def __init__(self, roots, skip_dir=lambda path: False, interval=DEFAULT_POLL_INTERVAL):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.skip_dir = skip_dir
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for dirpath, filenames in _walk(root, self.skip_dir):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {path for path, stamp in snapshot.items() if self.snapshot.get(path) != stamp}
+        changed.update(path for path in self.snapshot if path not in snapshot)
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Recursive inotify watch on `roots`. New subdirectories are watched
+    as they appear, and files already inside them are reported."""
+
+    def __init__(self, roots, skip_dir=lambda path: False):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.skip_dir = skip_dir
+        self.directories = {}
+        for root in roots:
+            self._watch_tree(os.path.abspath(root))
+
+    def _watch_tree(self, root):
+        """Watch `root` and its subdirectories. Returns the files found."""
+        found = set()
+        for dirpath, filenames in _walk(root, self.skip_dir):
+            wd = self._add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise OSError(error, "inotify watch limit reached (fs.inotify.max_user_watches)")
+                continue
+            self.directories[wd] = dirpath
+            found.update(os.path.join(dirpath, name) for name in filenames)
+        return found
+
+    def poll(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped: report every file we watch.
+                    for directory in list(self.directories.values()):
+                        changed.update(self._watch_tree(directory))
+                    continue
+                directory = self.directories.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.directories[wd]
+                    continue
+                if not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and not self.skip_dir(path):
+                        changed.update(self._watch_tree(path))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(roots, skip_dir=lambda path: False, interval=DEFAULT_POLL_INTERVAL):
+    """An inotify watcher on Linux, else (or if inotify fails) a polling
+    one. Both have `poll(timeout)`, returning the paths changed since."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, skip_dir)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}); polling every {interval:g}s instead")
+    return PollingWatcher(roots, skip_dir, interval)
+
+
+def batches(watcher, quiet=DEFAULT_QUIET, max_wait=DEFAULT_MAX_WAIT):
+    """Yield sets of changed paths forever, one per burst: a batch ends
+    once `quiet` seconds pass without a change, or `max_wait` seconds
+    after it started so a steady trickle still gets published."""
+    while True:
+        pending = watcher.poll(None)
+        if not pending:
+            continue
+        started = time.monotonic()
+        while True:
+            remaining = max_wait - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            more = watcher.poll(min(quiet, remaining))
+            if not more:
+                break
+            pending |= more
+        yield pending
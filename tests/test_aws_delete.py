@@ -0,0 +1,70 @@
+"""Tests for bin/aws_delete.py --purge-versions."""
+
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+import aws_delete  # noqa: E402
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def version(key, version_id, latest, marker, day):
+    return {
+        "Key": key,
+        "VersionId": version_id,
+        "IsLatest": latest,
+        "DeleteMarker": marker,
+        "Size": 0 if marker else 5,
+        "LastModified": T0 + timedelta(days=day),
+    }
+
+
+class FakeClient:
+    """Records delete_objects calls; deleting any of `failing` fails."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def delete_objects(self, Bucket, Delete):
+        objects = [(o["Key"], o["VersionId"]) for o in Delete["Objects"]]
+        self.calls.append(objects)
+        return {
+            "Deleted": [{"Key": k, "VersionId": v} for k, v in objects if (k, v) not in self.failing],
+            "Errors": [{"Key": k, "VersionId": v, "Message": "denied"} for k, v in objects if (k, v) in self.failing],
+        }
+
+
+def deleted_key(key):
+    return [version(key, "m", True, True, 3), version(key, "v2", False, False, 2), version(key, "v1", False, False, 1)]
+
+
+def test_current_marker_is_selected_last():
+    selected = aws_delete.select_noncurrent(deleted_key("a"))
+    assert [v["VersionId"] for v in selected] == ["v2", "v1", "m"]
+
+
+def test_current_marker_kept_if_a_version_is_kept():
+    versions = deleted_key("a")
+    selected = aws_delete.select_noncurrent(versions, min_size=10)
+    assert selected == []
+
+
+def test_markers_deleted_after_versions():
+    selected = aws_delete.select_noncurrent(deleted_key("a")) + aws_delete.select_noncurrent(deleted_key("b"))
+    client = FakeClient()
+    deleted, errors, kept = aws_delete.purge_versions(client, "bucket", selected, threads=4)
+    assert (deleted, errors, kept) == (6, [], 0)
+    assert all(version_id != "m" for _, version_id in client.calls[0])
+    assert sorted(client.calls[1]) == [("a", "m"), ("b", "m")]
+
+
+def test_marker_kept_when_a_version_delete_fails():
+    selected = aws_delete.select_noncurrent(deleted_key("a")) + aws_delete.select_noncurrent(deleted_key("b"))
+    client = FakeClient(failing={("a", "v1")})
+    deleted, errors, kept = aws_delete.purge_versions(client, "bucket", selected, threads=4)
+    assert (deleted, len(errors), kept) == (4, 1, 1)
+    assert client.calls[-1] == [("b", "m")]
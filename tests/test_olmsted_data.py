@@ -0,0 +1,48 @@
+"""Regression tests for bin/olmsted_data.py's streaming JSON reader.
+
+Run with `python -m pytest tests/test_olmsted_data.py`.
+"""
+
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+import olmsted_data  # noqa: E402
+
+DOCUMENTS = [
+    [0.1, 2],
+    [-2.5e-07, 1],
+    {"a": 12.5e3, "b": [1e10, -0.0, 123456789]},
+    {"clones": {"d": [{"mutation_freq": 0.015625, "unique_seqs_count": 12}]}},
+]
+
+
+def read_all(text, read_size):
+    stream = olmsted_data.JSONStream(io.StringIO(text), read_size=read_size)
+    if stream.peek() == "[":
+        value = list(stream.iter_array())
+    else:
+        value = {}
+        for key in stream.iter_object():
+            value[key] = stream.read_value()
+    stream.finish()
+    return value
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_numbers_split_across_chunks(document):
+    # Every read size puts the chunk boundary inside some number, e.g.
+    # "0." | "1" or "-2.5e" | "-07".
+    text = json.dumps(document)
+    for read_size in range(1, len(text) + 1):
+        assert read_all(text, read_size) == document
+
+
+def test_truncated_number_is_an_error():
+    with pytest.raises(olmsted_data.ConsolidatedFormatError):
+        read_all('{"a": 1.', 2)
@@ -0,0 +1,79 @@
+"""Tests for the streaming tree diff in bin/olmsted_diff.py."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+import olmsted_diff  # noqa: E402
+import olmsted_hashes  # noqa: E402
+import olmsted_storage  # noqa: E402
+
+
+def write_tree(root, files):
+    for key, body in files.items():
+        path = os.path.join(root, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as handle:
+            handle.write(body)
+
+
+def upload(root, files):
+    """A file:// bucket at `root` holding `files`, with S3-style ETags."""
+    client = olmsted_storage.LocalS3Client(root)
+    for key, body in files.items():
+        client.put_object(Bucket="bucket", Key=key, Body=body)
+    return client
+
+
+def run(left, right, tmp_path):
+    cache = olmsted_hashes.HashCache(str(tmp_path / "hash-cache.json"))
+    return {key: (status, reason) for status, key, reason, _, _ in olmsted_diff.diff(left, right, cache)}
+
+
+LEFT = {"data/a.json": b"same", "data/b.json": b"left", "data/c.json": b"1234", "data/only-left.json": b"x"}
+RIGHT = {"data/a.json": b"same", "data/b.json": b"right", "data/c.json": b"5678", "data/z/only-right.json": b"y"}
+EXPECTED = {
+    "a.json": (olmsted_diff.IDENTICAL, None),
+    "b.json": (olmsted_diff.CHANGED, "size"),
+    "c.json": (olmsted_diff.CHANGED, "content"),
+    "only-left.json": (olmsted_diff.ONLY_LEFT, None),
+    "z/only-right.json": (olmsted_diff.ONLY_RIGHT, None),
+}
+
+
+def test_merge_join():
+    left = [("a", 1), ("b", 1), ("d", 1)]
+    right = [("b", 2), ("c", 2), ("e", 2)]
+    rows = [(key, a is not None, b is not None) for key, a, b in olmsted_diff.merge_join(left, right)]
+    assert rows == [("a", True, False), ("b", True, True), ("c", False, True), ("d", True, False), ("e", False, True)]
+
+
+def test_local_trees(tmp_path):
+    write_tree(tmp_path / "left", LEFT)
+    write_tree(tmp_path / "right", RIGHT)
+    left = olmsted_diff.Source(str(tmp_path / "left" / "data"), None)
+    right = olmsted_diff.Source(str(tmp_path / "right" / "data"), None)
+    assert run(left, right, tmp_path) == EXPECTED
+
+
+@pytest.mark.parametrize("prefix", ["data", "data/"])
+def test_bucket_prefix_with_and_without_slash(tmp_path, prefix):
+    write_tree(tmp_path / "left", LEFT)
+    client = upload(str(tmp_path / "bucket"), RIGHT)
+    left = olmsted_diff.Source(str(tmp_path / "left" / "data"), None)
+    right = olmsted_diff.Source(f"s3://bucket/{prefix}", lambda: client)
+    assert run(left, right, tmp_path) == EXPECTED
+    assert right.full_key("a.json") == "data/a.json"
+
+
+def test_plain_md5_etag_matches_large_local_file(tmp_path):
+    # A server-side copy leaves a plain-MD5 ETag even on a multipart-sized object.
+    body = os.urandom(olmsted_hashes.S3_MULTIPART_CHUNKSIZE + 1)
+    write_tree(tmp_path / "left", {"big.bin": body})
+    client = upload(str(tmp_path / "bucket"), {"big.bin": body})
+    left = olmsted_diff.Source(str(tmp_path / "left"), None)
+    right = olmsted_diff.Source("s3://bucket", lambda: client)
+    assert run(left, right, tmp_path) == {"big.bin": (olmsted_diff.IDENTICAL, None)}
@@ -0,0 +1,68 @@
+"""Tests for prefix pushdown in bin/olmsted_filters.py."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+import olmsted_filters  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "pattern, prefixes",
+    [
+        (r"^data/consolidated/foo.*\.json\.gz$", ["data/consolidated/foo"]),
+        (r"\Adata/x", ["data/x"]),
+        (r"^data/(summaries|shards)/", ["data/summaries/", "data/shards/"]),
+        (r"^data/[ab]_", ["data/a_", "data/b_"]),
+        # Unanchored, or ^ matching after any newline: no prefix.
+        (r"data/", [""]),
+        (r"(?m)^data/", [""]),
+        # Optional and repeated items end the prefix.
+        (r"^d?x", [""]),
+        (r"^(ab)+c", ["ab"]),
+    ],
+)
+def test_regex_prefixes(pattern, prefixes):
+    assert olmsted_filters.regex_prefixes(pattern) == prefixes
+
+
+def test_regex_prefixes_truncated_at_limit():
+    # 16 spellings fit the limit; at 4 the prefix stops before the third
+    # character class.
+    pattern = r"^[ab][cd][ef][gh]x"
+    assert len(olmsted_filters.regex_prefixes(pattern)) == 16
+    assert olmsted_filters.regex_prefixes(pattern, limit=4) == ["ac", "ad", "bc", "bd"]
+    # Too many alternatives at one position: no prefix at all.
+    assert olmsted_filters.regex_prefixes("^(" + "|".join("abcdefghijklmnopq") + ")z", limit=16) == [""]
+
+
+def test_caseless_prefixes():
+    assert olmsted_filters.caseless_prefixes(["2024/Data/", "2024/x"]) == ["2024/"]
+    assert olmsted_filters.caseless_prefixes(["2024/01/", "2025/"]) == ["2024/01/", "2025/"]
+    assert olmsted_filters.caseless_prefixes(["data/", "2024/"]) == [""]
+
+
+@pytest.mark.parametrize(
+    "prefix, pattern, case_sensitive, expected",
+    [
+        ("", "^data/c", True, ["data/c"]),
+        # Case-insensitive by default: Data/c... matches too.
+        ("", "^data/c", False, [""]),
+        ("", "(?i)^data/c", True, [""]),
+        ("", "^2024/c", False, ["2024/"]),
+        ("data/", "^data/(summaries|shards)/", True, ["data/shards/", "data/summaries/"]),
+        # --prefix and the regex can't both hold.
+        ("releases/", "^data/", True, []),
+    ],
+)
+def test_list_prefixes(prefix, pattern, case_sensitive, expected):
+    key_filter = olmsted_filters.KeyFilter(prefix, pattern, True, case_sensitive=case_sensitive)
+    assert key_filter.list_prefixes() == expected
+
+
+def test_list_prefixes_with_globs():
+    key_filter = olmsted_filters.KeyFilter("", includes=["data/*.json.gz", "releases/*"])
+    assert key_filter.list_prefixes() == ["data/", "releases/"]
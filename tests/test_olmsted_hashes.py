@@ -0,0 +1,59 @@
+"""Tests for S3 ETag computation in bin/olmsted_hashes.py."""
+
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+import olmsted_hashes  # noqa: E402
+
+PART = 1024  # small part size so the boundaries are cheap to test
+
+
+def expected_etag(data, part_size):
+    """The ETag S3 gives a boto3 upload, spelled out independently."""
+    if len(data) < part_size:
+        return hashlib.md5(data).hexdigest()
+    parts = [data[i : i + part_size] for i in range(0, len(data), part_size)]
+    return hashlib.md5(b"".join(hashlib.md5(p).digest() for p in parts)).hexdigest() + f"-{len(parts)}"
+
+
+@pytest.mark.parametrize("size", [0, 1, PART - 1, PART, PART + 1, 2 * PART - 1, 2 * PART, 2 * PART + 1, 5 * PART + 7])
+def test_etag_around_part_boundaries(tmp_path, size):
+    data = os.urandom(size)
+    path = tmp_path / "file"
+    path.write_bytes(data)
+    digests = olmsted_hashes.compute_digests(str(path), part_size=PART)
+    assert digests["md5"] == hashlib.md5(data).hexdigest()
+    assert digests["sha256"] == hashlib.sha256(data).hexdigest()
+    assert digests["etag"] == expected_etag(data, PART)
+    assert ("-" in digests["etag"]) == (size >= PART)
+
+
+def test_etag_matches(tmp_path):
+    data = os.urandom(3 * PART)
+    path = tmp_path / "file"
+    path.write_bytes(data)
+    digests = olmsted_hashes.compute_digests(str(path), part_size=PART)
+    md5 = hashlib.md5(data).hexdigest()
+    assert olmsted_hashes.etag_matches(digests, digests["etag"])
+    # A server-side copy (or single PUT) has the plain MD5 as ETag.
+    assert olmsted_hashes.etag_matches(digests, md5)
+    # Another part size gives another multipart ETag.
+    assert not olmsted_hashes.etag_matches(digests, expected_etag(data, 2 * PART))
+    # The plain-MD5 fallback never applies to a multipart ETag.
+    assert not olmsted_hashes.etag_matches(digests, md5 + "-3")
+    assert not olmsted_hashes.etag_matches(digests, hashlib.md5(b"other").hexdigest())
+
+
+def test_hash_cache_rehashes_changed_file(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"one")
+    cache = olmsted_hashes.HashCache(str(tmp_path / "cache.json"), part_size=PART)
+    first = cache.get(str(path))
+    assert cache.get(str(path)) == first and cache.hits == 1
+    path.write_bytes(b"three")
+    assert cache.get(str(path))["md5"] == hashlib.md5(b"three").hexdigest()
@@ -0,0 +1,53 @@
+"""Tests for the release history in bin/olmsted_releases.py, against a
+file:// target."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+import olmsted_releases  # noqa: E402
+import olmsted_storage  # noqa: E402
+
+
+def release(client, bucket, state, release_id):
+    client.put_object(
+        Bucket=bucket,
+        Key=olmsted_releases.release_prefix(release_id) + "index.html",
+        Body=b"<html><head></head><body></body></html>",
+        ContentType="text/html",
+    )
+    state["releases"].append({"id": release_id, "created": "", "top_level": ["index.html"]})
+    olmsted_releases.activate(client, bucket, state, release_id, ["index.html"])
+
+
+def test_rollback_after_rollback_and_new_release(tmp_path):
+    client, bucket = olmsted_storage.connect(f"file://{tmp_path}", None)
+    state = olmsted_releases.load_state(client, bucket)
+    release(client, bucket, state, "R1")
+    release(client, bucket, state, "R2")
+    # R2 is bad: roll back to R1, then release R3.
+    assert olmsted_releases.previous_release_id(state) == "R1"
+    olmsted_releases.activate(client, bucket, state, "R1", ["index.html"])
+    release(client, bucket, state, "R3")
+
+    state = olmsted_releases.load_state(client, bucket)
+    assert state["active"] == "R3"
+    assert olmsted_releases.previous_release_id(state) == "R1"
+
+
+def test_prune_keeps_the_rollback_target(tmp_path):
+    client, bucket = olmsted_storage.connect(f"file://{tmp_path}", None)
+    state = olmsted_releases.load_state(client, bucket)
+    release(client, bucket, state, "R1")
+    release(client, bucket, state, "R2")
+    olmsted_releases.activate(client, bucket, state, "R1", ["index.html"])
+    release(client, bucket, state, "R3")
+
+    assert olmsted_releases.prune(client, bucket, state, keep=1) == ["R2"]
+    assert [r["id"] for r in state["releases"]] == ["R1", "R3"]
+
+
+def test_previous_falls_back_to_list_order():
+    state = {"active": "R2", "releases": [{"id": "R1"}, {"id": "R2"}]}
+    assert olmsted_releases.previous_release_id(state) == "R1"
@@ -0,0 +1,107 @@
+"""Tests for hedged requests in bin/olmsted_transfer.py."""
+
+import itertools
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+import olmsted_transfer  # noqa: E402
+
+MIN_DELAY = 0.05
+
+
+def attempts(*behaviours):
+    """A callable whose n-th call follows behaviours[n]: (seconds, result),
+    raising `result` if it is an exception."""
+    counter = itertools.count()
+    lock = threading.Lock()
+    calls = []
+
+    def fn():
+        with lock:
+            n = next(counter)
+        calls.append(n)
+        seconds, result = behaviours[n]
+        time.sleep(seconds)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    fn.calls = calls
+    return fn
+
+
+def warmed_hedger(samples=5):
+    """A hedger that has seen `samples` instant GETs, so it hedges any GET
+    still running after MIN_DELAY."""
+    hedger = olmsted_transfer.Hedger(percentile=95, max_size=100, min_samples=samples, min_delay=MIN_DELAY)
+    for _ in range(samples):
+        assert hedger.delay("GET") is None
+        hedger.call("GET", 1, lambda: "ok")
+    time.sleep(0.05)  # primaries record their latency from a done callback
+    return hedger
+
+
+def test_no_hedging_until_enough_samples():
+    hedger = olmsted_transfer.Hedger(min_samples=3, min_delay=MIN_DELAY)
+    fn = attempts((0.2, "slow"), (0, "fast"))
+    assert hedger.call("GET", 1, fn) == "slow"
+    assert fn.calls == [0] and hedger.fired == 0
+
+
+def test_delay_threshold():
+    hedger = warmed_hedger()
+    assert hedger.delay("GET") == pytest.approx(MIN_DELAY)
+    assert hedger.delay("PUT") is None
+
+
+def test_fast_request_is_not_hedged():
+    hedger = warmed_hedger()
+    fn = attempts((0, "primary"), (0, "hedge"))
+    assert hedger.call("GET", 1, fn) == "primary"
+    assert fn.calls == [0] and hedger.fired == 0
+
+
+def test_slow_request_is_hedged_and_first_result_wins():
+    hedger = warmed_hedger()
+    fn = attempts((0.5, "primary"), (0, "hedge"))
+    started = time.monotonic()
+    assert hedger.call("GET", 1, fn) == "hedge"
+    assert time.monotonic() - started < 0.3
+    assert (hedger.fired, hedger.won) == (1, 1)
+
+
+def test_losing_attempt_error_is_swallowed():
+    hedger = warmed_hedger()
+    fn = attempts((0.2, "primary"), (0, OSError("hedge failed")))
+    assert hedger.call("GET", 1, fn) == "primary"
+    assert (hedger.fired, hedger.won) == (1, 0)
+
+
+def test_error_raised_when_every_attempt_fails():
+    hedger = warmed_hedger()
+    fn = attempts((0.2, OSError("primary failed")), (0, OSError("hedge failed")))
+    with pytest.raises(OSError):
+        hedger.call("GET", 1, fn)
+
+
+def test_large_objects_are_not_hedged():
+    hedger = warmed_hedger()
+    fn = attempts((0.2, "primary"), (0, "hedge"))
+    assert hedger.call("GET", 101, fn) == "primary"
+    assert fn.calls == [0] and hedger.fired == 0
+
+
+def test_report():
+    hedger = warmed_hedger()
+    hedger.call("GET", 1, attempts((0.5, "primary"), (0, "hedge")))
+    time.sleep(0.6)  # let the original request finish
+    assert hedger.requests == 6
+    actual, unhedged = hedger.latencies()
+    assert max(actual) < 0.3 and max(unhedged) >= 0.5
+    assert "1 hedge(s) fired, 1 won" in hedger.report()